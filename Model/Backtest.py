@@ -0,0 +1,289 @@
+import copy
+import sys
+import time
+import tracemalloc
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from Model.Ensemble import Detector
+from Model.Evaluation import average_precision, threshold_curve
+from Model.Preprocessing import DATETIME_FORMAT, TransactionPreprocessor
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, where max_rss_mb is not recorded
+    resource = None
+
+
+def max_rss_mb() -> float:
+    """
+    Gets the peak resident memory of the current process and of its terminated child processes (e.g. the workers of a process pool) over
+    their lifetime, so it only grows: it is a measure of a whole run, not of the last step.
+
+    :return: Float representing the peak resident memory in MiB, NaN if it cannot be measured
+    """
+    if resource is None:
+        return float('nan')
+    max_rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+    # bytes on macOS, KiB elsewhere
+    return max_rss / 2 ** 20 if sys.platform == 'darwin' else max_rss / 2 ** 10
+
+
+def single_threaded(detector: Detector) -> Detector:
+    """
+    Limits a detector to one thread, e.g. before running it in one of several worker processes, which would otherwise each start one
+    thread or process per CPU (the detectors of Models.py default to n_jobs=-1). Sets the n_jobs of the detector, of the sklearn model
+    it wraps and of the members of an EnsembleScorer.
+
+    :param detector: Unfitted or fitted detector
+    :return: The same detector
+    """
+    if hasattr(detector, 'n_jobs'):
+        detector.n_jobs = 1
+    model = getattr(detector, 'model', None)
+    if hasattr(model, 'get_params') and 'n_jobs' in model.get_params():
+        model.set_params(n_jobs=1)
+    for member in getattr(detector, 'detectors', {}).values():
+        single_threaded(member)
+
+    return detector
+
+
+def run_window(detector: Detector, train_features: np.ndarray, test_features: np.ndarray, test_labels: np.ndarray,
+               warm_start_trees: Optional[int] = None, trace_memory: bool = False) -> Tuple[Detector, Dict[str, float]]:
+    """
+    Trains a detector on one window and scores the next one, recording the metrics and the cost. Module level, so it can run in worker
+    processes.
+
+    :param detector: Detector to train, already fitted when warm_start_trees is set.
+    :param train_features: Numpy array representing the features of the training window
+    :param test_features: Numpy array representing the features of the test window
+    :param test_labels: Numpy array representing the true classes of the test window where 0 is non-fraud and 1 is fraud.
+    :param warm_start_trees: Integer representing the number of trees added to the fitted detector (see IsolationForest.add_trees)
+                             instead of fitting it from scratch, None to fit it.
+    :param trace_memory: Boolean representing whether the peak memory allocated by fitting and scoring is traced with tracemalloc, which
+                         slows allocations down several times.
+    :return: Tuple of the trained detector and the dict of metrics
+    """
+    if trace_memory:
+        tracemalloc.start()
+
+    start = time.perf_counter()
+    if warm_start_trees is not None:
+        detector.add_trees(train_features, warm_start_trees)
+    else:
+        detector.fit(train_features)
+    fit_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    scores = np.asarray(detector.score(test_features))
+    predictions = np.asarray(detector.predict(test_features))
+    score_time = time.perf_counter() - start
+
+    peak_memory = float('nan')
+    if trace_memory:
+        peak_memory = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+
+    metrics = {'fit_seconds': fit_time, 'score_seconds': score_time, 'peak_memory_mb': peak_memory,
+               'auroc': float('nan'), 'average_precision': float('nan'), 'precision': float('nan'), 'recall': float('nan')}
+    num_fraud = int(np.sum(test_labels == 1))
+    if 0 < num_fraud < len(test_labels):
+        curve, metrics['auroc'] = threshold_curve(scores, test_labels)
+        metrics['average_precision'] = average_precision(curve)
+        metrics['recall'] = float(np.mean(predictions[test_labels == 1] == 1))
+    if np.any(predictions == 1):
+        metrics['precision'] = float(np.mean(test_labels[predictions == 1] == 1))
+
+    return detector, metrics
+
+
+class Backtester:
+    """
+    Backtester object
+
+    Walk-forward backtest over transactions spread across time (e.g. the 5 years of Dataset/models.py): the data is cut into periods, a
+    detector is trained on a window of periods and scores the next period, then the window slides by one period.
+
+    - Preprocessing is cached: unless refit_preprocessor is set, the TransactionPreprocessor is fitted on the first training window only
+      (never on later data) and the features of every period are computed once and reused by all the windows that contain it.
+    - Models can be warm-started: with warm_start, each window's detector is the previous one grown with trees built on the newest
+      training period (see IsolationForest.add_trees) instead of a new fit. Windows then depend on each other and run in sequence.
+    - Without warm_start, windows are independent and run in parallel over n_jobs processes. Detectors are then limited to one thread
+      each (see single_threaded), so the processes do not oversubscribe the CPUs.
+    - The training and test arrays of a window are built only when it runs, so memory holds the cached period features plus the windows
+      in flight (one, or at most 2 * n_jobs in parallel), even with expanding windows (train_periods=None).
+
+    Per window, the test metrics (AUROC, average precision, precision and recall of predict) and the cost (fit and score wall-clock time
+    and, with trace_memory, peak memory allocated) are recorded. The peak resident memory is recorded once for the whole run.
+    """
+
+    TIME_COLUMN = 'Payment Creation Date and Time'
+
+    def __init__(self, make_detector: Callable[[], Detector], period: str = '90D', train_periods: Optional[int] = 4,
+                 train_on_normal: bool = True, refit_preprocessor: bool = False, warm_start: bool = False, warm_start_trees: int = 20,
+                 preprocessor_params: Optional[dict] = None, n_jobs: int = 1, trace_memory: bool = False):
+        """
+        Initialises the Backtester object.
+
+        :param make_detector: Function returning a new unfitted detector, picklable (e.g. functools.partial of a class) when n_jobs > 1.
+        :param period: String representing the length of a period as a pandas offset, e.g. '90D'.
+        :param train_periods: Integer representing the number of periods in a training window, all the previous periods if None.
+        :param train_on_normal: Boolean representing whether detectors are trained on the non-fraud rows only, as in test.py.
+        :param refit_preprocessor: Boolean representing whether the preprocessor is refitted on each training window.
+        :param warm_start: Boolean representing whether each window's detector grows the previous one rather than being fitted anew. Needs
+                           the frozen preprocessor, as refitting it changes the feature space the previous trees were built on.
+        :param warm_start_trees: Integer representing the number of trees added per window with warm_start.
+        :param preprocessor_params: Dict representing the keyword arguments of the TransactionPreprocessor.
+        :param n_jobs: Integer representing the number of processes running independent windows, each detector running on one thread
+                       when it is above 1.
+        :param trace_memory: Boolean representing whether the peak memory allocated by each window is traced (see run_window).
+        """
+        if warm_start and refit_preprocessor:
+            raise ValueError("warm_start needs a frozen preprocessor, refit_preprocessor changes the features between windows")
+
+        self.make_detector = make_detector
+        self.period = pd.Timedelta(period)
+        self.train_periods = train_periods
+        self.train_on_normal = train_on_normal
+        self.refit_preprocessor = refit_preprocessor
+        self.warm_start = warm_start
+        self.warm_start_trees = warm_start_trees
+        self.preprocessor_params = preprocessor_params or {}
+        self.n_jobs = n_jobs
+        self.trace_memory = trace_memory
+
+    def assign_periods(self, data: pd.DataFrame) -> np.ndarray:
+        """
+        Gets the period of each transaction, counted from the earliest one. Transactions without a creation time get -1.
+
+        :param data: DataFrame representing transactions in the simulated schema
+        :return: Numpy array of periods
+        """
+        times = pd.to_datetime(data[self.TIME_COLUMN], format=DATETIME_FORMAT, errors='coerce')
+        periods = ((times - times.min()) // self.period).to_numpy(dtype=np.float64)
+
+        return np.nan_to_num(periods, nan=-1).astype(np.int64)
+
+    def windows(self, num_periods: int) -> List[Tuple[List[int], int]]:
+        """
+        Gets the training periods and the test period of each window.
+
+        :param num_periods: Integer representing the number of periods
+        :return: List of tuples of the training periods and the test period
+        """
+        first_test = self.train_periods if self.train_periods is not None else 1
+        windows = []
+        for test_period in range(first_test, num_periods):
+            first_train = max(0, test_period - self.train_periods) if self.train_periods is not None else 0
+            windows.append((list(range(first_train, test_period)), test_period))
+
+        return windows
+
+    def run(self, data: pd.DataFrame, label_column: str = 'Behaviour ID') -> pd.DataFrame:
+        """
+        Runs the backtest.
+
+        :param data: DataFrame representing labelled transactions in the simulated schema
+        :param label_column: String representing the label column, any non-zero behaviour is fraud.
+        :return: DataFrame with one row per window: its periods, sizes, test metrics and cost, and the preprocessing time and peak
+                 resident memory of the run in attrs
+        """
+        start = time.perf_counter()
+        periods = self.assign_periods(data)
+        labels = (data[label_column] != 0).astype(int).to_numpy()
+        transactions = data.drop(label_column, axis=1)
+        rows = {period: np.flatnonzero(periods == period) for period in range(periods.max() + 1)}
+        windows = self.windows(periods.max() + 1)
+        if not windows:
+            raise ValueError("Not enough periods in the data for a single window")
+
+        # features of each period, computed once with the preprocessor of the first training window unless refit_preprocessor is set
+        cache: Dict[int, np.ndarray] = {}
+        preprocessor = None
+
+        def training_mask(train: List[int]) -> np.ndarray:
+            train_labels = np.concatenate([labels[rows[period]] for period in train])
+            return train_labels == 0 if self.train_on_normal else np.ones(len(train_labels), dtype=bool)
+
+        def training_rows(train: List[int]) -> np.ndarray:
+            return np.concatenate([rows[period] for period in train])[training_mask(train)]
+
+        def features(period_list: List[int], fitted: TransactionPreprocessor) -> np.ndarray:
+            if self.refit_preprocessor:
+                indices = np.concatenate([rows[period] for period in period_list])
+                return fitted.transform(transactions.iloc[indices]).to_numpy()
+            for period in period_list:
+                if period not in cache:
+                    cache[period] = fitted.transform(transactions.iloc[rows[period]]).to_numpy()
+            return np.concatenate([cache[period] for period in period_list])
+
+        def window_tasks():
+            # arrays of one window at a time, built when it is run so only the windows in flight are held in memory
+            nonlocal preprocessor, preprocessing_time
+            for index, (train, test) in enumerate(windows):
+                window_start = time.perf_counter()
+                if preprocessor is None or self.refit_preprocessor:
+                    preprocessor = TransactionPreprocessor(**self.preprocessor_params)
+                    preprocessor.fit(transactions.iloc[training_rows(train)])
+                if self.warm_start and index > 0:
+                    # only the newest training period is new to a warm-started detector
+                    train_features = features([train[-1]], preprocessor)[training_mask([train[-1]])]
+                else:
+                    train_features = features(train, preprocessor)[training_mask(train)]
+                task = (train_features, features([test], preprocessor), labels[rows[test]])
+                preprocessing_time += time.perf_counter() - window_start
+                yield task
+
+        preprocessing_time = time.perf_counter() - start
+        results = []
+        if self.warm_start:
+            detector = None
+            for task in window_tasks():
+                if detector is None:
+                    detector, metrics = run_window(self.make_detector(), *task, trace_memory=self.trace_memory)
+                else:
+                    detector, metrics = run_window(copy.deepcopy(detector), *task, self.warm_start_trees, self.trace_memory)
+                results.append(metrics)
+        elif self.n_jobs > 1:
+            # at most 2 * n_jobs windows submitted and not yet collected, so workers stay busy while the next window is built
+            pending = deque()
+            with ProcessPoolExecutor(max_workers=self.n_jobs) as executor:
+                for task in window_tasks():
+                    pending.append(executor.submit(run_window, single_threaded(self.make_detector()), *task, trace_memory=self.trace_memory))
+                    if len(pending) >= 2 * self.n_jobs:
+                        results.append(pending.popleft().result()[1])
+                while pending:
+                    results.append(pending.popleft().result()[1])
+        else:
+            results = [run_window(self.make_detector(), *task, trace_memory=self.trace_memory)[1] for task in window_tasks()]
+
+        report = []
+        for (train, test), metrics in zip(windows, results):
+            report.append({'train_periods': f"{train[0]}-{train[-1]}", 'test_period': test, 'num_train': int(training_mask(train).sum()),
+                           'num_test': len(rows[test]), 'num_fraud': int(labels[rows[test]].sum()), **metrics})
+        report = pd.DataFrame(report)
+        report.attrs['preprocessing_seconds'] = preprocessing_time
+        report.attrs['max_rss_mb'] = max_rss_mb()
+
+        return report
+
+
+if __name__ == '__main__':
+    from Model.Models import IsolationForest
+
+    data_path = 'Dataset/data/df_simulated.csv'
+    df = pd.read_csv(data_path)
+
+    # windows run in 4 processes, single_threaded sets the detectors' n_jobs to 1
+    backtester = Backtester(partial(IsolationForest, None, n_estimators=100, random_state=0), period='180D', train_periods=2, n_jobs=4)
+    results = backtester.run(df)
+    print(results.to_string())
+    print(f"Preprocessing: {results.attrs['preprocessing_seconds']:.2f}s, peak resident memory: {results.attrs['max_rss_mb']:.0f} MiB")
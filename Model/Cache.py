@@ -0,0 +1,176 @@
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+# multipliers of the row hash (splitmix64 and a large odd constant), arithmetic is modulo 2^64
+SPLITMIX_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+SPLITMIX_MULTIPLIERS = (np.uint64(0xBF58476D1CE4E5B9), np.uint64(0x94D049BB133111EB))
+ROW_MULTIPLIER = np.uint64(0x100000001B3)
+
+
+def hash_rows(data) -> np.ndarray:
+    """
+    Hashes each row of a numeric feature matrix into a 64-bit key, vectorised over rows: the bits of every value are mixed (splitmix64) and
+    combined column by column. Rows with equal values get equal keys (0.0 and -0.0, and all NaNs, are treated as equal); distinct rows
+    collide with probability about 2^-64 per pair.
+
+    :param data: DataFrame or Numpy array representing numeric features
+    :return: Numpy array of uint64 keys
+    """
+    values = np.asarray(data, dtype=np.float64)
+    if values.ndim == 1:
+        values = values[:, None]
+    # adding 0.0 turns -0.0 into 0.0
+    values = np.where(np.isnan(values), np.nan, values + 0.0)
+    bits = np.ascontiguousarray(values).view(np.uint64)
+
+    with np.errstate(over='ignore'):
+        keys = np.full(len(bits), np.uint64(len(bits[0]) if len(bits) else 0))
+        for column in range(bits.shape[1]):
+            mixed = bits[:, column] + SPLITMIX_GAMMA * np.uint64(column + 1)
+            mixed = (mixed ^ (mixed >> np.uint64(30))) * SPLITMIX_MULTIPLIERS[0]
+            mixed = (mixed ^ (mixed >> np.uint64(27))) * SPLITMIX_MULTIPLIERS[1]
+            mixed ^= mixed >> np.uint64(31)
+            keys = (keys ^ mixed) * ROW_MULTIPLIER
+
+    return keys
+
+
+class ScoringCache:
+    """
+    ScoringCache object
+
+    Sits in front of a detector (see Ensemble.Detector, or any model with a method taking a feature batch, e.g. sklearn's score_samples) and
+    evaluates each distinct feature row only once: rows are hashed (hash_rows), duplicates within a batch are collapsed, rows seen in
+    earlier batches are read from a bounded LRU cache, and only the remaining distinct rows are passed to the detector, in one call.
+    Results are cached separately for each method, in arrays of the detector's result dtype sorted by key, so lookups, inserts and
+    evictions are vectorised over the batch. Recency is tracked per batch: when the cache is full, the entries last used by the oldest
+    batches are evicted first.
+
+    When the detector only reads some of the columns (e.g. the feature_columns of OneClassSVM.AnomalyDetection), only those should be
+    hashed, so rows differing elsewhere share their cached result. The detector is still passed the full rows.
+
+    The detector must be deterministic and must not be refitted while the cache is in use (see clear).
+    """
+
+    def __init__(self, detector, max_entries: int = 1000000, columns: Optional[Union[slice, List[int]]] = None):
+        """
+        Initialises the ScoringCache object.
+
+        :param detector: Fitted detector.
+        :param max_entries: Integer representing the maximum number of cached results per method, least recently used are evicted first.
+        :param columns: Slice or list representing the positions of the columns the detector reads, hashed as the row key, all if None.
+        """
+        self.detector = detector
+        self.max_entries = max_entries
+        self.columns = columns
+        self.clear()
+
+    def clear(self) -> None:
+        """
+        Empties the cache and resets the statistics, e.g. after the detector is refitted.
+
+        :return: None
+        """
+        # per method: sorted keys, their results and the number of the batch that last used them
+        self.caches: Dict[str, Dict[str, np.ndarray]] = {}
+        self.num_batches = 0
+        self.num_rows = 0
+        self.num_hits = 0
+        self.num_batch_duplicates = 0
+        self.num_evaluated = 0
+        self.num_evictions = 0
+
+    def call(self, method: str, data) -> np.ndarray:
+        """
+        Calls a method of the detector on a batch through the cache.
+
+        :param method: String representing the method, e.g. 'score' or 'predict'.
+        :param data: DataFrame or Numpy array representing numeric features
+        :return: Numpy array of the results of each row, as returned by the detector
+        """
+        self.num_batches += 1
+        keys = hash_rows(self.key_columns(data))
+        unique_keys, first_rows, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        self.num_rows += len(keys)
+        self.num_batch_duplicates += len(keys) - len(unique_keys)
+
+        cache = self.caches.get(method)
+        if cache is not None and len(cache['keys']):
+            positions = np.minimum(np.searchsorted(cache['keys'], unique_keys), len(cache['keys']) - 1)
+            hits = cache['keys'][positions] == unique_keys
+            cache['used'][positions[hits]] = self.num_batches
+            unique_results = cache['values'][positions]
+        else:
+            hits = np.zeros(len(unique_keys), dtype=bool)
+            unique_results = None
+        missing = np.flatnonzero(~hits)
+        self.num_hits += len(unique_keys) - len(missing)
+
+        if len(missing):
+            rows = first_rows[missing]
+            batch = data.iloc[rows] if isinstance(data, pd.DataFrame) else np.asarray(data)[rows]
+            results = np.asarray(getattr(self.detector, method)(batch))
+            self.num_evaluated += len(missing)
+            if unique_results is None:
+                unique_results = np.empty((len(unique_keys),) + results.shape[1:], dtype=results.dtype)
+            unique_results[missing] = results
+            self.insert(method, unique_keys[missing], results)
+
+        return unique_results[inverse.ravel()]
+
+    def key_columns(self, data):
+        if self.columns is None:
+            return data
+        return data.iloc[:, self.columns] if isinstance(data, pd.DataFrame) else np.asarray(data)[:, self.columns]
+
+    def insert(self, method: str, keys: np.ndarray, values: np.ndarray) -> None:
+        """
+        Adds new results to the cache of a method, evicting the least recently used entries beyond max_entries.
+
+        :param method: String representing the method
+        :param keys: Numpy array representing the keys, not already cached
+        :param values: Numpy array representing the results of the keys
+        :return: None
+        """
+        cache = self.caches.get(method)
+        used = np.full(len(keys), self.num_batches, dtype=np.int64)
+        if cache is not None:
+            keys = np.concatenate([cache['keys'], keys])
+            values = np.concatenate([cache['values'], values])
+            used = np.concatenate([cache['used'], used])
+
+        if len(keys) > self.max_entries:
+            kept = np.argpartition(-used, self.max_entries - 1)[:self.max_entries] if self.max_entries > 0 else []
+            self.num_evictions += len(keys) - self.max_entries
+            keys, values, used = keys[kept], values[kept], used[kept]
+
+        order = np.argsort(keys, kind='stable')
+        self.caches[method] = {'keys': keys[order], 'values': values[order], 'used': used[order]}
+
+    def score(self, data) -> np.ndarray:
+        return self.call('score', data)
+
+    def predict(self, data) -> np.ndarray:
+        return self.call('predict', data)
+
+    @property
+    def hit_rate(self) -> float:
+        """
+        Gets the proportion of rows that were not evaluated by the detector, duplicates within a batch or cache hits.
+
+        :return: Float representing the hit rate
+        """
+        return 1 - self.num_evaluated / self.num_rows if self.num_rows else 0.0
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Gets the cache statistics.
+
+        :return: Dict with the number of rows seen, of duplicates within batches, of distinct rows found in the cache, of rows evaluated by
+                 the detector and of evicted entries, the number of cached entries and the hit rate
+        """
+        return {'rows': self.num_rows, 'batch_duplicates': self.num_batch_duplicates, 'cache_hits': self.num_hits,
+                'evaluated': self.num_evaluated, 'evictions': self.num_evictions,
+                'entries': sum(len(cache['keys']) for cache in self.caches.values()), 'hit_rate': self.hit_rate}
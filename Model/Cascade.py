@@ -0,0 +1,158 @@
+import time
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from Model.Ensemble import Detector
+
+
+class CascadeScorer:
+    """
+    CascadeScorer object
+
+    Two-stage scoring: a cheap prefilter (e.g. Models.IsolationForest) scores every row and only the rows it finds suspicious, those with a
+    prefilter score at or above a cut, go to the expensive detector (e.g. OneClassSVM.AnomalyDetection, whose RBF decision function costs
+    one kernel evaluation per support vector). Rows below the cut are predicted non-fraud without being scored by the detector.
+
+    The cut is set on reference data, either as the top fraction of prefilter scores (fit) or as the highest cut losing at most
+    max_recall_loss of the detections of the detector alone (calibrate). evaluate measures the recall loss and the speedup on labelled data.
+    """
+
+    def __init__(self, prefilter: Detector, detector: Detector, fraction: float = 0.1, accept_fraction: Optional[float] = None):
+        """
+        Initialises the CascadeScorer object.
+
+        :param prefilter: Fitted cheap detector scoring every row.
+        :param detector: Fitted expensive detector scoring the suspicious rows.
+        :param fraction: Float representing the proportion of reference rows with the highest prefilter scores sent to the detector.
+        :param accept_fraction: Float representing the proportion of reference rows with the highest prefilter scores predicted fraud
+                                without the detector, so only the band between accept_fraction and fraction goes to the detector.
+                                None to send all suspicious rows to the detector.
+        """
+        self.prefilter = prefilter
+        self.detector = detector
+        self.fraction = fraction
+        self.accept_fraction = accept_fraction
+        # prefilter score cuts, set by fit or calibrate
+        self.threshold = None
+        self.accept_threshold = None
+
+    def fit(self, data) -> None:
+        """
+        Sets the prefilter cuts from the prefilter scores of reference data (typically the training data).
+
+        :param data: DataFrame or Numpy array representing preprocessed reference features
+        :return: None
+        """
+        scores = np.asarray(self.prefilter.score(data))
+        self.threshold = float(np.quantile(scores, 1 - self.fraction))
+        if self.accept_fraction is not None:
+            self.accept_threshold = float(np.quantile(scores, 1 - self.accept_fraction))
+
+    def calibrate(self, data, max_recall_loss: float = 0.01) -> float:
+        """
+        Sets the cut to the highest one that keeps at least 1 - max_recall_loss of the rows the detector alone flags on reference data,
+        which requires scoring the reference data with the detector once. No labels are needed.
+
+        :param data: DataFrame or Numpy array representing preprocessed reference features
+        :param max_recall_loss: Float representing the proportion of the detector's detections the cascade may miss.
+        :return: Float representing the resulting proportion of reference rows sent to the detector
+        """
+        scores = np.asarray(self.prefilter.score(data))
+        flagged = np.asarray(self.detector.predict(data)) == 1
+        if not flagged.any():
+            raise ValueError("The detector flags no reference rows, the cut cannot be calibrated")
+
+        self.threshold = float(np.quantile(scores[flagged], max_recall_loss, method='lower'))
+        self.accept_threshold = None
+        self.fraction = float(np.mean(scores >= self.threshold))
+
+        return self.fraction
+
+    def select(self, data) -> Dict[str, np.ndarray]:
+        """
+        Runs the prefilter and splits the rows between the stages.
+
+        :param data: DataFrame or Numpy array representing preprocessed features
+        :return: Dict with the prefilter scores and the indices of the rows 'forwarded' to the detector and of the rows 'accepted' as fraud
+        """
+        if self.threshold is None:
+            raise ValueError("CascadeScorer must be fitted or calibrated before scoring")
+
+        scores = np.asarray(self.prefilter.score(data))
+        suspicious = scores >= self.threshold
+        accepted = scores >= self.accept_threshold if self.accept_threshold is not None else np.zeros(len(scores), dtype=bool)
+
+        return {'prefilter_scores': scores, 'forwarded': np.flatnonzero(suspicious & ~accepted), 'accepted': np.flatnonzero(accepted)}
+
+    @staticmethod
+    def take(data, indices: np.ndarray):
+        return data.iloc[indices] if hasattr(data, 'iloc') else np.asarray(data)[indices]
+
+    def score(self, data) -> np.ndarray:
+        """
+        Computes the anomaly score of each row: the detector's score for forwarded rows, +inf for rows accepted as fraud and -inf for the
+        rows the prefilter let through.
+
+        :param data: DataFrame or Numpy array representing preprocessed features
+        :return: Numpy array of anomaly scores, higher is more anomalous
+        """
+        stages = self.select(data)
+        scores = np.full(len(stages['prefilter_scores']), -np.inf)
+        scores[stages['accepted']] = np.inf
+        if len(stages['forwarded']):
+            scores[stages['forwarded']] = self.detector.score(self.take(data, stages['forwarded']))
+
+        return scores
+
+    def predict(self, data) -> np.ndarray:
+        """
+        Predicts whether each row is fraud, running the detector on the forwarded rows only.
+
+        :param data: DataFrame or Numpy array representing preprocessed features
+        :return: Numpy array representing the predicted class where 0 is non-fraud and 1 is fraud.
+        """
+        return self.predict_with_stages(data)[0]
+
+    def predict_with_stages(self, data) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+        """
+        Predicts whether each row is fraud, as predict, also returning how the rows were split between the stages.
+
+        :param data: DataFrame or Numpy array representing preprocessed features
+        :return: Tuple of the Numpy array of predicted classes and the dict of the stages (see select)
+        """
+        stages = self.select(data)
+        predictions = np.zeros(len(stages['prefilter_scores']), dtype=int)
+        predictions[stages['accepted']] = 1
+        if len(stages['forwarded']):
+            predictions[stages['forwarded']] = self.detector.predict(self.take(data, stages['forwarded']))
+
+        return predictions, stages
+
+    def evaluate(self, data, labels: Optional[np.ndarray] = None) -> Dict[str, float]:
+        """
+        Compares the cascade with the detector alone on the same rows.
+
+        :param data: DataFrame or Numpy array representing preprocessed features
+        :param labels: Numpy array representing the true classes where 0 is non-fraud and 1 is fraud, to report recalls, None to skip them.
+        :return: Dict with the proportion of rows forwarded, the time of each approach and the speedup, the recall loss versus the detector
+                 alone (proportion of its detections the cascade misses) and, with labels, the recall of each approach
+        """
+        start = time.perf_counter()
+        full = np.asarray(self.detector.predict(data))
+        full_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        cascade, stages = self.predict_with_stages(data)
+        cascade_time = time.perf_counter() - start
+
+        report = {'forwarded_fraction': len(stages['forwarded']) / max(len(cascade), 1), 'full_seconds': full_time,
+                  'cascade_seconds': cascade_time, 'speedup': full_time / cascade_time,
+                  'recall_loss_vs_full': float(np.mean(cascade[full == 1] == 0)) if (full == 1).any() else 0.0,
+                  'agreement': float(np.mean(cascade == full))}
+        if labels is not None:
+            labels = np.asarray(labels)
+            report['recall_full'] = float(np.mean(full[labels == 1] == 1))
+            report['recall_cascade'] = float(np.mean(cascade[labels == 1] == 1))
+
+        return report
@@ -0,0 +1,168 @@
+from typing import Dict, Optional
+
+import numpy as np
+
+
+class CoresetSampler:
+    """
+    CoresetSampler object
+
+    Selects a representative training subset of a fixed size from any number of rows in one streaming pass, in constant memory per stratum.
+
+    - Density-aware (weighting='sensitivity'): rows are sampled with probability proportional to a lightweight coreset sensitivity,
+      1/2 + 1/2 * d^2 / mean(d^2) where d is the distance to the running mean of the rows, so that sparse regions far from the bulk of
+      the data, which shape the boundary of a one-class model such as the SVDD, are not drowned out by dense ones. The sample is then
+      biased towards those regions: select returns importance weights 1/p that undo the bias when passed as sample_weight to a
+      detector supporting it (e.g. Models.IsolationForest.fit). Detectors without sample_weight should use the default, uniform
+      weighting.
+    - Stratified by time: rows are grouped into strata of stratum_width time units (e.g. rows of a time-ordered file) and the sample is
+      split across strata in proportion to their number of rows, so no period of the data is over- or under-represented.
+    - Streaming: each stratum keeps a weighted reservoir (Efraimidis-Spirakis, the size rows with the highest keys log(u) / weight), merged
+      chunk by chunk with vectorised numpy operations.
+    """
+
+    def __init__(self, size: int, stratum_width: Optional[float] = None, weighting: str = 'uniform', random_state: Optional[int] = None):
+        """
+        Initialises the CoresetSampler object.
+
+        :param size: Integer representing the number of rows selected.
+        :param stratum_width: Float representing the width of the time strata, a single stratum if None.
+        :param weighting: String representing how rows are weighted: 'uniform' or 'sensitivity' (density-aware, to be used with the
+                          importance weights of select).
+        :param random_state: Integer representing the seed of the sampling.
+        """
+        if weighting not in ('sensitivity', 'uniform'):
+            raise ValueError(f"Unknown weighting: {weighting}")
+
+        self.size = size
+        self.stratum_width = stratum_width
+        self.weighting = weighting
+        self.rng = np.random.default_rng(random_state)
+        self.num_seen = 0
+        # running count, mean and mean squared distance to the mean of the rows
+        self.mean = None
+        self.mean_squared_distance = 0.0
+        # reservoir of each stratum: keys, rows, positions (index of the row in the stream), sampling weights, number of rows seen and
+        # total sampling weight of the rows seen
+        self.strata: Dict[int, dict] = {}
+
+    def weights(self, rows: np.ndarray) -> np.ndarray:
+        """
+        Updates the running mean with a chunk and computes the sampling weight of its rows.
+
+        :param rows: Numpy array representing the rows
+        :return: Numpy array of weights
+        """
+        if self.weighting == 'uniform':
+            return np.ones(len(rows))
+
+        # merge the moments of the chunk into the running ones (Chan et al.)
+        chunk_mean = rows.mean(axis=0)
+        chunk_squared_distance = np.mean(np.sum((rows - chunk_mean) ** 2, axis=1))
+        if self.mean is None:
+            self.mean = chunk_mean
+            self.mean_squared_distance = chunk_squared_distance
+        else:
+            total = self.num_seen + len(rows)
+            delta = chunk_mean - self.mean
+            self.mean = self.mean + delta * len(rows) / total
+            self.mean_squared_distance = (self.num_seen * self.mean_squared_distance + len(rows) * chunk_squared_distance
+                                          + np.sum(delta ** 2) * self.num_seen * len(rows) / total) / total
+
+        squared_distances = np.sum((rows - self.mean) ** 2, axis=1)
+
+        return 0.5 + 0.5 * squared_distances / max(self.mean_squared_distance, np.finfo(np.float64).tiny)
+
+    def add(self, rows, times: Optional[np.ndarray] = None) -> None:
+        """
+        Offers a chunk of rows to the sampler.
+
+        :param rows: DataFrame or Numpy array representing the rows
+        :param times: Numpy array representing the time of each row, used for the strata, the position of the row in the stream if None.
+        :return: None
+        """
+        rows = np.asarray(rows)
+        positions = self.num_seen + np.arange(len(rows))
+        times = positions if times is None else np.asarray(times)
+        weights = self.weights(rows)
+        self.num_seen += len(rows)
+
+        # the size rows with the highest keys are a weighted sample without replacement
+        keys = np.log(self.rng.random(len(rows))) / weights
+        strata = np.floor(times / self.stratum_width).astype(np.int64) if self.stratum_width is not None else np.zeros(len(rows), dtype=np.int64)
+
+        for stratum in np.unique(strata):
+            in_stratum = strata == stratum
+            reservoir = self.strata.get(stratum)
+            if reservoir is None:
+                reservoir = {'keys': keys[:0], 'rows': rows[:0], 'positions': positions[:0], 'weights': weights[:0], 'num_seen': 0,
+                             'total_weight': 0.0}
+                self.strata[stratum] = reservoir
+
+            merged_keys = np.concatenate([reservoir['keys'], keys[in_stratum]])
+            merged_rows = np.concatenate([reservoir['rows'], rows[in_stratum]])
+            merged_positions = np.concatenate([reservoir['positions'], positions[in_stratum]])
+            merged_weights = np.concatenate([reservoir['weights'], weights[in_stratum]])
+            if len(merged_keys) > self.size:
+                kept = np.argpartition(-merged_keys, self.size - 1)[:self.size]
+                merged_keys, merged_rows, merged_positions, merged_weights = (merged_keys[kept], merged_rows[kept], merged_positions[kept],
+                                                                              merged_weights[kept])
+            reservoir.update(keys=merged_keys, rows=merged_rows, positions=merged_positions, weights=merged_weights,
+                             num_seen=reservoir['num_seen'] + int(np.count_nonzero(in_stratum)),
+                             total_weight=reservoir['total_weight'] + float(weights[in_stratum].sum()))
+
+    def allocation(self) -> Dict[int, int]:
+        """
+        Splits the sample size across strata in proportion to their number of rows (largest remainder method).
+
+        :return: Dict representing the number of rows selected from each stratum
+        """
+        counts = {stratum: reservoir['num_seen'] for stratum, reservoir in self.strata.items()}
+        total = sum(counts.values())
+        size = min(self.size, total)
+        quotas = {stratum: size * count / total for stratum, count in counts.items()}
+        allocation = {stratum: int(quota) for stratum, quota in quotas.items()}
+        remainders = sorted(quotas, key=lambda stratum: quotas[stratum] - allocation[stratum], reverse=True)
+        for stratum in remainders[:size - sum(allocation.values())]:
+            allocation[stratum] += 1
+
+        return allocation
+
+    def select(self):
+        """
+        Gets the selected rows, their positions in the stream and their importance weights. The importance weight of a row is 1/p, where
+        p = min(1, count * w / W) approximates its probability of being selected: count rows selected from its stratum, w its sampling
+        weight and W the total sampling weight of the rows of its stratum. Weighted by them, the sample estimates sums over all the rows
+        seen; with uniform weighting they are the number of rows each selected row stands for in its stratum.
+
+        :return: Tuple of the Numpy array of selected rows, in stream order, the Numpy array of their positions and the Numpy array of
+                 their importance weights
+        """
+        if not self.strata:
+            return np.empty((0, 0)), np.empty(0, dtype=np.int64), np.empty(0)
+
+        rows = []
+        positions = []
+        importance = []
+        for stratum, count in self.allocation().items():
+            reservoir = self.strata[stratum]
+            best = np.argsort(-reservoir['keys'], kind='stable')[:count]
+            rows.append(reservoir['rows'][best])
+            positions.append(reservoir['positions'][best])
+            probabilities = np.minimum(1.0, count * reservoir['weights'][best] / reservoir['total_weight'])
+            importance.append(1 / probabilities)
+        rows = np.concatenate(rows)
+        positions = np.concatenate(positions)
+        importance = np.concatenate(importance)
+        order = np.argsort(positions, kind='stable')
+
+        return rows[order], positions[order], importance[order]
+
+    @property
+    def sample(self) -> np.ndarray:
+        """
+        Gets the selected rows.
+
+        :return: Numpy array of at most size rows, in stream order
+        """
+        return self.select()[0]
@@ -0,0 +1,165 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Protocol, Union
+
+import numpy as np
+import pandas as pd
+
+from Model.Preprocessing import TransactionPreprocessor
+
+
+class Detector(Protocol):
+    """
+    Interface shared by the detectors of Models.py (AutoEncoder, IsolationForest, LocalOutlierFactor) and OneClassSVM.py (AnomalyDetection).
+
+    Every detector takes a preprocessed feature batch (DataFrame or Numpy array) and selects the columns it was trained on itself.
+    """
+
+    def score(self, data) -> np.ndarray:
+        """
+        :return: Numpy array of anomaly scores, higher is more anomalous
+        """
+        ...
+
+    def predict(self, data) -> np.ndarray:
+        """
+        :return: Numpy array representing the predicted class where 0 is non-fraud and 1 is fraud.
+        """
+        ...
+
+
+class EnsembleScorer:
+    """
+    EnsembleScorer object
+
+    Scores one preprocessed batch with all member detectors in parallel, normalises their scores to a common [0, 1] scale and combines them
+    into a single fraud score, so the data is only read and transformed once for the whole ensemble.
+    """
+
+    def __init__(self, detectors: Dict[str, Detector], weights: Optional[Dict[str, float]] = None, normalization: str = 'quantile',
+                 combination: str = 'mean', threshold: float = 0.99, preprocessor: Optional[TransactionPreprocessor] = None,
+                 n_jobs: Optional[int] = None):
+        """
+        Initialises the EnsembleScorer object.
+
+        :param detectors: Dict representing the fitted member detectors by name.
+        :param weights: Dict representing the weight of each member in the combination, equal weights if None.
+        :param normalization: String representing how scores are put on a common scale:
+                              'quantile' maps a score to its quantile among the member's scores on reference data (see fit),
+                              'rank' maps a score to its rank within the batch being scored.
+        :param combination: String representing how normalised scores are combined: 'mean' (weighted) or 'max'.
+        :param threshold: Float representing the ensemble score above which a transaction is fraud.
+        :param preprocessor: TransactionPreprocessor shared with the members, used by preprocess.
+        :param n_jobs: Integer representing the number of threads scoring members concurrently, one per member if None.
+        """
+        if normalization not in ('quantile', 'rank'):
+            raise ValueError(f"Unknown normalization: {normalization}")
+        if combination not in ('mean', 'max'):
+            raise ValueError(f"Unknown combination: {combination}")
+
+        self.detectors = detectors
+        self.weights = weights if weights is not None else {name: 1.0 for name in detectors}
+        self.normalization = normalization
+        self.combination = combination
+        self.threshold = threshold
+        self.preprocessor = preprocessor if preprocessor is not None else TransactionPreprocessor()
+        self.n_jobs = n_jobs if n_jobs is not None else len(detectors)
+
+        # sorted scores of each member on reference data, set by fit
+        self.reference_scores: Dict[str, np.ndarray] = {}
+
+    def preprocess(self, data) -> pd.DataFrame:
+        """
+        Transforms raw transactions into features with the shared preprocessor, fitting it first if it is not fitted yet.
+
+        :param data: DataFrame representing transactions in the simulated schema
+        :return: DataFrame representing the features
+        """
+        if not self.preprocessor.fitted:
+            self.preprocessor.fit(data)
+
+        return self.preprocessor.transform(data)
+
+    def fit(self, data) -> None:
+        """
+        Records the score distribution of every member on reference data (typically the training data), used by quantile normalisation.
+        The members themselves must already be fitted.
+
+        :param data: DataFrame or Numpy array representing preprocessed reference features
+        :return: None
+        """
+        self.reference_scores = {name: np.sort(scores) for name, scores in self.score_members(data).items()}
+
+    def score_members(self, data) -> pd.DataFrame:
+        """
+        Scores the batch with every member, concurrently.
+
+        :param data: DataFrame or Numpy array representing preprocessed features
+        :return: DataFrame representing the raw score of each member (columns) for each row
+        """
+        names = list(self.detectors)
+        with ThreadPoolExecutor(max_workers=max(1, min(self.n_jobs, len(names)))) as executor:
+            scores = list(executor.map(lambda name: np.asarray(self.detectors[name].score(data), dtype=np.float64), names))
+
+        return pd.DataFrame(dict(zip(names, scores)), index=data.index if isinstance(data, pd.DataFrame) else None)
+
+    def normalize(self, name: str, scores: np.ndarray) -> np.ndarray:
+        """
+        Puts the scores of a member on a [0, 1] scale, higher is more anomalous.
+
+        :param name: String representing the member
+        :param scores: Numpy array representing the raw scores of the member
+        :return: Numpy array representing the normalised scores
+        """
+        if self.normalization == 'rank':
+            return pd.Series(scores).rank(pct=True).to_numpy()
+
+        if name not in self.reference_scores:
+            raise ValueError("EnsembleScorer must be fitted on reference data for quantile normalization")
+        reference = self.reference_scores[name]
+
+        return np.searchsorted(reference, scores, side='right') / len(reference)
+
+    def score_with_members(self, data) -> pd.DataFrame:
+        """
+        Scores the batch with every member and combines the normalised scores.
+
+        :param data: DataFrame or Numpy array representing preprocessed features
+        :return: DataFrame with the normalised score of each member and the combined score in the 'ensemble' column
+        """
+        raw_scores = self.score_members(data)
+        normalized = pd.DataFrame({name: self.normalize(name, raw_scores[name].to_numpy()) for name in raw_scores.columns}, index=raw_scores.index)
+
+        if self.combination == 'max':
+            normalized['ensemble'] = normalized.max(axis=1)
+        else:
+            weights = np.array([self.weights[name] for name in raw_scores.columns])
+            normalized['ensemble'] = normalized[raw_scores.columns].to_numpy() @ weights / weights.sum()
+
+        return normalized
+
+    def score(self, data) -> np.ndarray:
+        """
+        Computes the ensemble fraud score of each row.
+
+        :param data: DataFrame or Numpy array representing preprocessed features
+        :return: Numpy array of ensemble scores in [0, 1], higher is more anomalous
+        """
+        return self.score_with_members(data)['ensemble'].to_numpy()
+
+    def predict(self, data) -> Union[list, np.ndarray]:
+        """
+        Predicts whether each row is fraud, i.e. its ensemble score is above the threshold.
+
+        :param data: DataFrame or Numpy array representing preprocessed features
+        :return: Numpy array representing the predicted class where 0 is non-fraud and 1 is fraud.
+        """
+        return (self.score(data) > self.threshold).astype(int)
+
+    @property
+    def decision_threshold(self) -> float:
+        """
+        Gets the ensemble score above which predict flags a row as fraud.
+
+        :return: Float representing the threshold
+        """
+        return self.threshold
@@ -0,0 +1,276 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+# matplotlib is only imported by the plotting functions, so that headless batch runs do not pay for it
+
+
+def threshold_curve(scores: np.ndarray, labels: np.ndarray) -> Tuple[pd.DataFrame, float]:
+    """
+    Evaluates every possible threshold on anomaly scores in one pass.
+
+    The scores are sorted once in decreasing order, and the confusion matrix of every threshold is read off the cumulative counts of
+    fraud and non-fraud rows, for each distinct score. A row is predicted as fraud when its score is strictly above the threshold.
+
+    :param scores: Numpy array representing the anomaly scores, higher is more anomalous. Hard 0/1 predictions are accepted as scores.
+    :param labels: Numpy array representing the true classes where 0 is non-fraud and 1 is fraud.
+    :return: Tuple of the curve (DataFrame with threshold, tp, fp, fn, tn, precision, recall, f1, fpr and auroc columns, in decreasing
+             threshold order, where auroc is the AUROC of the thresholded predictions) and the AUROC of the scores themselves.
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    labels = np.asarray(labels).astype(bool)
+    order = np.argsort(-scores, kind='stable')
+    sorted_scores = scores[order]
+    sorted_labels = labels[order]
+
+    # cumulative counts of rows strictly above each position
+    tp_cumulative = np.concatenate([[0], np.cumsum(sorted_labels)])
+    fp_cumulative = np.concatenate([[0], np.cumsum(~sorted_labels)])
+
+    # thresholds are the distinct scores, rows before their first occurrence are predicted as fraud
+    first = np.flatnonzero(np.concatenate([[True], sorted_scores[1:] != sorted_scores[:-1]]))
+    tp = tp_cumulative[first]
+    fp = fp_cumulative[first]
+    positives = tp_cumulative[-1]
+    negatives = fp_cumulative[-1]
+    fn = positives - tp
+    tn = negatives - fp
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.where(tp + fp > 0, tp / (tp + fp), 0.0)
+        recall = np.where(positives > 0, tp / max(positives, 1), 0.0)
+        f1 = np.where(tp > 0, 2 * tp / (2 * tp + fp + fn), 0.0)
+        fpr = np.where(negatives > 0, fp / max(negatives, 1), 0.0)
+
+    curve = pd.DataFrame({
+        'threshold': sorted_scores[first],
+        'tp': tp,
+        'fp': fp,
+        'fn': fn,
+        'tn': tn,
+        'precision': precision,
+        'recall': recall,
+        'f1': f1,
+        'fpr': fpr,
+        'auroc': (recall + 1 - fpr) / 2,
+    })
+
+    # area under the full ROC curve, closed with the point where every row is predicted as fraud
+    roc_tpr = np.concatenate([recall, [1.0]])
+    roc_fpr = np.concatenate([fpr, [1.0]])
+    auroc = float(np.sum(np.diff(roc_fpr) * (roc_tpr[1:] + roc_tpr[:-1]) / 2))
+
+    return curve, auroc
+
+
+def average_precision(curve: pd.DataFrame) -> float:
+    """
+    Computes the average precision (area under the precision-recall curve, as sklearn's average_precision_score) from a threshold_curve.
+
+    :param curve: DataFrame returned by threshold_curve
+    :return: Float representing the average precision
+    """
+    # every row but the first threshold predicts some rows as fraud, add the last point where every row is
+    tp = np.concatenate([curve['tp'].to_numpy()[1:], [curve['tp'].iloc[0] + curve['fn'].iloc[0]]])
+    fp = np.concatenate([curve['fp'].to_numpy()[1:], [curve['fp'].iloc[0] + curve['tn'].iloc[0]]])
+    positives = tp[-1]
+    if positives == 0:
+        return 0.0
+
+    precision = tp / np.maximum(tp + fp, 1)
+    recall = tp / positives
+
+    return float(np.sum(np.diff(np.concatenate([[0.0], recall])) * precision))
+
+
+def confusion_matrices(scores: np.ndarray, labels: np.ndarray, thresholds: Sequence[float]) -> np.ndarray:
+    """
+    Computes the confusion matrices of many thresholds at once, with a binary search of each threshold in the sorted scores of each class.
+
+    :param scores: Numpy array representing the anomaly scores. Hard 0/1 predictions are accepted with a threshold of 0.5.
+    :param labels: Numpy array representing the true classes where 0 is non-fraud and 1 is fraud.
+    :param thresholds: Thresholds above which a row is predicted as fraud.
+    :return: Numpy array of shape (num_thresholds, 2, 2), each matrix laid out as sklearn's confusion_matrix: [[tn, fp], [fn, tp]]
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    labels = np.asarray(labels).astype(bool)
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    fraud_scores = np.sort(scores[labels])
+    nonfraud_scores = np.sort(scores[~labels])
+
+    tp = len(fraud_scores) - np.searchsorted(fraud_scores, thresholds, side='right')
+    fp = len(nonfraud_scores) - np.searchsorted(nonfraud_scores, thresholds, side='right')
+    fn = len(fraud_scores) - tp
+    tn = len(nonfraud_scores) - fp
+
+    return np.stack([np.stack([tn, fp], axis=1), np.stack([fn, tp], axis=1)], axis=1)
+
+
+def precision_at_k(scores: np.ndarray, labels: np.ndarray, k_values: Sequence[int]) -> np.ndarray:
+    """
+    Computes the proportion of fraud among the k highest scored rows, e.g. the alerts an investigation team can review, for several k.
+
+    :param scores: Numpy array representing the anomaly scores.
+    :param labels: Numpy array representing the true classes where 0 is non-fraud and 1 is fraud.
+    :param k_values: Numbers of top rows.
+    :return: Numpy array representing the precision at each k
+    """
+    labels = np.asarray(labels).astype(bool)
+    k_max = min(max(k_values), len(labels))
+    # only the top k_max rows need to be ordered
+    top = np.argpartition(-np.asarray(scores, dtype=np.float64), k_max - 1)[:k_max] if k_max < len(labels) else np.arange(len(labels))
+    top = top[np.argsort(-np.asarray(scores, dtype=np.float64)[top], kind='stable')]
+    hits = np.cumsum(labels[top])
+
+    return np.array([hits[min(k, k_max) - 1] / min(k, k_max) if k > 0 else 0.0 for k in k_values])
+
+
+def evaluate_models(scores: Dict[str, np.ndarray], labels: np.ndarray, thresholds: Optional[Dict[str, Sequence[float]]] = None,
+                    cost_false_positive: float = 1.0, cost_false_negative: float = 1.0) -> pd.DataFrame:
+    """
+    Evaluates many models at many thresholds.
+
+    :param scores: Dict representing the anomaly scores (or hard 0/1 predictions) of each model by name.
+    :param labels: Numpy array representing the true classes where 0 is non-fraud and 1 is fraud.
+    :param thresholds: Dict representing the thresholds to evaluate for each model. Every distinct score of a model is used if absent.
+    :param cost_false_positive: Float representing the cost of flagging a non-fraud transaction (e.g. an investigation).
+    :param cost_false_negative: Float representing the cost of missing a fraud transaction (e.g. the average loss).
+    :return: DataFrame with one row per model and threshold: the confusion matrix, precision, recall (fraud detection rate),
+             specificity (non-fraud detection rate), f1, accuracy and cost.
+    """
+    thresholds = thresholds or {}
+    results = []
+    for name, model_scores in scores.items():
+        if name in thresholds:
+            model_thresholds = np.asarray(thresholds[name], dtype=np.float64)
+        else:
+            model_thresholds = np.unique(np.asarray(model_scores, dtype=np.float64))
+        cms = confusion_matrices(model_scores, labels, model_thresholds)
+        results.append(pd.DataFrame({
+            'model': name,
+            'threshold': model_thresholds,
+            'tn': cms[:, 0, 0],
+            'fp': cms[:, 0, 1],
+            'fn': cms[:, 1, 0],
+            'tp': cms[:, 1, 1],
+        }))
+
+    results = pd.concat(results, ignore_index=True)
+    tp, fp, fn, tn = (results[column].to_numpy().astype(np.float64) for column in ('tp', 'fp', 'fn', 'tn'))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        results['precision'] = np.where(tp + fp > 0, tp / (tp + fp), 0.0)
+        results['recall'] = np.where(tp + fn > 0, tp / (tp + fn), 0.0)
+        results['specificity'] = np.where(tn + fp > 0, tn / (tn + fp), 0.0)
+        results['f1'] = np.where(tp > 0, 2 * tp / (2 * tp + fp + fn), 0.0)
+    results['accuracy'] = (tp + tn) / (tp + fp + fn + tn)
+    results['cost'] = fp * cost_false_positive + fn * cost_false_negative
+
+    return results
+
+
+def summarize_models(scores: Dict[str, np.ndarray], labels: np.ndarray, k_values: Sequence[int] = (100, 1000),
+                     cost_false_positive: float = 1.0, cost_false_negative: float = 1.0) -> pd.DataFrame:
+    """
+    Summarises the ranking quality of many models: AUROC, average precision, precision at k, best f1 and minimum cost over all thresholds.
+
+    :param scores: Dict representing the anomaly scores of each model by name.
+    :param labels: Numpy array representing the true classes where 0 is non-fraud and 1 is fraud.
+    :param k_values: Numbers of top rows for precision at k.
+    :param cost_false_positive: Float representing the cost of flagging a non-fraud transaction.
+    :param cost_false_negative: Float representing the cost of missing a fraud transaction.
+    :return: DataFrame with one row per model
+    """
+    summary = []
+    for name, model_scores in scores.items():
+        curve, auroc = threshold_curve(model_scores, labels)
+        costs = curve['fp'].to_numpy() * cost_false_positive + curve['fn'].to_numpy() * cost_false_negative
+        best_f1 = int(np.argmax(curve['f1'].to_numpy()))
+        best_cost = int(np.argmin(costs))
+        row = {
+            'model': name,
+            'auroc': auroc,
+            'average_precision': average_precision(curve),
+            'best_f1': curve['f1'].iloc[best_f1],
+            'best_f1_threshold': curve['threshold'].iloc[best_f1],
+            'min_cost': costs[best_cost],
+            'min_cost_threshold': curve['threshold'].iloc[best_cost],
+        }
+        for k, precision in zip(k_values, precision_at_k(model_scores, labels, k_values)):
+            row[f'precision@{k}'] = precision
+        summary.append(row)
+
+    return pd.DataFrame(summary)
+
+
+def detection_report(cm: np.ndarray, name: str = 'test') -> str:
+    """
+    Formats the detection rates of a confusion matrix, as printed by SklearnModels.py.
+
+    :param cm: Numpy array representing a confusion matrix [[tn, fp], [fn, tp]]
+    :param name: String representing the evaluated set, e.g. 'training' or 'test'
+    :return: String of the report lines
+    """
+    (tn, fp), (fn, tp) = cm
+
+    return "\n".join([
+        f"Total fraud transactions detected in {name}: {tp} / {tp + fn}",
+        f"Total non-fraud transactions detected in {name}: {tn} / {fp + tn}",
+        f"Probability to detect a fraud transaction in {name}: {tp / max(tp + fn, 1)}",
+        f"Probability to detect a non-fraud transaction in {name}: {tn / max(fp + tn, 1)}",
+        f"Accuracy of model on the {name}: {100 * (tn + tp) / max(tn + fp + fn + tp, 1)}",
+    ])
+
+
+def plot_confusion_matrix(cm: np.ndarray, classes: List[str], title: str = 'Confusion matrix', cmap=None) -> None:
+    """
+    Plots a confusion matrix with matplotlib.
+
+    :param cm: Numpy array representing a confusion matrix
+    :param classes: List representing the class names
+    :param title: String representing the title
+    :param cmap: Matplotlib colormap, Blues if None
+    :return: None
+    """
+    import matplotlib.pyplot as plt
+
+    plt.imshow(cm, interpolation='nearest', cmap=cmap if cmap is not None else plt.cm.Blues)
+    plt.title(title)
+    plt.colorbar()
+    tick_marks = np.arange(len(classes))
+    plt.xticks(tick_marks, classes, rotation=45)
+    plt.yticks(tick_marks, classes)
+
+    thresh = cm.max() / 2.
+    for i in range(cm.shape[0]):
+        for j in range(cm.shape[1]):
+            plt.text(j, i, format(cm[i, j], 'd'), horizontalalignment="center", color="white" if cm[i, j] > thresh else "black")
+
+    plt.tight_layout()
+    plt.ylabel('True label')
+    plt.xlabel('Predicted label')
+    plt.show()
+
+
+def plot_curves(scores: Dict[str, np.ndarray], labels: np.ndarray, kind: str = 'roc') -> None:
+    """
+    Plots the ROC or precision-recall curves of many models with matplotlib.
+
+    :param scores: Dict representing the anomaly scores of each model by name.
+    :param labels: Numpy array representing the true classes where 0 is non-fraud and 1 is fraud.
+    :param kind: String representing the curve, 'roc' or 'pr'.
+    :return: None
+    """
+    import matplotlib.pyplot as plt
+
+    for name, model_scores in scores.items():
+        curve, auroc = threshold_curve(model_scores, labels)
+        if kind == 'roc':
+            plt.plot(np.concatenate([[0.0], curve['fpr'], [1.0]]), np.concatenate([[0.0], curve['recall'], [1.0]]), label=f"{name} (AUROC {auroc:.3f})")
+        else:
+            plt.plot(curve['recall'], curve['precision'], label=f"{name} (AP {average_precision(curve):.3f})")
+
+    plt.xlabel('False positive rate' if kind == 'roc' else 'Recall')
+    plt.ylabel('True positive rate' if kind == 'roc' else 'Precision')
+    plt.legend()
+    plt.show()
@@ -1,6 +1,10 @@
 import numpy as np
 from scipy import stats
-import queue
+from scipy import special
+import concurrent.futures
+import contextlib
+import heapq
+import time
 
 
 
@@ -9,13 +13,14 @@ class Trepan:
 	Wrapper class for tree building algorithm TREPAN as described in 
 	"Extracting tree-structured representations of trained networks" : Craven,Shavlik 1993
 	Differences/Unimplemented/Implemented differently:
-	1. Not using m-of-n splits in decision tree nodes, instead a simple C4.5 split (Quinlan,1993) is used.
+	1. m-of-n splits are found by hill climbing from the C4.5 split (Quinlan,1993) as in the paper, but only with the two operators
+	   that add a condition (no beam search, no threshold refinement), over a fixed set of quantile thresholds per feature.
 	2. Input features must be numeric.
 	3. Stopping criterion is only num_nodes < MAX_NODES . Other criterion described in the paper [TODO:Description?] is unimplemented.
 	'''
 
 	@staticmethod
-	def build_tree(MIN_EXAMPLES_PER_NODE,MAX_NODES,trainX,oracle):
+	def build_tree(MIN_EXAMPLES_PER_NODE,MAX_NODES,trainX,oracle,num_workers=1,frontier_size=None,max_conditions=5,stats=None):
 		'''			
 			Parameters
 			----------
@@ -26,6 +31,17 @@ class Trepan:
 						: training examples of dimension (num_examples,num_dimensions) 
 			oracle 		: 	Oracle object, used to generate samples given constraints of linear inequalities on the input space,
 							It also wraps the NN model to imitate, which it uses to label the instances. 
+			num_workers	: int
+						  number of processes used to expand nodes. With 1, nodes are expanded one at a time in this process.
+						  Otherwise the oracle is pickled once to each worker process, so its network must be picklable.
+			frontier_size : int
+						  number of highest priority nodes taken from the frontier and expanded concurrently at each step, defaults to num_workers.
+						  The children of these nodes are only added to the frontier once all of them are expanded, so with frontier_size>1
+						  the nodes are not expanded in strict priority order.
+			max_conditions : int
+						  maximum number of conditions n of the m-of-n split of a node, 1 gives C4.5 splits.
+			stats		: BuildStats object or None
+						  collects timings and counts of the build if given. Nothing is measured if None.
 			Returns
 			--------
 			root : the root node of the built tree. Call root.classify(single_example) to get the prediction of the imitating tree. 
@@ -34,82 +50,242 @@ class Trepan:
 
 		total_num_examples = trainX.shape[0]
 		num_dimensions = trainX.shape[1]
+		if frontier_size is None:
+			frontier_size = num_workers
+		if stats is not None:
+			build_start = time.perf_counter()
 		#generate labels from oracle
-		labels = np.zeros((trainX.shape[0]))
-		for i in range(0,trainX.shape[0]):
-			labels[i]=oracle.get_oracle_label(trainX[i,:])
+		with timed(stats,"oracle"):
+			labels = oracle.get_oracle_labels(trainX)
 
 		all_examples=(trainX,labels)
 		all_examples_dict={"trainX":trainX,"labels":labels}
 
-		#initialize queue with root
-		sortedQueue = queue.PriorityQueue()
+		#initialize frontier (a heap ordered by priority) with root
+		frontier = []
 		root = Node(all_examples_dict,total_num_examples)
-		sortedQueue.put((root.priority,0,root,all_examples,Constraints(num_dimensions)))
+		heapq.heappush(frontier,(root.priority,0,root,all_examples,Constraints(num_dimensions)))
+
+		executor = None
+		if num_workers>1:
+			executor = concurrent.futures.ProcessPoolExecutor(max_workers=num_workers,initializer=init_expansion_worker,
+																initargs=(oracle,MIN_EXAMPLES_PER_NODE,max_conditions))
 
 		num_nodes=1
-		while not sortedQueue.empty():
-			(p, tiebreaker, node, examples, constraints)=sortedQueue.get()
-			num_examples=examples[0].shape[0]
-			assert(node.leaf)
-			assert(num_examples>0)
-
-			print("############PROCESSING "+str(num_examples)+" #############")
-
-			if num_examples<MIN_EXAMPLES_PER_NODE:
-				print("NEED EXTRA")
-				(trainX,labels)= examples
-				num_required = MIN_EXAMPLES_PER_NODE - num_examples
-				(trainX_oracle,labels_oracle) = oracle.generate_constrained_examples_with_labels(constraints,num_required)
-				trainX_aug = np.concatenate([trainX,trainX_oracle],axis=0)
-				labels_aug = np.concatenate([labels,labels_oracle],axis=0)
-				examples_aug=(trainX_aug,labels_aug)		
-			else :
-				print("ALL OK")
-				examples_aug = examples
-
-			srule = SplitFinder.find_best_m_of_n_split(examples_aug)
-			#a good split was not found, so keep as leaf
-			if not srule:
-				continue
-			examples_l,examples_r = partition(examples,srule)
+		try:
+			while frontier:
+				#number of nodes will exceed MAX_NODES if we make any more split, so keep the remaining nodes as leaves
+				if (MAX_NODES - num_nodes<2):
+					break
+
+				#each split adds 2 nodes, so don't expand more nodes than can still be split
+				num_to_expand = min(frontier_size,(MAX_NODES - num_nodes)//2,len(frontier))
+				batch = [heapq.heappop(frontier) for _ in range(0,num_to_expand)]
+				if executor is None:
+					expansions = [expand_node(examples,constraints,oracle,MIN_EXAMPLES_PER_NODE,max_conditions,stats)
+									for (p,tiebreaker,node,examples,constraints) in batch]
+				else:
+					#each task reseeds its worker, otherwise forked workers would all draw the same oracle samples
+					seeds = np.random.randint(0,2**31-1,size=num_to_expand)
+					results = list(executor.map(expand_node_in_worker,[entry[3] for entry in batch],[entry[4] for entry in batch],
+												seeds,[stats is not None]*num_to_expand))
+					expansions = [expansion for (expansion,worker_stats) in results]
+					if stats is not None:
+						for (expansion,worker_stats) in results:
+							stats.merge(worker_stats)
+
+				#apply the expansions in priority order
+				for (p,tiebreaker,node,examples,constraints),expansion in zip(batch,expansions):
+					assert(node.leaf)
+					#no good or non trivial split was found, so keep as leaf
+					if expansion is None:
+						if stats is not None:
+							stats.record_expansion(node,None)
+						continue
+					(srule,examples_l,examples_r)=expansion
+
+					#split the node, and make as internal
+					examples_l_dict={"trainX":examples_l[0],"labels":examples_l[1]}
+					examples_r_dict={"trainX":examples_r[0],"labels":examples_r[1]}
+					left_child= Node(examples_l_dict,total_num_examples)
+					right_child= Node(examples_r_dict,total_num_examples)
+					node.left_child = left_child
+					node.right_child = right_child
+					node.splitrule=srule
+					node.leaf=False
+
+					#add child nodes
+					constraints_left = constraints.copy()
+					constraints_left.addRule(srule)
+					priority = left_child.priority
+					heapq.heappush(frontier,(priority,num_nodes,left_child,examples_l,constraints_left))
+					num_nodes+=1
+					
+					constraints_right = constraints.copy()
+					constraints_right .addRule(srule.invert())
+					priority = right_child.priority
+					heapq.heappush(frontier,(priority,num_nodes,right_child,examples_r,constraints_right))
+					num_nodes+=1
+
+					if stats is not None:
+						stats.record_expansion(node,srule)
+		finally:
+			if executor is not None:
+				executor.shutdown()
+
+		if stats is not None:
+			stats.num_nodes=num_nodes
+			stats.total_time+=time.perf_counter()-build_start
+		
+		return root
 
-			#even though the trivial splits are avoided with examples_aug, 
-			#the splitrule may still split the examples trivially
-			#trivial split, so keep as leaf
-			if len(examples_l[0])==0 or len(examples_r[0])==0:
-				continue
 
-			#TODO: Add stop criterion thresholding the proportion of dominant class, similar to 
-			
-			#number of nodes will exceed MAX_NODES if we make the split, so keep as leaf
-			if (MAX_NODES - num_nodes<2):
-				continue
+def expand_node(examples,constraints,oracle,MIN_EXAMPLES_PER_NODE,max_conditions,stats=None):
+	'''
+	Finds the split of a frontier node: augments its examples with oracle samples drawn under its constraints if there are less than
+	MIN_EXAMPLES_PER_NODE, finds the best split on the augmented examples and partitions the node's own examples with it.
+	Returns
+	-------
+	(srule,examples_l,examples_r), or None if no good or non trivial split was found, in which case the node is kept as a leaf.
+	'''
+	num_examples=examples[0].shape[0]
+	assert(num_examples>0)
+
+	if num_examples<MIN_EXAMPLES_PER_NODE:
+		(trainX,labels)= examples
+		num_required = MIN_EXAMPLES_PER_NODE - num_examples
+		with timed(stats,"sampling"):
+			trainX_oracle = oracle.generate_constrained_examples(constraints,num_required)
+		with timed(stats,"oracle"):
+			labels_oracle = oracle.get_oracle_labels(trainX_oracle)
+		if stats is not None:
+			stats.num_generated_examples+=num_required
+		trainX_aug = np.concatenate([trainX,trainX_oracle],axis=0)
+		labels_aug = np.concatenate([labels,labels_oracle],axis=0)
+		examples_aug=(trainX_aug,labels_aug)		
+	else :
+		examples_aug = examples
+
+	with timed(stats,"split_search"):
+		srule = SplitFinder.find_best_m_of_n_split(examples_aug,max_conditions)
+	#a good split was not found
+	if not srule:
+		return None
+	with timed(stats,"partition"):
+		examples_l,examples_r = partition(examples,srule)
+
+	#even though the trivial splits are avoided with examples_aug, 
+	#the splitrule may still split the examples trivially
+	if len(examples_l[0])==0 or len(examples_r[0])==0:
+		return None
+
+	#TODO: Add stop criterion thresholding the proportion of dominant class, similar to 
+
+	return (srule,examples_l,examples_r)
+
+
+#state of a build_tree worker process, set once by init_expansion_worker
+worker_state = {}
+
+
+def init_expansion_worker(oracle,MIN_EXAMPLES_PER_NODE,max_conditions):
+	worker_state["oracle"]=oracle
+	worker_state["MIN_EXAMPLES_PER_NODE"]=MIN_EXAMPLES_PER_NODE
+	worker_state["max_conditions"]=max_conditions
+
+
+def expand_node_in_worker(examples,constraints,seed,collect_stats):
+	np.random.seed(seed)
+	stats = BuildStats() if collect_stats else None
+	expansion = expand_node(examples,constraints,worker_state["oracle"],worker_state["MIN_EXAMPLES_PER_NODE"],
+							worker_state["max_conditions"],stats)
+	return expansion,stats
 
-			#split the node, and make as internal
-			examples_l_dict={"trainX":examples_l[0],"labels":examples_l[1]}
-			examples_r_dict={"trainX":examples_r[0],"labels":examples_r[1]}
-			left_child= Node(examples_l_dict,total_num_examples)
-			right_child= Node(examples_r_dict,total_num_examples)
-			node.left_child = left_child
-			node.right_child = right_child
-			node.splitrule=srule
-			node.leaf=False
-
-			#add child nodes
-			constraints_left = constraints.copy()
-			constraints_left.addRule(srule)
-			priority = left_child.priority
-			sortedQueue.put((priority,num_nodes,left_child,examples_l,constraints_left))
-			num_nodes+=1
-			
-			constraints_right = constraints.copy()
-			constraints_right .addRule(srule.invert())
-			priority = right_child.priority
-			sortedQueue.put((priority,num_nodes,right_child,examples_r,constraints_right))
-			num_nodes+=1
-		
-		return root
+
+###########################################
+
+
+class BuildStats:
+	'''
+	Instrumentation of Trepan.build_tree, enabled by passing an instance as its stats argument.
+	Fields
+	------
+	phase_times	: dict, total seconds spent in each phase of the build, summed over worker processes:
+				  "oracle" (labelling examples with the network), "sampling" (drawing constrained examples),
+				  "split_search" (find_best_m_of_n_split) and "partition" (routing a node's examples to its children)
+	phase_calls	: dict, number of times each phase was run
+	total_time	: wall clock seconds spent in build_tree
+	num_nodes, num_expanded, num_splits, num_generated_examples : counts of tree nodes, nodes taken from the frontier,
+				  nodes split and examples drawn from the oracle
+	callback	: optional function called in the building process as callback(event,info) after a node is expanded,
+				  with event "split" or "leaf" and info a dict describing the node, e.g. to log progress
+	'''
+
+	PHASES = ("oracle","sampling","split_search","partition")
+
+	def __init__(self,callback=None):
+		self.callback=callback
+		self.phase_times=dict((phase,0.0) for phase in self.PHASES)
+		self.phase_calls=dict((phase,0) for phase in self.PHASES)
+		self.total_time=0.0
+		self.num_nodes=0
+		self.num_expanded=0
+		self.num_splits=0
+		self.num_generated_examples=0
+
+	@contextlib.contextmanager
+	def timer(self,phase):
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.phase_times[phase]+=time.perf_counter()-start
+			self.phase_calls[phase]+=1
+
+	def record_expansion(self,node,srule):
+		self.num_expanded+=1
+		if srule is not None:
+			self.num_splits+=1
+		if self.callback is not None:
+			info={"num_examples":node.num_examples,"priority":node.priority,"num_expanded":self.num_expanded}
+			if srule is not None:
+				info["m"]=srule.m
+				info["n"]=srule.n
+			self.callback("split" if srule is not None else "leaf",info)
+
+	def merge(self,other):
+		'''
+		Adds the phase timings and the example counts of other, e.g. collected in a worker process, to this object.
+		'''
+		for phase in self.PHASES:
+			self.phase_times[phase]+=other.phase_times[phase]
+			self.phase_calls[phase]+=other.phase_calls[phase]
+		self.num_generated_examples+=other.num_generated_examples
+
+	def to_dict(self):
+		'''
+		Returns the collected metrics as a plain dict, e.g. to be dumped as json for profiling runs.
+		'''
+		return {"total_time":self.total_time,
+				"phase_times":dict(self.phase_times),
+				"phase_calls":dict(self.phase_calls),
+				"num_nodes":self.num_nodes,
+				"num_expanded":self.num_expanded,
+				"num_splits":self.num_splits,
+				"num_generated_examples":self.num_generated_examples}
+
+
+#shared no-op timer used when instrumentation is disabled
+NO_TIMER = contextlib.nullcontext()
+
+
+def timed(stats,phase):
+	'''
+	Returns a context manager timing phase into stats, or a no-op one if stats is None.
+	'''
+	if stats is None:
+		return NO_TIMER
+	return stats.timer(phase)
 
 
 ###########################################
@@ -221,7 +397,6 @@ class SplitFinder:
 		(X,labels)=examples
 		num_examples=X.shape[0]
 		num_dimensions=X.shape[1]
-		print("SPLITTING "+str(num_examples)+" EXAMPLES")
 
 		#initialize gains 
 		gains = np.zeros((num_examples,num_dimensions))
@@ -251,16 +426,149 @@ class SplitFinder:
 		return srule
 
 	@staticmethod
-	def find_best_m_of_n_split(examples):
+	def class_counts(satisfied,y,classes,rows=None,chunk_size=65536):
+		'''
+		Number of examples of each class satisfying each candidate, counted per class over chunks of rows,
+		so that no copy of the condition matrix larger than chunk_size rows (of booleans) is made.
+		Parameters
+		---------
+		satisfied : boolean np array of shape (num_examples,num_candidates)
+		y : np array of shape (num_examples,), the category/class labels
+		classes : np array of shape (num_classes,), the classes counted
+		rows : boolean np array of shape (num_examples,), the examples counted, all of them if None
+		Returns
+		-------
+		counts : np array of shape (num_candidates,num_classes)
+		'''
+		counts=np.zeros((satisfied.shape[1],len(classes)),dtype=np.int64)
+		for (c,class_c) in enumerate(classes):
+			in_class = y==class_c
+			class_rows = np.flatnonzero(in_class if rows is None else in_class & rows)
+			for start in range(0,len(class_rows),chunk_size):
+				counts[:,c]+=np.count_nonzero(satisfied[class_rows[start:start+chunk_size]],axis=0)
+		return counts
+
+	@staticmethod
+	def count_gains(left_counts,total_counts):
+		'''
+		Information gain of candidate partitions given the class counts of their left partitions.
+		Parameters
+		---------
+		left_counts : np array of shape (num_candidates,num_classes)
+		total_counts : np array of shape (num_classes,), the class counts of all the examples
+		Returns
+		-------
+		gains : np array of shape (num_candidates,)
+		'''
+		num_examples = total_counts.sum()
+		right_counts = total_counts[None,:] - left_counts
+
+		def entropies(counts):
+			totals = counts.sum(axis=1,keepdims=True)
+			with np.errstate(divide='ignore',invalid='ignore'):
+				probs = counts/totals
+				#lim(x->0) xlogx = 0
+				terms = np.where(counts>0,-probs*np.log2(np.where(counts>0,probs,1)),0)
+			return terms.sum(axis=1),totals[:,0]
+
+		entropy_parent = SplitFinder.entropy(dict(enumerate(total_counts)),num_examples)
+		entropy_l,num_l = entropies(left_counts)
+		entropy_r,num_r = entropies(right_counts)
+		return entropy_parent - (num_l*entropy_l + num_r*entropy_r)/float(num_examples)
+
+	@staticmethod
+	def partition_gains(satisfied,y):
+		'''
+		Vectorized information gain of many candidate partitions of the same examples at once.
+		Parameters
+		---------
+		satisfied : boolean np array of shape (num_examples,num_candidates)
+					column j is True for the examples sent to the left partition by the jth candidate
+		y : np array of shape (num_examples,) 
+			the category/class labels
+		Returns
+		-------
+		gains : np array of shape (num_candidates,)
+		'''
+		classes,total_counts = np.unique(y,return_counts=True)
+		return SplitFinder.count_gains(SplitFinder.class_counts(satisfied,y,classes),total_counts)
+
+	@staticmethod
+	def candidate_conditions(X,num_thresholds):
+		'''
+		Returns the boolean tests considered for m-of-n splits, as a list of (feature,operator,value) 
+		along with their boolean condition matrix of shape (num_examples,num_candidates).
+		For each feature, up to num_thresholds quantiles of its values are used as thresholds, each with the "lte" and "gt" operators.
+		'''
+		quantiles = np.linspace(0,1,num_thresholds+2)[1:-1]
+		thresholds = [np.unique(np.quantile(X[:,i],quantiles)) for i in range(0,X.shape[1])]
+		conditions=[]
+		#filled in place, as stacking a list of columns would hold the matrix twice
+		matrix = np.empty((X.shape[0],2*sum(len(values) for values in thresholds)),dtype=bool)
+		for (i,values) in enumerate(thresholds):
+			for value in values:
+				column = len(conditions)
+				np.less_equal(X[:,i],value,out=matrix[:,column])
+				np.logical_not(matrix[:,column],out=matrix[:,column+1])
+				conditions.append((i,"lte",value))
+				conditions.append((i,"gt",value))
+		return conditions,matrix
+
+	@staticmethod
+	def find_best_m_of_n_split(examples,max_conditions=5,num_thresholds=16):
 		'''
 		Find the best m-of-n split. An m-of-n split, is a splitting function composed of n boolean expressions.
 		An m-of-n split is satisifed if at least m-of-n expressions is satisfied
-		TODO: Right now just returns a binary split
+		The search is the hill climbing search of the TREPAN paper, seeded with the best single feature (C4.5) split.
+		At each step, every candidate condition (see candidate_conditions) is tried with both of the paper's operators,
+		m-of-n -> m-of-(n+1) and m-of-n -> (m+1)-of-(n+1), and the best one is kept if it increases the information gain.
+		The candidates of a step are evaluated together: an example satisfies the current split extended with a candidate if it
+		already satisfies the new m, or if it is one condition short and satisfies the candidate, so only the condition matrix
+		rows of the examples one condition short are counted.
+		Parameters
+		---------
+		max_conditions	: int, maximum n of the split. 1 gives the plain C4.5 split.
+		num_thresholds	: int, number of candidate thresholds per feature
 		'''
 
 		seed= SplitFinder.find_best_single_feature_split(examples)
-		##TODO find best m-of-n split with hill climbing method, with C4.5 split as 
-		srule=seed
+		if not seed or max_conditions<2:
+			return seed
+
+		(X,labels)=examples
+		labels = np.reshape(labels,X.shape[0])
+		splits = list(seed.splits)
+		m,n = seed.m,seed.n
+		best_gain = SplitFinder.partition_gains(seed.satisfied_batch(X)[:,None],labels)[0]
+		conditions,condition_matrix = SplitFinder.candidate_conditions(X,num_thresholds)
+		used = np.array([condition in splits for condition in conditions])
+
+		classes,total_counts = np.unique(labels,return_counts=True)
+		#number of conditions of the current split satisfied by each example
+		counts = seed.condition_matrix(X).sum(axis=1)
+		while n<max_conditions:
+			#the first half adds condition j keeping m, the second half adds it and increments m
+			gains=[]
+			for new_m in (m,m+1):
+				satisfied = counts>=new_m
+				left_counts = np.array([np.count_nonzero(satisfied & (labels==class_c)) for class_c in classes])[None,:]
+				left_counts = left_counts + SplitFinder.class_counts(condition_matrix,labels,classes,rows=counts==new_m-1)
+				gains.append(SplitFinder.count_gains(left_counts,total_counts))
+			gains = np.concatenate(gains)
+			gains[np.concatenate([used,used])] = -np.inf
+			best = np.argmax(gains)
+			if gains[best] <= best_gain + 1e-6:
+				break
+			best_gain = gains[best]
+			condition_idx = best % len(conditions)
+			splits.append(conditions[condition_idx])
+			used[condition_idx] = True
+			counts = counts + condition_matrix[:,condition_idx]
+			if best >= len(conditions):
+				m+=1
+			n+=1
+
+		srule=SplitRule(splits,m,n)
 		return srule
 
 
@@ -272,20 +580,67 @@ def partition(examples,srule):
 	examples_l,examples_r : np arrays of shape (*,num_dimensions)
 	'''
 	(X,y) = examples
-	num_examples = X.shape[0]
-	left_partition,right_partition=[[],[]]
-
-	for idx in range(0,num_examples):
-		if srule.satisfied(X[idx,:]):
-			left_partition.append(idx)
-		else:
-			right_partition.append(idx)
+	left_partition = srule.satisfied_batch(X)
+	right_partition = ~left_partition
 
 	examples_l = (X[left_partition,:],y[left_partition])
 	examples_r = (X[right_partition,:],y[right_partition])
 	return examples_l,examples_r
 
 
+#smallest kernel bandwidth, a constant feature would otherwise get a bandwidth of 0 and divide by zero
+MIN_BANDWIDTH = 1e-6
+
+
+def log_normal_interval_mass(lower,upper):
+	'''
+	Utility function returning log(Phi(upper) - Phi(lower)) elementwise, where Phi is the standard normal CDF.
+	Intervals lying in the upper tail are reflected to the lower tail, so that the difference is not lost
+	to rounding when both CDF values are close to 1.
+	'''
+	flip = lower > 0
+	lo = np.where(flip,-upper,lower)
+	hi = np.where(flip,-lower,upper)
+	log_lo = special.log_ndtr(lo)
+	log_hi = special.log_ndtr(hi)
+	with np.errstate(divide='ignore'):
+		return log_hi + np.log1p(-np.exp(log_lo-log_hi))
+
+
+def sample_truncated_kde(kernel,min_val,max_val,num_samples):
+	'''
+	Utility function to draw samples from a 1-D gaussian KDE restricted to the interval (min_val,max_val).
+	The KDE is a mixture of gaussians centred on its data points, so the restricted KDE is a mixture of truncated
+	gaussians, where each centre is weighted by its original weight times its probability mass inside the interval.
+	Centres are drawn according to these weights, then each value is drawn from the truncated gaussian of its centre.
+	There is no rejection loop, so the effort is bounded however narrow the interval is, even when it lies far in the tails.
+	Parameters
+	----------
+	kernel 			: scipy.stats.gaussian_kde fitted on a single feature
+	min_val,max_val : float, bounds of the interval, may be infinite
+	num_samples		: int
+	Returns
+	-------
+	samples : np array of shape (num_samples,)
+	'''
+	if not min_val < max_val:
+		raise ValueError("Cannot sample from empty interval ("+str(min_val)+","+str(max_val)+")")
+
+	centres = kernel.dataset[0]
+	bandwidth = max(np.sqrt(kernel.covariance[0,0]),MIN_BANDWIDTH)
+	lower = (min_val - centres)/bandwidth
+	upper = (max_val - centres)/bandwidth
+
+	#mixture weights of the truncated kernels, normalized in log space to avoid underflow
+	log_weights = np.log(kernel.weights) + log_normal_interval_mass(lower,upper)
+	probs = np.exp(log_weights - np.max(log_weights))
+	probs /= probs.sum()
+
+	chosen = np.random.choice(centres.shape[0],size=num_samples,p=probs)
+	offsets = stats.truncnorm.rvs(lower[chosen],upper[chosen],size=num_samples)
+	return centres[chosen] + bandwidth*offsets
+
+
 ###########################################
 
 
@@ -295,23 +650,43 @@ class Oracle:
 	constrained distribution of training examples.
 	'''
 
-	def __init__(self,network,num_classes,trainX):
+	MAX_REJECTION_ROUNDS = 20
+
+	def __init__(self,network,num_classes,trainX,max_centres=None):
+		'''
+		Parameters
+		----------
+		network		: model to imitate, network.predict(examples) must return one hot outputs of shape (num_examples,num_classes)
+		num_classes	: int
+		trainX		: numpy array of dimension (num_examples,num_dimensions)
+		max_centres	: int or None
+					  memory budget of the feature distributions, as the maximum number of kernel centres kept per feature.
+					  None keeps one centre per training example (exact KDE). Otherwise a BinnedKDE is used, so that the oracle
+					  stays small enough to be built over millions of rows and pickled to worker processes.
+		'''
 		self.network=network
 		self.num_classes=num_classes
 		self.dimension=trainX.shape[1]
+		self.max_centres=max_centres
 		self.feature_distributions=self.generate_feature_distributions(trainX)
 
 	def generate_feature_distributions(self,trainX):
 		'''
 		Returns a list of objects modeling the probability distributions of each feature.
-		For continuous features we use Gaussian Kernel Density Estimation from scipy.stats
+		For continuous features we use Gaussian Kernel Density Estimation from scipy.stats, or its BinnedKDE approximation if max_centres is set
 		'''
 
 		feature_distributions =[]
 		#only consider continuous distributions
 		for i in range(0,self.dimension):
 			feature_values = trainX[:,i].reshape(trainX.shape[0])
-			kernel = stats.gaussian_kde(feature_values,bw_method='silverman')
+			if np.ptp(feature_values)==0:
+				#a single centre, with the MIN_BANDWIDTH floor
+				kernel = BinnedKDE(feature_values,1)
+			elif self.max_centres is None:
+				kernel = stats.gaussian_kde(feature_values,bw_method='silverman')
+			else:
+				kernel = BinnedKDE(feature_values,self.max_centres)
 			feature_distributions.append(kernel)
 		return feature_distributions
 
@@ -326,43 +701,55 @@ class Oracle:
 		onehot =self.network.predict(np.array([example])).reshape(self.num_classes)
 		return np.argmax(onehot)
 
+	def get_oracle_labels(self,examples):
+		'''
+		Returns the labels predicted by the oracle network for a batch of examples, using a single call to the network.
+		examples must have dimension (num_examples,num_dimensions)
+		'''
+		onehot =self.network.predict(examples).reshape(examples.shape[0],self.num_classes)
+		return np.argmax(onehot,axis=1)
+
 	def generate_constrained_examples_with_labels(self,constraints,num_examples):
 		'''
 		Returns a tuple of examples,oracle_labels , where examples are drawn from the distribution of the
 		training examples, after constraints have been applied to it.
 		'''
 
-		examples= np.zeros((num_examples,self.dimension))
-		oracle_labels = np.zeros(num_examples)
-		i=0
-		print(num_examples)
-		for i in range(0,num_examples):
-			example=self.generate_constrained_example(constraints)
-			label=self.get_oracle_label(example)
-			examples[i,:]=example
-			oracle_labels[i]=label
-											
+		examples=self.generate_constrained_examples(constraints,num_examples)
+		oracle_labels=self.get_oracle_labels(examples)
 		return (examples,oracle_labels)
 
-	#can be more efficient
-	def generate_constrained_example(self,constraints):
+	def generate_constrained_examples(self,constraints,num_examples):
 		'''
-		Returns an example drawn from the distribution of the training examples, after constraints have been applied to it.
+		Returns num_examples examples drawn from the distribution of the training examples, after constraints have been applied to it.
+		All rows are filled at once, one batched draw per feature (see sample_truncated_kde).
+		The bounds on each feature are always respected. Rows violating the m-of-n rules of the constraints (constraints.cons_list) 
+		are redrawn, at most MAX_REJECTION_ROUNDS times, after which the remaining rows are kept as they are.
 		'''
 
-		example = np.zeros(self.dimension)
+		examples = self.sample_within_bounds(constraints,num_examples)
+		invalid = ~constraints.satisfied_batch(examples)
+		num_rounds = 0
+		while invalid.any() and num_rounds<self.MAX_REJECTION_ROUNDS:
+			examples[invalid,:]=self.sample_within_bounds(constraints,int(invalid.sum()))
+			invalid[invalid] = ~constraints.satisfied_batch(examples[invalid,:])
+			num_rounds+=1
+		return examples
+
+	def sample_within_bounds(self,constraints,num_examples):
+		examples= np.zeros((num_examples,self.dimension))
 		#assuming features have independent distributions, sample each feature separately
 		for i in range(0,self.dimension):
-			min_val = constraints.min_val(i)
-			max_val = constraints.max_val(i)
-			done=False
-			#generate the ith feature by rejection sampling
-			while not done :
-				#sample i^th feature from its distribution
-				example[i]=self.feature_distributions[i].resample(1)[0]
-				if example[i] > min_val and example[i] < max_val :
-					done=True
-		return example
+			examples[:,i]=sample_truncated_kde(self.feature_distributions[i],
+												constraints.min_val(i),constraints.max_val(i),num_examples)
+		return examples
+
+	def generate_constrained_example(self,constraints):
+		'''
+		Returns an example drawn from the distribution of the training examples, after constraints have been applied to it.
+		'''
+
+		return self.generate_constrained_examples(constraints,1)[0]
 
 	def is_valid_example(self,example,constraints):
 		'''
@@ -379,6 +766,53 @@ class Oracle:
 ###########################################
 
 
+class BinnedKDE:
+	'''
+	Compact approximation of scipy.stats.gaussian_kde for a single feature, holding at most max_centres weighted kernel centres
+	instead of every training value. The values are binned into max_centres equal width bins, and each non empty bin
+	is replaced by the mean of its values, weighted by its count. The bandwidth is silverman's bandwidth of the full set of values,
+	so the approximation only differs from the exact KDE by the position of the centres within a bin.
+	Exposes the fields used by sample_truncated_kde (dataset, weights, covariance) and the resample/evaluate
+	methods of gaussian_kde, and only holds small numpy arrays so it is cheap to pickle.
+	'''
+
+	def __init__(self,feature_values,max_centres):
+		num_values = feature_values.shape[0]
+		counts,edges = np.histogram(feature_values,bins=max_centres)
+		sums,_ = np.histogram(feature_values,bins=edges,weights=feature_values)
+		non_empty = counts>0
+
+		self.dataset = (sums[non_empty]/counts[non_empty]).reshape(1,-1)
+		self.weights = counts[non_empty]/float(num_values)
+		#silverman's factor for 1-D data
+		factor = (num_values*3.0/4.0)**(-1.0/5)
+		variance = np.var(feature_values,ddof=1) if num_values>1 else 0.0
+		self.covariance = np.array([[max(variance*factor**2,MIN_BANDWIDTH**2)]])
+
+	def resample(self,size):
+		'''
+		Returns size samples from the KDE, with dimension (1,size) as in gaussian_kde.
+		'''
+		centres = self.dataset[0]
+		chosen = np.random.choice(centres.shape[0],size=size,p=self.weights)
+		samples = centres[chosen] + np.sqrt(self.covariance[0,0])*np.random.randn(size)
+		return samples.reshape(1,size)
+
+	def evaluate(self,points):
+		'''
+		Returns the estimated density at each of the points, with dimension (num_points,)
+		'''
+		points = np.atleast_1d(points).reshape(-1)
+		bandwidth = np.sqrt(self.covariance[0,0])
+		densities = stats.norm.pdf((points[:,None]-self.dataset[0][None,:])/bandwidth)/bandwidth
+		return densities.dot(self.weights)
+
+	__call__ = evaluate
+
+
+###########################################
+
+
 class Node:
 	'''
 	Object represents a single node in the decision tree. It's important fields are
@@ -409,8 +843,6 @@ class Node:
 			self.fidelity = 1 - (float(self.misclassified)/self.num_examples)
 			self.reach = float(self.num_examples)/total_num_examples
 			self.priority = (-1)*self.reach* (1 - self.fidelity)
-		
-		print("NEW NODE! with priority = "+ str(self.priority))
 
 	def get_dominant_class(self,labeled_examples):
 		'''
@@ -470,18 +902,171 @@ class Node:
 ###########################################
 
 
+class CompiledTree:
+	'''
+	Array form of a tree built by Trepan.build_tree, to classify and explain batches of examples at once.
+	Nodes are numbered in preorder, and the decision path of every leaf (the conjunction of the SplitRules, or of their inverses, met
+	from the root to the leaf) is rendered once when the tree is compiled. Explaining any number of examples then costs one vectorized
+	traversal of the tree, which evaluates the SplitRule of each internal node once on all the examples reaching it, and a lookup of
+	the rendered paths by leaf id.
+	Parameters
+	----------
+	root			: Node, the root returned by Trepan.build_tree
+	feature_names	: List[str] or None, names of the features used in the rendered paths, x[i] for feature i if None
+	'''
+
+	OP_SYMBOLS = {"gte":">=","lte":"<=","gt":">","lt":"<"}
+
+	def __init__(self,root,feature_names=None):
+		self.feature_names=feature_names
+		self.left=[]
+		self.right=[]
+		self.leaf=[]
+		self.dominant=[]
+		self.splitrules=[]
+		#rules met on the way to each node, and whether each was satisfied
+		self.path_rules=[]
+
+		#iterative preorder traversal, nodes without examples predict the dominant class of their parent
+		stack=[(root,None,[],0)]
+		while stack:
+			(node,parent_id,path,parent_dominant)=stack.pop()
+			node_id=len(self.leaf)
+			if parent_id is not None:
+				(parent,satisfied)=parent_id
+				if satisfied:
+					self.left[parent]=node_id
+				else:
+					self.right[parent]=node_id
+			dominant = node.dominant if node.num_examples>0 else parent_dominant
+			self.left.append(-1)
+			self.right.append(-1)
+			self.leaf.append(node.leaf)
+			self.dominant.append(dominant)
+			self.splitrules.append(node.splitrule)
+			self.path_rules.append(path)
+			if not node.leaf:
+				#pushed right first, so the left subtree is numbered first
+				stack.append((node.right_child,(node_id,False),path+[(node.splitrule,False)],dominant))
+				stack.append((node.left_child,(node_id,True),path+[(node.splitrule,True)],dominant))
+
+		self.left=np.array(self.left)
+		self.right=np.array(self.right)
+		self.leaf=np.array(self.leaf)
+		self.dominant=np.array(self.dominant)
+		self.internal_nodes=np.flatnonzero(~self.leaf)
+		#rendered decision path of every leaf, None for internal nodes
+		self.paths=np.empty(len(self.leaf),dtype=object)
+		for node_id in np.flatnonzero(self.leaf):
+			self.paths[node_id]=self.render_path(node_id)
+
+	def feature_name(self,feature_idx):
+		if self.feature_names is None:
+			return "x[%d]" % feature_idx
+		return str(self.feature_names[feature_idx])
+
+	def render_rule(self,srule):
+		'''
+		Renders a SplitRule, e.g. "x[0] >= 0.5" for a single condition, "x[0] >= 0.5 AND x[1] < 0.3" for a conjunction
+		and "at least 2 of (x[0] >= 0.5, x[1] < 0.3, x[2] > 1.5)" otherwise.
+		'''
+		conditions=["%s %s %.6g" % (self.feature_name(feature_idx),self.OP_SYMBOLS[op_string],val)
+					for (feature_idx,op_string,val) in srule.splits]
+		if srule.is_conjunction():
+			return " AND ".join(conditions)
+		return "at least %d of (%s)" % (srule.m,", ".join(conditions))
+
+	def render_path(self,node_id):
+		'''
+		Renders the decision path from the root to a node, e.g. "x[0] >= 0.5 AND x[2] <= 1.5 => class 1".
+		The rules not satisfied on the path are rendered as their inverse (see SplitRule.invert).
+		'''
+		parts=[]
+		for (srule,satisfied) in self.path_rules[node_id]:
+			parts.append(self.render_rule(srule if satisfied else srule.invert()))
+		condition = " AND ".join(parts) if parts else "always"
+		return "%s => class %s" % (condition,self.dominant[node_id])
+
+	def leaf_ids(self,X):
+		'''
+		Routes a batch of examples to their leaves.
+		Parameters
+		----------
+		X : np array of shape (num_examples,num_features)
+		Returns
+		---------
+		np array of shape (num_examples,), the id of the leaf reached by each example
+		'''
+		X=np.asarray(X)
+		node_ids=np.zeros(X.shape[0],dtype=np.int64)
+		#examples only move down, so in preorder each internal node is visited after the nodes above it
+		for node_id in self.internal_nodes:
+			at_node=np.flatnonzero(node_ids==node_id)
+			if len(at_node)==0:
+				continue
+			satisfied=self.splitrules[node_id].satisfied_batch(X[at_node])
+			node_ids[at_node]=np.where(satisfied,self.left[node_id],self.right[node_id])
+		return node_ids
+
+	def classify_batch(self,X):
+		'''
+		Vectorized version of Node.classify for examples of shape (num_examples,num_features).
+		'''
+		return self.dominant[self.leaf_ids(X)]
+
+	def explain(self,X):
+		'''
+		Classifies and explains a batch of examples.
+		Parameters
+		----------
+		X : np array of shape (num_examples,num_features)
+		Returns
+		---------
+		leaf_ids	: np array of shape (num_examples,), the leaf reached by each example
+		predictions	: np array of shape (num_examples,), the class predicted by the tree
+		paths		: np array of shape (num_examples,) of str, the rendered decision path of each example (shared per leaf)
+		'''
+		leaf_ids=self.leaf_ids(X)
+		return leaf_ids,self.dominant[leaf_ids],self.paths[leaf_ids]
+
+	def decision_path(self,leaf_id):
+		'''
+		Returns the list of (SplitRule,satisfied) met from the root to a leaf, satisfied being False where the example went right.
+		'''
+		return self.path_rules[leaf_id]
+
+
+###########################################
+
+
 class Constraints :
 
 	def __init__(self,num_dim):
-		# self.cons_list=[]
+		#m-of-n rules with m<n, which cannot be expressed as bounds on each feature
+		self.cons_list=[]
 		self.num_dim=num_dim
-		self.max_list = np.zeros(num_dim)
-		self.min_list = np.zeros(num_dim)
+		#unconstrained, i.e. every feature lies in (-inf,inf)
+		self.max_list = np.full(num_dim,np.inf)
+		self.min_list = np.full(num_dim,-np.inf)
 
 	def addRule(self,split):
+		if not split.is_conjunction():
+			self.cons_list.append(split)
+			return
+		#each rule added can only narrow the interval of a feature
 		for i in range(0,self.num_dim):
-			self.max_list[i]=max(self.max_list[i],split.max_val(i))
-			self.min_list[i]=min(self.min_list[i],split.min_val(i))
+			self.max_list[i]=min(self.max_list[i],split.max_val(i))
+			self.min_list[i]=max(self.min_list[i],split.min_val(i))
+
+	def satisfied_batch(self,samples):
+		'''
+		Returns a boolean np array of shape (num_examples,), True for the samples satisfying the rules of cons_list.
+		The bounds on each feature are not checked, samples are expected to be drawn within them.
+		'''
+		valid = np.ones(samples.shape[0],dtype=bool)
+		for split in self.cons_list:
+			valid &= split.satisfied_batch(samples)
+		return valid
 
 	def max_val(self,dim):
 		return self.max_list[dim]
@@ -493,6 +1078,7 @@ class Constraints :
 		c = Constraints(self.num_dim)
 		c.max_list=np.copy(self.max_list)
 		c.min_list=np.copy(self.min_list)
+		c.cons_list=list(self.cons_list)
 		return c
 
 
@@ -505,7 +1091,7 @@ class SplitRule:
 	The function is particularly an m-of-n expression which is composed of n boolean value expressions,
 	and which is satisfied by an example if at least m out of n expressions is satisfied.
 	The boolean expressions are linear inequalities/equalities.
-	Keeps a list of upper and lower bounds on each feature. Used by constraints object.
+	Keeps a list of upper and lower bounds on each feature when the rule is a conjunction (m=n). Used by constraints object.
 	Parameters
 	---------
 	splits	: List[(feature_to_split,operator,split_value)]
@@ -517,21 +1103,30 @@ class SplitRule:
 		self.splits=splits
 		self.m=m
 		self.n=n
-		self.op_dict= {"gte":self.gte,"lte":self.lte}
+		self.op_dict= {"gte":self.gte,"lte":self.lte,"gt":self.gt,"lt":self.lt}
 		self.process_splits()
 
 	def process_splits(self):
 		self.max_dict={}
 		self.min_dict={}
+		#the examples satisfying an m-of-n rule with m<n do not lie within per feature bounds
+		if not self.is_conjunction():
+			return
 		for (feature_to_split,operator,split_value) in self.splits:
 			if operator in ["lte" ,"lt"]:
 				if feature_to_split not in self.max_dict:
 					self.max_dict[feature_to_split]=split_value
-				self.max_dict[feature_to_split] = max(self.max_dict[feature_to_split],split_value)
+				self.max_dict[feature_to_split] = min(self.max_dict[feature_to_split],split_value)
 			elif operator in ["gte","gt"]:
 				if feature_to_split not in self.min_dict:
 					self.min_dict[feature_to_split]=split_value
-				self.min_dict[feature_to_split] = min(self.min_dict[feature_to_split],split_value)
+				self.min_dict[feature_to_split] = max(self.min_dict[feature_to_split],split_value)
+
+	def is_conjunction(self):
+		'''
+		Returns True if all the constraints of this splitrule must be satisfied, i.e. m=n.
+		'''
+		return self.m==self.n
 
 	#for building constraints
 	def invert(self):
@@ -540,14 +1135,15 @@ class SplitRule:
 		Does this by inverting each of the individual constraints.
 		While at each level, only one (left child's) split is evaluated, 
 		We need to pass the inverse to the right child to add to its list of constraints.
-		Note: What is the inverse of an m-of-n split? 
+		An m-of-n split is not satisfied when at most m-1 constraints are satisfied, 
+		i.e. when at least n-m+1 of the inverted constraints are satisfied.
 		'''
 		inverted_splits= []
 		inverse_map = {"gte":"lt","gt":"lte","lte":"gt","lt":"gte"}
 		for (feature_to_split,operator,val) in self.splits:
 			inverse_operator=inverse_map[operator]
 			inverted_splits.append((feature_to_split,inverse_operator,val))
-		invsplit = SplitRule(inverted_splits,self.m,self.n)
+		invsplit = SplitRule(inverted_splits,self.n-self.m+1,self.n)
 		return invsplit
 
 	def gte(self,arg1, arg2):
@@ -585,6 +1181,30 @@ class SplitRule:
 		else:
 			return True
 
+	def condition_matrix(self,samples):
+		'''
+		Evaluates each of the n constraints on a batch of samples.
+		
+		Parameters
+		----------
+		samples : np array of shape (num_examples,num_features)
+		Returns
+		---------
+		boolean np array of shape (num_examples,n), True where a sample satisfies a constraint
+		'''
+		matrix = np.zeros((samples.shape[0],self.n),dtype=bool)
+		for j,(feature_idx,op_string,val) in enumerate(self.splits):
+			op = self.op_dict[op_string]
+			matrix[:,j]=op(samples[:,feature_idx],val)
+		return matrix
+
+	def satisfied_batch(self,samples):
+		'''
+		Vectorized version of satisfied for samples of shape (num_examples,num_features).
+		Returns a boolean np array of shape (num_examples,), True for the samples satisfying at least m constraints
+		'''
+		return self.condition_matrix(samples).sum(axis=1) >= self.m
+
 
 	def max_val(self,dim):
 		if dim in self.max_dict :
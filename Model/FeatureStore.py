@@ -0,0 +1,260 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from Model.Preprocessing import TransactionPreprocessor
+from Model.Streaming import read_csv_chunks, split_features
+
+# builds features from a source file, chunk by chunk, as (features, labels) pairs
+FeatureBuilder = Callable[..., Iterator[Tuple[pd.DataFrame, np.ndarray]]]
+
+
+def csv_feature_chunks(source_path: str, label_column: str, normalize: bool = False, chunksize: int = 100000) -> Iterator[Tuple[pd.DataFrame, np.ndarray]]:
+    """
+    Feature builder for numeric CSV files such as creditcard.csv: every column but the label, optionally L2-normalised per row as in test.py.
+
+    :param source_path: String representing the CSV file path.
+    :param label_column: String representing the label column.
+    :param normalize: Boolean representing whether rows are L2-normalised.
+    :param chunksize: Integer representing the number of rows read at once.
+    :return: Iterator of (features, labels) chunks
+    """
+    for chunk in read_csv_chunks(source_path, chunksize):
+        yield split_features(chunk, label_column, normalize)
+
+
+def transaction_feature_chunks(source_path: str, label_column: str = 'Behaviour ID', chunksize: int = 100000,
+                               num_hash_buckets: int = 2 ** 16, max_categories: int = 50) -> Iterator[Tuple[pd.DataFrame, np.ndarray]]:
+    """
+    Feature builder for simulated transactions such as df_simulated.csv: a TransactionPreprocessor is fitted over a first pass on the file,
+    then the chunks are transformed in a second pass. Labels are 1 for any fraudulent behaviour and 0 otherwise.
+
+    :param source_path: String representing the CSV file path.
+    :param label_column: String representing the label column.
+    :param chunksize: Integer representing the number of rows read at once.
+    :param num_hash_buckets: Integer passed to TransactionPreprocessor.
+    :param max_categories: Integer passed to TransactionPreprocessor.
+    :return: Iterator of (features, labels) chunks
+    """
+    preprocessor = TransactionPreprocessor(num_hash_buckets=num_hash_buckets, max_categories=max_categories)
+    for chunk in read_csv_chunks(source_path, chunksize):
+        preprocessor.partial_fit(chunk.drop(label_column, axis=1))
+
+    for chunk in read_csv_chunks(source_path, chunksize):
+        yield preprocessor.transform(chunk.drop(label_column, axis=1)), (chunk[label_column] != 0).astype(int).to_numpy()
+
+
+class FeatureSet:
+    """
+    FeatureSet object. Preprocessed features of a source file, memory-mapped read-only, with their labels and cached split indices.
+    """
+
+    def __init__(self, features: np.ndarray, labels: np.ndarray, columns: List[str], splits: Dict[str, np.ndarray]):
+        self.features = features
+        self.labels = labels
+        self.columns = columns
+        self.splits = splits
+
+    def split(self, name: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Gets the features and labels of a cached split.
+
+        :param name: String representing the split, 'train' or 'test'.
+        :return: Tuple of the features and the labels of the split
+        """
+        indices = self.splits[name]
+
+        return self.features[indices], self.labels[indices]
+
+
+class FeatureStore:
+    """
+    FeatureStore object
+
+    Materialises the preprocessed features of a source file once, as a float32 matrix memory-mapped from disk together with the labels and
+    the train/test split indices. Entries are keyed by a hash of the source file content and of the preprocessing configuration, so
+    repeated experiments load them instantly, and processes loading the same entry share its pages through the OS page cache.
+    """
+
+    FEATURES_FILE = 'features.f32'
+    LABELS_FILE = 'labels.npy'
+    METADATA_FILE = 'metadata.json'
+    # digests of the source files by path, size and modification time, so unchanged files are not read again to find their entries
+    HASHES_FILE = 'source_hashes.json'
+
+    def __init__(self, root: str = 'Model/feature_store'):
+        """
+        Initialises the FeatureStore object.
+
+        :param root: String representing the directory the entries are stored in.
+        """
+        self.root = root
+
+    @staticmethod
+    def file_hash(path: str, block_size: int = 1 << 20) -> str:
+        """
+        Hashes the content of a file, reading it block by block.
+
+        :param path: String representing the file path.
+        :param block_size: Integer representing the number of bytes read at once.
+        :return: String representing the sha256 hex digest
+        """
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                digest.update(block)
+
+        return digest.hexdigest()
+
+    def source_hash(self, path: str) -> str:
+        """
+        Gets the digest of a source file, reading the file only if its size or modification time changed since its digest was recorded in
+        HASHES_FILE.
+
+        :param path: String representing the file path.
+        :return: String representing the sha256 hex digest
+        """
+        stat = os.stat(path)
+        path = os.path.abspath(path)
+        hashes_path = os.path.join(self.root, self.HASHES_FILE)
+        try:
+            with open(hashes_path) as f:
+                hashes = json.load(f)
+        except (OSError, ValueError):
+            hashes = {}
+
+        recorded = hashes.get(path)
+        if recorded is not None and recorded['size'] == stat.st_size and recorded['mtime_ns'] == stat.st_mtime_ns:
+            return recorded['sha256']
+
+        digest = self.file_hash(path)
+        hashes[path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest}
+        # replaced atomically, a concurrent writer can at worst drop a digest, which is then computed again
+        os.makedirs(self.root, exist_ok=True)
+        handle, temporary_path = tempfile.mkstemp(dir=self.root, prefix='.hashes-')
+        with os.fdopen(handle, 'w') as f:
+            json.dump(hashes, f)
+        os.replace(temporary_path, hashes_path)
+
+        return digest
+
+    def key(self, source_path: str, builder: FeatureBuilder, config: dict, test_size: float, random_state: int) -> str:
+        """
+        Computes the key of an entry from the source file content, the builder and its configuration, and the split parameters.
+
+        :return: String representing the key
+        """
+        description = json.dumps({'source': self.source_hash(source_path), 'builder': f"{builder.__module__}.{builder.__qualname__}",
+                                  'config': config, 'test_size': test_size, 'random_state': random_state}, sort_keys=True)
+
+        return hashlib.sha256(description.encode()).hexdigest()[:32]
+
+    def load_or_build(self, source_path: str, builder: FeatureBuilder, test_size: float = 0.2, random_state: int = 40, **config) -> FeatureSet:
+        """
+        Loads the features of a source file from the store, building and storing them first if they are not there yet.
+
+        :param source_path: String representing the source file path.
+        :param builder: Function yielding (features, labels) chunks from source_path and config, e.g. csv_feature_chunks.
+        :param test_size: Float representing the proportion of rows in the stratified test split.
+        :param random_state: Integer representing the seed of the split.
+        :param config: JSON-serialisable keyword arguments passed to the builder, part of the key.
+        :return: FeatureSet object
+        """
+        directory = os.path.join(self.root, self.key(source_path, builder, config, test_size, random_state))
+        if not os.path.exists(os.path.join(directory, self.METADATA_FILE)):
+            self.build(directory, source_path, builder, config, test_size, random_state)
+
+        return self.load(directory)
+
+    def build(self, directory: str, source_path: str, builder: FeatureBuilder, config: dict, test_size: float, random_state: int) -> None:
+        """
+        Writes an entry chunk by chunk into a temporary directory, then moves it into place, so concurrent builders never see a partial entry.
+
+        :return: None
+        """
+        from sklearn.model_selection import train_test_split
+
+        os.makedirs(self.root, exist_ok=True)
+        building = tempfile.mkdtemp(dir=self.root, prefix='.building-')
+        try:
+            num_rows = 0
+            columns = None
+            labels = []
+            with open(os.path.join(building, self.FEATURES_FILE), 'wb') as f:
+                for features, chunk_labels in builder(source_path, **config):
+                    columns = [str(column) for column in features.columns]
+                    f.write(np.ascontiguousarray(features.to_numpy(), dtype=np.float32).tobytes())
+                    labels.append(np.asarray(chunk_labels))
+                    num_rows += len(features)
+
+            if num_rows == 0:
+                raise ValueError(f"The builder {builder.__qualname__} yielded no rows from {source_path} with config {config}")
+
+            labels = np.concatenate(labels)
+            np.save(os.path.join(building, self.LABELS_FILE), labels)
+
+            indices = np.arange(num_rows)
+            stratify = labels if np.unique(labels).shape[0] > 1 else None
+            train, test = train_test_split(indices, test_size=test_size, random_state=random_state, stratify=stratify)
+            splits = {'train': np.sort(train), 'test': np.sort(test)}
+            for name, split_indices in splits.items():
+                np.save(os.path.join(building, f'split_{name}.npy'), split_indices)
+
+            # written last, marks the entry as complete
+            with open(os.path.join(building, self.METADATA_FILE), 'w') as f:
+                json.dump({'source_path': source_path, 'config': config, 'shape': [num_rows, len(columns)], 'columns': columns,
+                           'splits': list(splits)}, f)
+
+            try:
+                os.rename(building, directory)
+            except OSError:
+                # another process stored the same entry first
+                if not os.path.exists(os.path.join(directory, self.METADATA_FILE)):
+                    raise
+        finally:
+            shutil.rmtree(building, ignore_errors=True)
+
+    def load(self, directory: str) -> FeatureSet:
+        """
+        Memory-maps a stored entry.
+
+        :param directory: String representing the directory of the entry.
+        :return: FeatureSet object
+        """
+        with open(os.path.join(directory, self.METADATA_FILE)) as f:
+            metadata = json.load(f)
+
+        features = np.memmap(os.path.join(directory, self.FEATURES_FILE), dtype=np.float32, mode='r', shape=tuple(metadata['shape']))
+        labels = np.load(os.path.join(directory, self.LABELS_FILE), mmap_mode='r')
+        splits = {name: np.load(os.path.join(directory, f'split_{name}.npy'), mmap_mode='r') for name in metadata['splits']}
+
+        return FeatureSet(features, labels, metadata['columns'], splits)
+
+    def clear(self, source_path: Optional[str] = None) -> None:
+        """
+        Removes the stored entries, only those built from source_path if given.
+
+        :param source_path: String representing a source file path.
+        :return: None
+        """
+        if not os.path.isdir(self.root):
+            return
+
+        for name in os.listdir(self.root):
+            directory = os.path.join(self.root, name)
+            if not os.path.isdir(directory):
+                continue
+            if source_path is not None:
+                metadata_path = os.path.join(directory, self.METADATA_FILE)
+                if not os.path.exists(metadata_path):
+                    continue
+                with open(metadata_path) as f:
+                    if json.load(f)['source_path'] != source_path:
+                        continue
+            shutil.rmtree(directory, ignore_errors=True)
@@ -1,78 +1,560 @@
-from typing import Union
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple, Union
 
 import numpy as np
 import pandas as pd
-from sklearn.metrics import confusion_matrix
+
+# sklearn, joblib and tensorflow are imported where they are used, so that loading a persisted model only imports what it needs (see score.py)
+from Model.Evaluation import threshold_curve
+from Model.Preprocessing import TransactionPreprocessor
+from Model.Streaming import ReservoirSampler, read_csv_chunks
 
 
 class AutoEncoder:
     """
     AutoEncoder object
+
+    Dense autoencoder (10-5-2-5-10 hidden units with relu, sigmoid output, as in Exploration/Models_Autoencoder.ipynb) scoring transactions
+    by their reconstruction error. Training uses TensorFlow, imported only inside fit. The trained weights are then kept as float32 numpy
+    arrays, so scoring (and a model loaded with AutoEncoder.load) runs as plain numpy matrix products without importing TensorFlow.
     """
 
-    def __init__(self):
-        pass
+    def __init__(self, preprocessor: Optional[TransactionPreprocessor] = None, hidden_units: Tuple[int, ...] = (10, 5, 2), epochs: int = 10,
+                 batch_size: int = 32, validation_split: float = 0.2, threshold: Optional[float] = None, threshold_quantile: float = 0.99,
+                 chunk_size: int = 65536):
+        """
+        Initialises the AutoEncoder object.
+
+        :param preprocessor: TransactionPreprocessor shared with other models. A new one is created if not provided.
+        :param hidden_units: Tuple representing the units of the encoder layers, mirrored by the decoder.
+        :param epochs: Integer representing the number of training epochs.
+        :param batch_size: Integer representing the training batch size.
+        :param validation_split: Float representing the proportion of training data held out for validation.
+        :param threshold: Float representing the reconstruction error above which a transaction is fraud. Set from the training errors if None.
+        :param threshold_quantile: Float representing the quantile of the training errors used as threshold when threshold is None.
+        :param chunk_size: Integer representing the number of rows scored at once.
+        """
+        self.preprocessor = preprocessor if preprocessor is not None else TransactionPreprocessor()
+        self.hidden_units = hidden_units
+        self.epochs = epochs
+        self.batch_size = batch_size
+        self.validation_split = validation_split
+        self.threshold = threshold
+        self.threshold_quantile = threshold_quantile
+        self.chunk_size = chunk_size
+
+        # exported parameters, set by fit or load
+        self.weights: List[Tuple[np.ndarray, np.ndarray]] = []
+        self.activations: List[str] = []
+        self.feature_min = None
+        self.feature_scale = None
 
     def preprocess(self, data) -> pd.DataFrame:
-        pass
+        """
+        Transforms raw transactions into features with the (shared) preprocessor, fitting it first if it is not fitted yet.
+
+        :param data: DataFrame representing transactions in the simulated schema
+        :return: DataFrame representing the features
+        """
+        if not self.preprocessor.fitted:
+            self.preprocessor.fit(data)
+
+        return self.preprocessor.transform(data)
 
     def fit(self, data) -> None:
-        pass
+        """
+        Trains the autoencoder on (preprocessed, non-fraud) data with TensorFlow and exports its weights.
+
+        :param data: DataFrame or Numpy array representing the features used for training
+        :return: None
+        """
+        from tensorflow.keras import layers, losses, models, optimizers
+
+        features = np.asarray(data, dtype=np.float32)
+        n_features = features.shape[1]
+
+        # min-max scaling, as the sigmoid output can only reconstruct values in [0, 1]
+        self.feature_min = features.min(axis=0)
+        feature_range = features.max(axis=0) - self.feature_min
+        feature_range[feature_range == 0] = 1
+        self.feature_scale = (1 / feature_range).astype(np.float32)
+        scaled = self.scale(features)
+
+        units = list(self.hidden_units) + list(reversed(self.hidden_units[:-1])) + [n_features]
+        self.activations = ['relu'] * (len(units) - 1) + ['sigmoid']
+
+        autoencoder = models.Sequential()
+        autoencoder.add(layers.Input(shape=(n_features,)))
+        for unit, activation in zip(units, self.activations):
+            autoencoder.add(layers.Dense(units=unit, activation=activation))
+        autoencoder.compile(loss=losses.MSE, optimizer=optimizers.Adam())
+        autoencoder.fit(x=scaled, y=scaled, epochs=self.epochs, batch_size=self.batch_size, validation_split=self.validation_split, verbose=0)
+
+        self.weights = [(kernel.astype(np.float32), bias.astype(np.float32)) for kernel, bias in (layer.get_weights() for layer in autoencoder.layers)]
+
+        if self.threshold is None:
+            self.threshold = float(np.quantile(self.reconstruction_error(features), self.threshold_quantile))
+
+    def scale(self, features: np.ndarray) -> np.ndarray:
+        return (features - self.feature_min) * self.feature_scale
+
+    def reconstruction_error(self, data) -> np.ndarray:
+        """
+        Computes the mean squared reconstruction error of each row, chunk by chunk, with numpy only.
+
+        :param data: DataFrame or Numpy array representing the features to score
+        :return: Numpy array of float32 errors, higher is more anomalous
+        """
+        features = np.asarray(data, dtype=np.float32)
+        errors = np.empty(features.shape[0], dtype=np.float32)
+
+        for start in range(0, features.shape[0], self.chunk_size):
+            scaled = self.scale(features[start:start + self.chunk_size])
+            output = scaled
+            for (kernel, bias), activation in zip(self.weights, self.activations):
+                output = output @ kernel
+                output += bias
+                if activation == 'relu':
+                    np.maximum(output, 0, out=output)
+                else:
+                    # sigmoid, in place
+                    np.negative(output, out=output)
+                    np.exp(output, out=output)
+                    output += 1
+                    np.reciprocal(output, out=output)
+            output -= scaled
+            np.square(output, out=output)
+            errors[start:start + self.chunk_size] = output.mean(axis=1)
+
+        return errors
+
+    def score(self, data) -> np.ndarray:
+        """
+        Computes the anomaly score of each row, i.e. its reconstruction error.
+
+        :param data: DataFrame or Numpy array representing the features to score
+        :return: Numpy array of anomaly scores, higher is more anomalous
+        """
+        return self.reconstruction_error(data)
 
     def predict(self, data) -> Union[list, np.ndarray]:
-        pass
+        """
+        Predicts whether each row is fraud, i.e. its reconstruction error is above the threshold.
+
+        :param data: DataFrame or Numpy array representing the features to predict
+        :return: Numpy array representing the predicted class where 0 is non-fraud and 1 is fraud.
+        """
+        return (self.reconstruction_error(data) > self.threshold).astype(int)
+
+    @property
+    def decision_threshold(self) -> float:
+        """
+        Gets the reconstruction error above which predict flags a row as fraud.
+
+        :return: Float representing the threshold
+        """
+        return self.threshold
+
+    def calibrate(self, data, labels: np.ndarray, metric: str = 'f1') -> pd.DataFrame:
+        """
+        Sets the threshold to the one maximising metric on labelled data, scoring the data once (see calibrate_threshold).
+
+        :param data: DataFrame or Numpy array representing the features of labelled transactions
+        :param labels: Numpy array representing the true classes where 0 is non-fraud and 1 is fraud.
+        :param metric: String representing the metric to maximise: 'precision', 'recall', 'f1' or 'auroc'.
+        :return: DataFrame representing the metrics of every threshold
+        """
+        self.threshold, curve, _ = calibrate_threshold(self.reconstruction_error(data), labels, metric)
+
+        return curve
+
+    def save(self, path: str) -> None:
+        """
+        Exports the trained parameters to a .npz file, which AutoEncoder.load reads back with numpy only.
+
+        :param path: String representing the file path
+        :return: None
+        """
+        arrays = {'activations': np.array(self.activations), 'feature_min': self.feature_min, 'feature_scale': self.feature_scale,
+                  'threshold': np.array(self.threshold)}
+        for i, (kernel, bias) in enumerate(self.weights):
+            arrays[f'kernel_{i}'] = kernel
+            arrays[f'bias_{i}'] = bias
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path: str, preprocessor: Optional[TransactionPreprocessor] = None, chunk_size: int = 65536) -> 'AutoEncoder':
+        """
+        Loads an AutoEncoder exported with save, ready for scoring.
+
+        :param path: String representing the file path
+        :param preprocessor: TransactionPreprocessor to use for preprocess
+        :param chunk_size: Integer representing the number of rows scored at once.
+        :return: AutoEncoder object
+        """
+        with np.load(path) as arrays:
+            model = cls(preprocessor, threshold=float(arrays['threshold']), chunk_size=chunk_size)
+            model.activations = [str(activation) for activation in arrays['activations']]
+            model.feature_min = arrays['feature_min']
+            model.feature_scale = arrays['feature_scale']
+            model.weights = [(arrays[f'kernel_{i}'], arrays[f'bias_{i}']) for i in range(len(model.activations))]
+
+        return model
+
+
+def calibrate_threshold(scores: np.ndarray, labels: np.ndarray, metric: str = 'f1') -> Tuple[float, pd.DataFrame, float]:
+    """
+    Evaluates every possible threshold on anomaly scores (e.g. reconstruction errors) in one pass and picks the best one.
+
+    See Evaluation.threshold_curve: the scores are sorted once and the confusion matrix of every distinct score is read off cumulative counts.
+    A row is predicted as fraud when its score is strictly above the threshold, as in AutoEncoder.predict.
+
+    :param scores: Numpy array representing the anomaly scores, higher is more anomalous.
+    :param labels: Numpy array representing the true classes where 0 is non-fraud and 1 is fraud.
+    :param metric: String representing the column of the curve to maximise: 'precision', 'recall', 'f1' or 'auroc'.
+    :return: Tuple of the best threshold, the curve (DataFrame with threshold, tp, fp, fn, tn, precision, recall, f1, fpr and auroc columns,
+             where auroc is the AUROC of the thresholded predictions) and the AUROC of the scores themselves.
+    """
+    curve, auroc = threshold_curve(scores, labels)
+    best_threshold = float(curve['threshold'].iloc[int(np.argmax(curve[metric].to_numpy()))])
+
+    return best_threshold, curve, auroc
+
+
+def score_in_chunks(score_function: Callable[[np.ndarray], np.ndarray], features: np.ndarray, chunk_size: int, n_jobs: int) -> np.ndarray:
+    """
+    Applies score_function to consecutive chunks of rows, on n_jobs threads, and concatenates the scores.
+
+    Threads are enough as numpy and sklearn release the GIL in their heavy loops, and they avoid copying features to other processes.
+
+    :param score_function: Function mapping a chunk of rows to one score per row.
+    :param features: Numpy array representing the rows to score.
+    :param chunk_size: Integer representing the number of rows per chunk.
+    :param n_jobs: Integer representing the number of threads, -1 for one per CPU.
+    :return: Numpy array representing the score of each row.
+    """
+    chunks = [features[start:start + chunk_size] for start in range(0, features.shape[0], chunk_size)]
+    if len(chunks) == 0:
+        return np.zeros(0)
+    num_threads = os.cpu_count() if n_jobs == -1 else n_jobs
+    if num_threads <= 1 or len(chunks) == 1:
+        return np.concatenate([score_function(chunk) for chunk in chunks])
+
+    with ThreadPoolExecutor(max_workers=min(num_threads, len(chunks))) as executor:
+        return np.concatenate(list(executor.map(score_function, chunks)))
 
 
 class IsolationForest:
     """
     IsolationForest object
+
+    Wraps sklearn's IsolationForest: trees are built in parallel, fitting and scoring are separate (test data is never fitted on),
+    scoring is chunked over threads and returns continuous anomaly scores, and trees can be added on new data with add_trees.
     """
 
-    def __int__(self):
-        pass
+    def __init__(self, preprocessor: Optional[TransactionPreprocessor] = None, n_estimators: int = 100, max_samples: Union[int, float, str] = 'auto',
+                 contamination: Union[float, str] = 'auto', n_jobs: int = -1, chunk_size: int = 65536, random_state: Optional[int] = None):
+        """
+        Initialises the IsolationForest object.
+
+        :param preprocessor: TransactionPreprocessor shared with other models. A new one is created if not provided.
+        :param n_estimators: Integer representing the number of trees built by fit.
+        :param max_samples: Number of rows drawn to build each tree (see sklearn's IsolationForest).
+        :param contamination: Expected proportion of fraud, used to set the threshold of predict (see sklearn's IsolationForest).
+        :param n_jobs: Integer representing the number of processes building trees and threads scoring chunks, -1 for one per CPU.
+        :param chunk_size: Integer representing the number of rows scored at once.
+        :param random_state: Integer representing the seed of the forest.
+        """
+        from sklearn import ensemble
+
+        self.preprocessor = preprocessor if preprocessor is not None else TransactionPreprocessor()
+        self.n_estimators = n_estimators
+        self.n_jobs = n_jobs
+        self.chunk_size = chunk_size
+        self.model = ensemble.IsolationForest(n_estimators=n_estimators, max_samples=max_samples, contamination=contamination,
+                                              n_jobs=n_jobs, random_state=random_state, warm_start=True)
 
     def preprocess(self, data) -> pd.DataFrame:
-        pass
+        """
+        Transforms raw transactions into features with the (shared) preprocessor, fitting it first if it is not fitted yet.
 
-    def fit(self, data) -> None:
-        pass
+        :param data: DataFrame representing transactions in the simulated schema
+        :return: DataFrame representing the features
+        """
+        if not self.preprocessor.fitted:
+            self.preprocessor.fit(data)
+
+        return self.preprocessor.transform(data)
+
+    def fit(self, data, sample_weight: Optional[np.ndarray] = None) -> None:
+        """
+        Builds the forest on training data, replacing any previously built trees.
+
+        :param data: DataFrame or Numpy array representing the features used for training
+        :param sample_weight: Numpy array representing the weight of each row, e.g. the importance weights of a CoresetSampler sample.
+        :return: None
+        """
+        # with warm_start, fit only builds trees that are missing, so drop the existing ones first
+        if hasattr(self.model, 'estimators_'):
+            del self.model.estimators_
+        self.model.set_params(n_estimators=self.n_estimators)
+        self.model.fit(np.asarray(data, dtype=np.float32), sample_weight=sample_weight)
+
+    def add_trees(self, data, n_estimators: int) -> None:
+        """
+        Grows the fitted forest with n_estimators trees built on new data, keeping the existing trees.
+
+        :param data: DataFrame or Numpy array representing the new features
+        :param n_estimators: Integer representing the number of trees to add
+        :return: None
+        """
+        self.model.set_params(n_estimators=self.model.n_estimators + n_estimators)
+        self.model.fit(np.asarray(data, dtype=np.float32))
+
+    def score(self, data) -> np.ndarray:
+        """
+        Computes the anomaly score of each row, chunk by chunk on several threads.
+
+        :param data: DataFrame or Numpy array representing the features to score
+        :return: Numpy array of anomaly scores, higher is more anomalous
+        """
+        features = np.asarray(data, dtype=np.float32)
+
+        return -score_in_chunks(self.model.score_samples, features, self.chunk_size, self.n_jobs)
 
     def predict(self, data) -> Union[list, np.ndarray]:
-        pass
+        """
+        Predicts whether each row is fraud, i.e. its anomaly score is above the threshold set by contamination.
+
+        :param data: DataFrame or Numpy array representing the features to predict
+        :return: Numpy array representing the predicted class where 0 is non-fraud and 1 is fraud.
+        """
+        return (self.score(data) > self.decision_threshold).astype(int)
+
+    @property
+    def decision_threshold(self) -> float:
+        """
+        Gets the anomaly score above which predict flags a row as fraud, set by contamination when fitting.
+
+        :return: Float representing the threshold
+        """
+        # sklearn flags rows whose score_samples is below offset_
+        return float(-self.model.offset_)
+
+    def save(self, path: str) -> None:
+        """
+        Persists the fitted forest.
+
+        :param path: String representing the file path
+        :return: None
+        """
+        import joblib
+
+        joblib.dump({'n_estimators': self.n_estimators, 'model': self.model}, path)
+
+    @classmethod
+    def load(cls, path: str, preprocessor: Optional[TransactionPreprocessor] = None, n_jobs: int = -1, chunk_size: int = 65536) -> 'IsolationForest':
+        """
+        Loads an IsolationForest persisted with save, ready for scoring.
+
+        :param path: String representing the file path
+        :param preprocessor: TransactionPreprocessor to use for preprocess
+        :param n_jobs: Integer representing the number of threads scoring chunks, -1 for one per CPU.
+        :param chunk_size: Integer representing the number of rows scored at once.
+        :return: IsolationForest object
+        """
+        import joblib
+
+        state = joblib.load(path)
+        model = cls(preprocessor, n_estimators=state['n_estimators'], n_jobs=n_jobs, chunk_size=chunk_size)
+        model.model = state['model']
+
+        return model
 
 
 class LocalOutlierFactor:
     """
     LocalOutlierFactor object
+
+    Local Outlier Factor in novelty mode: the k-nearest neighbour index of the training rows, their k-distances and their local
+    reachability densities are computed once by fit, and can be persisted with save. Scoring new rows then only needs k-nearest
+    neighbour queries against the stored index, run chunk by chunk on several threads.
     """
 
-    def __int__(self):
-        pass
+    def __init__(self, preprocessor: Optional[TransactionPreprocessor] = None, n_neighbors: int = 20, contamination: Union[float, str] = 'auto',
+                 algorithm: str = 'auto', n_jobs: int = -1, chunk_size: int = 16384):
+        """
+        Initialises the LocalOutlierFactor object.
+
+        :param preprocessor: TransactionPreprocessor shared with other models. A new one is created if not provided.
+        :param n_neighbors: Integer representing the number of neighbours k.
+        :param contamination: Expected proportion of fraud among training rows, used to set the threshold of predict.
+                              'auto' flags rows with a local outlier factor above 1.5, as sklearn does.
+        :param algorithm: String representing the index structure, passed to sklearn's NearestNeighbors ('auto', 'kd_tree', 'ball_tree', 'brute').
+        :param n_jobs: Integer representing the number of threads querying the index, -1 for one per CPU.
+        :param chunk_size: Integer representing the number of rows queried at once.
+        """
+        self.preprocessor = preprocessor if preprocessor is not None else TransactionPreprocessor()
+        self.n_neighbors = n_neighbors
+        self.contamination = contamination
+        self.algorithm = algorithm
+        self.n_jobs = n_jobs
+        self.chunk_size = chunk_size
+
+        # fitted state, set by fit or load
+        self.index = None
+        self.k_distances = None
+        self.lrd = None
+        self.threshold = None
 
     def preprocess(self, data) -> pd.DataFrame:
-        pass
+        """
+        Transforms raw transactions into features with the (shared) preprocessor, fitting it first if it is not fitted yet.
+
+        :param data: DataFrame representing transactions in the simulated schema
+        :return: DataFrame representing the features
+        """
+        if not self.preprocessor.fitted:
+            self.preprocessor.fit(data)
+
+        return self.preprocessor.transform(data)
 
     def fit(self, data) -> None:
-        pass
+        """
+        Builds the neighbour index of the training rows and precomputes their k-distances and local reachability densities.
+
+        :param data: DataFrame or Numpy array representing the features used for training
+        :return: None
+        """
+        from sklearn import neighbors
+
+        features = np.asarray(data, dtype=np.float32)
+        self.index = neighbors.NearestNeighbors(n_neighbors=self.n_neighbors, algorithm=self.algorithm).fit(features)
+
+        # neighbours of the training rows, excluding themselves
+        distances, indices = self.index.kneighbors()
+        self.k_distances = distances[:, -1].astype(np.float32)
+        self.lrd = self.local_reachability_density(distances, indices)
+
+        if self.contamination == 'auto':
+            self.threshold = 1.5
+        else:
+            training_lof = self.lrd[indices].mean(axis=1) / self.lrd
+            self.threshold = float(np.quantile(training_lof, 1 - self.contamination))
+
+    def local_reachability_density(self, distances: np.ndarray, indices: np.ndarray) -> np.ndarray:
+        """
+        Computes local reachability densities from distances to, and indices of, training neighbours.
+
+        :param distances: Numpy array of shape (num_rows, k) representing the distances to the neighbours
+        :param indices: Numpy array of shape (num_rows, k) representing the training indices of the neighbours
+        :return: Numpy array representing the local reachability density of each row
+        """
+        reach_distances = np.maximum(distances, self.k_distances[indices])
+
+        # as in sklearn, avoid infinite densities on duplicated rows
+        return (1 / (reach_distances.mean(axis=1) + 1e-10)).astype(np.float32)
+
+    def local_outlier_factor(self, chunk: np.ndarray) -> np.ndarray:
+        distances, indices = self.index.kneighbors(chunk)
+
+        return self.lrd[indices].mean(axis=1) / self.local_reachability_density(distances, indices)
+
+    def score(self, data) -> np.ndarray:
+        """
+        Computes the local outlier factor of each row against the training rows, chunk by chunk on several threads.
+
+        :param data: DataFrame or Numpy array representing the features to score
+        :return: Numpy array of local outlier factors, around 1 for inliers and higher for outliers
+        """
+        features = np.asarray(data, dtype=np.float32)
+
+        return score_in_chunks(self.local_outlier_factor, features, self.chunk_size, self.n_jobs)
 
     def predict(self, data) -> Union[list, np.ndarray]:
-        pass
+        """
+        Predicts whether each row is fraud, i.e. its local outlier factor is above the threshold.
+
+        :param data: DataFrame or Numpy array representing the features to predict
+        :return: Numpy array representing the predicted class where 0 is non-fraud and 1 is fraud.
+        """
+        return (self.score(data) > self.threshold).astype(int)
+
+    @property
+    def decision_threshold(self) -> float:
+        """
+        Gets the local outlier factor above which predict flags a row as fraud.
+
+        :return: Float representing the threshold
+        """
+        return self.threshold
+
+    def save(self, path: str) -> None:
+        """
+        Persists the neighbour index and the precomputed training quantities.
+
+        :param path: String representing the file path
+        :return: None
+        """
+        import joblib
+
+        joblib.dump({'n_neighbors': self.n_neighbors, 'index': self.index, 'k_distances': self.k_distances, 'lrd': self.lrd,
+                     'threshold': self.threshold}, path)
+
+    @classmethod
+    def load(cls, path: str, preprocessor: Optional[TransactionPreprocessor] = None, n_jobs: int = -1, chunk_size: int = 16384,
+             mmap_mode: Optional[str] = 'r') -> 'LocalOutlierFactor':
+        """
+        Loads a LocalOutlierFactor persisted with save, ready for scoring.
+
+        :param path: String representing the file path
+        :param preprocessor: TransactionPreprocessor to use for preprocess
+        :param n_jobs: Integer representing the number of threads querying the index, -1 for one per CPU.
+        :param chunk_size: Integer representing the number of rows queried at once.
+        :param mmap_mode: Memory-maps the stored arrays (see joblib.load), so that processes loading the same file share them. None reads them.
+        :return: LocalOutlierFactor object
+        """
+        import joblib
+
+        state = joblib.load(path, mmap_mode=mmap_mode)
+        model = cls(preprocessor, n_neighbors=state['n_neighbors'], n_jobs=n_jobs, chunk_size=chunk_size)
+        model.index = state['index']
+        model.k_distances = state['k_distances']
+        model.lrd = state['lrd']
+        model.threshold = state['threshold']
+
+        return model
 
 
 if __name__ == '__main__':
-    # Reading
-    df = pd.read_csv('Dataset/data/df_simulated.csv')
-    labels = df['Behaviour ID']
-    training = df.drop('Behaviour ID', axis=1)
+    from sklearn.metrics import confusion_matrix
+
+    # Reading, chunk by chunk
+    data_path = 'Dataset/data/df_simulated.csv'
+    label_column = 'Behaviour ID'
+    no_of_samples = 100000
+
+    # Pre-processing, fitted once and shared by all models
+    preprocessor = TransactionPreprocessor()
+    for chunk in read_csv_chunks(data_path):
+        preprocessor.partial_fit(chunk.drop(label_column, axis=1))
 
     # Model
-    model = AutoEncoder()
-    # Pre-processing
-    df_processed = model.preprocess(training)
-    # Training
-    model.fit(df_processed)
+    model = AutoEncoder(preprocessor)
+    # Training on a uniform sample of the non-fraud transactions
+    sampler = ReservoirSampler(no_of_samples, random_state=0)
+    for chunk in read_csv_chunks(data_path):
+        df_processed = model.preprocess(chunk.drop(label_column, axis=1))
+        sampler.add(df_processed[chunk[label_column].to_numpy() == 0])
+    model.fit(sampler.sample)
+
     # Predicting
-    pred = model.predict(df_processed)
+    labels = []
+    pred = []
+    for chunk in read_csv_chunks(data_path):
+        labels.append((chunk[label_column] != 0).astype(int).to_numpy())
+        pred.append(model.predict(model.preprocess(chunk.drop(label_column, axis=1))))
 
     # Evaluating
-    confusion_matrix(labels, pred)
+    print(confusion_matrix(np.concatenate(labels), np.concatenate(pred)))
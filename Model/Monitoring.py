@@ -0,0 +1,374 @@
+import copy
+from typing import Dict, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+from Model.Ensemble import Detector
+
+# floor of the bin proportions in the PSI, so empty bins do not make it infinite
+PSI_EPSILON = 1e-4
+
+
+class QuantileSketch:
+    """
+    QuantileSketch object
+
+    Mergeable streaming quantile sketch with relative accuracy (DDSketch): values are counted in logarithmic buckets, so any quantile is
+    returned within relative_accuracy of the exact one, whatever the number of values. Memory is bounded by max_buckets, by collapsing the
+    buckets of the smallest magnitudes when there are more. Two sketches with the same relative_accuracy merge exactly, by adding counts.
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01, max_buckets: int = 2048):
+        """
+        Initialises the QuantileSketch object.
+
+        :param relative_accuracy: Float representing the relative error of the quantiles.
+        :param max_buckets: Integer representing the maximum number of buckets of each sign.
+        """
+        self.relative_accuracy = relative_accuracy
+        self.max_buckets = max_buckets
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = np.log(self.gamma)
+        # counts of the buckets of positive values and of negative values (by magnitude), and of zeros
+        self.positive: Dict[int, int] = {}
+        self.negative: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def add(self, values) -> None:
+        """
+        Adds values to the sketch, ignoring NaN and infinite values.
+
+        :param values: Numpy array representing the values
+        :return: None
+        """
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[np.isfinite(values)]
+        # magnitudes below the smallest normal float are counted as zeros
+        tiny = np.finfo(np.float64).tiny
+        for store, magnitudes in ((self.positive, values[values > tiny]), (self.negative, -values[values < -tiny])):
+            keys, counts = np.unique(np.ceil(np.log(magnitudes) / self.log_gamma).astype(np.int64), return_counts=True)
+            for key, count in zip(keys.tolist(), counts.tolist()):
+                store[key] = store.get(key, 0) + count
+            self.collapse(store)
+        self.zero_count += int(np.count_nonzero(np.abs(values) <= tiny))
+        self.count += len(values)
+
+    def collapse(self, store: Dict[int, int]) -> None:
+        """
+        Merges the buckets of the smallest magnitudes of a store until it has at most max_buckets buckets.
+
+        :param store: Dict representing the bucket counts
+        :return: None
+        """
+        if len(store) <= self.max_buckets:
+            return
+
+        keys = sorted(store)
+        collapsed = keys[:len(keys) - self.max_buckets + 1]
+        store[collapsed[-1]] = sum(store.pop(key) for key in collapsed)
+
+    def merge(self, other: 'QuantileSketch') -> None:
+        """
+        Adds the values of another sketch, e.g. from another worker process.
+
+        :param other: QuantileSketch object with the same relative_accuracy
+        :return: None
+        """
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Only sketches with the same relative accuracy can be merged")
+
+        for store, other_store in ((self.positive, other.positive), (self.negative, other.negative)):
+            for key, count in other_store.items():
+                store[key] = store.get(key, 0) + count
+            self.collapse(store)
+        self.zero_count += other.zero_count
+        self.count += other.count
+
+    def buckets(self):
+        """
+        Gets the representative value and the count of every bucket, in increasing order of value.
+
+        :return: Tuple of the Numpy array of values and the Numpy array of counts
+        """
+        negative_keys = np.array(sorted(self.negative, reverse=True), dtype=np.float64)
+        positive_keys = np.array(sorted(self.positive), dtype=np.float64)
+        # the value of bucket k, gamma^(k - 1) < |x| <= gamma^k, is within relative_accuracy of any value in it
+        scale = 2 / (self.gamma + 1)
+        values = np.concatenate([-scale * self.gamma ** negative_keys, [0.0], scale * self.gamma ** positive_keys])
+        counts = np.concatenate([[self.negative[key] for key in sorted(self.negative, reverse=True)], [self.zero_count],
+                                 [self.positive[key] for key in sorted(self.positive)]])
+
+        return values, counts
+
+    def quantile(self, q: Union[float, Sequence[float]]) -> np.ndarray:
+        """
+        Gets quantiles of the values added.
+
+        :param q: Float or list of floats representing the quantiles, between 0 and 1.
+        :return: Numpy array of quantiles, NaN if the sketch is empty
+        """
+        q = np.atleast_1d(np.asarray(q, dtype=np.float64))
+        if self.count == 0:
+            return np.full(len(q), np.nan)
+
+        values, counts = self.buckets()
+        ranks = np.floor(q * (self.count - 1))
+
+        return values[np.searchsorted(np.cumsum(counts), ranks, side='right')]
+
+    def cdf(self, x) -> np.ndarray:
+        """
+        Gets the proportion of values at or below x.
+
+        :param x: Float or Numpy array representing the points
+        :return: Numpy array of proportions
+        """
+        values, counts = self.buckets()
+        cumulative = np.concatenate([[0], np.cumsum(counts)]) / max(self.count, 1)
+
+        return cumulative[np.searchsorted(values, np.atleast_1d(x), side='right')]
+
+
+class CategoryCounts:
+    """
+    CategoryCounts object. Mergeable counts of the categories of a categorical feature (e.g. the payment channel mix).
+    """
+
+    def __init__(self):
+        self.counts: Dict[str, float] = {}
+
+    def add(self, counts: Dict[str, float]) -> None:
+        for category, count in counts.items():
+            self.counts[category] = self.counts.get(category, 0) + count
+
+    def merge(self, other: 'CategoryCounts') -> None:
+        self.add(other.counts)
+
+    def proportions(self, categories: Sequence[str]) -> np.ndarray:
+        total = max(sum(self.counts.values()), 1)
+
+        return np.array([self.counts.get(category, 0) / total for category in categories])
+
+
+def population_stability_index(reference: np.ndarray, current: np.ndarray) -> float:
+    """
+    Computes the population stability index between two binned distributions, sum((current - reference) * ln(current / reference)).
+    Values above 0.1 are commonly read as a moderate shift and above 0.25 as a major one.
+
+    :param reference: Numpy array representing the proportion of reference values in each bin
+    :param current: Numpy array representing the proportion of current values in each bin
+    :return: Float representing the PSI
+    """
+    reference = np.maximum(reference, PSI_EPSILON)
+    current = np.maximum(current, PSI_EPSILON)
+
+    return float(np.sum((current - reference) * np.log(current / reference)))
+
+
+class DriftMonitor:
+    """
+    DriftMonitor object
+
+    Follows the distribution of anomaly scores, of numeric features (e.g. payment amount, login gap) and of categorical features (e.g.
+    the channel mix) as batches are scored, in constant memory (QuantileSketch, CategoryCounts), and compares them with a reference
+    snapshot taken on the training data: PSI over the reference deciles and KS statistic for numeric values, PSI over the categories for
+    categorical features. The state of monitors running in different worker processes merges exactly.
+
+    Features are read from preprocessed batches: numeric features by column name or by position, categorical features as the one-hot
+    columns '<column>=<value>' of TransactionPreprocessor. Names are resolved in Numpy arrays through feature_names (e.g.
+    TransactionPreprocessor.feature_names); features that cannot be resolved in a batch are not recorded for it.
+    """
+
+    def __init__(self, numeric_features: Sequence[Union[str, int]] = ('log_payment_amount', 'login_to_creation_hours'),
+                 categorical_features: Sequence[str] = ('Payment File Format/Channel',), relative_accuracy: float = 0.01,
+                 max_buckets: int = 2048, psi_threshold: float = 0.2, feature_names: Optional[Sequence[str]] = None):
+        """
+        Initialises the DriftMonitor object.
+
+        :param numeric_features: List representing the numeric features monitored, names or positions.
+        :param categorical_features: List representing the categorical columns monitored through their one-hot columns.
+        :param relative_accuracy: Float representing the relative accuracy of the quantile sketches.
+        :param max_buckets: Integer representing the maximum number of buckets of each sketch.
+        :param psi_threshold: Float representing the PSI above which a distribution is reported as drifted.
+        :param feature_names: List representing the names of the columns of Numpy array batches, None to read them by position only.
+        """
+        self.numeric_features = list(numeric_features)
+        self.categorical_features = list(categorical_features)
+        self.relative_accuracy = relative_accuracy
+        self.max_buckets = max_buckets
+        self.psi_threshold = psi_threshold
+        self.feature_names = list(feature_names) if feature_names is not None else None
+        self.reference: Optional[DriftMonitor] = None
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Forgets the batches observed so far, keeping the reference.
+
+        :return: None
+        """
+        self.sketches: Dict[str, QuantileSketch] = {str(name): QuantileSketch(self.relative_accuracy, self.max_buckets)
+                                                    for name in ['score'] + self.numeric_features}
+        self.categories: Dict[str, CategoryCounts] = {name: CategoryCounts() for name in self.categorical_features}
+        self.num_predicted = 0
+        self.num_flagged = 0
+
+    def observe(self, data, scores: Optional[np.ndarray] = None, predictions: Optional[np.ndarray] = None) -> None:
+        """
+        Records a scored batch.
+
+        :param data: DataFrame or Numpy array representing the preprocessed features of the batch
+        :param scores: Numpy array representing the anomaly scores of the batch, if computed.
+        :param predictions: Numpy array representing the predicted classes of the batch, if computed.
+        :return: None
+        """
+        if isinstance(data, pd.DataFrame):
+            columns = [str(column) for column in data.columns]
+            take = lambda positions: data.iloc[:, positions].to_numpy()
+        else:
+            data = np.asarray(data)
+            columns = self.feature_names
+            take = lambda positions: data[:, positions]
+
+        for name in self.numeric_features:
+            position = self.position(name, columns, data.shape[1])
+            if position is not None:
+                self.sketches[str(name)].add(take(position))
+
+        if columns is not None:
+            for name in self.categorical_features:
+                prefix = f"{name}="
+                one_hot = [position for position, column in enumerate(columns) if column.startswith(prefix)]
+                totals = take(one_hot).sum(axis=0)
+                self.categories[name].add({columns[position][len(prefix):]: float(total) for position, total in zip(one_hot, totals)})
+
+        if scores is not None:
+            self.sketches['score'].add(scores)
+        if predictions is not None:
+            self.num_predicted += len(predictions)
+            self.num_flagged += int(np.count_nonzero(np.asarray(predictions) == 1))
+
+    @staticmethod
+    def position(name: Union[str, int], columns: Optional[Sequence[str]], num_columns: int) -> Optional[int]:
+        """
+        Resolves a monitored feature to a column position.
+
+        :param name: String or integer representing the feature, a name or a position
+        :param columns: List representing the column names of the batch, None if unknown
+        :param num_columns: Integer representing the number of columns of the batch
+        :return: Integer representing the position, None if the feature is not in the batch
+        """
+        if isinstance(name, (int, np.integer)):
+            return int(name) if -num_columns <= name < num_columns else None
+        if columns is not None and name in columns:
+            return list(columns).index(name)
+
+        return None
+
+    def snapshot(self) -> 'DriftMonitor':
+        """
+        Copies the current state, without its reference, e.g. to use the state after observing the training data as reference.
+
+        :return: DriftMonitor object
+        """
+        reference = self.reference
+        self.reference = None
+        snapshot = copy.deepcopy(self)
+        self.reference = reference
+
+        return snapshot
+
+    def set_reference(self, reference: 'DriftMonitor') -> None:
+        """
+        Sets the state distributions are compared with.
+
+        :param reference: DriftMonitor object, e.g. a snapshot taken after observing the training data
+        :return: None
+        """
+        self.reference = reference
+
+    def merge(self, other: 'DriftMonitor') -> None:
+        """
+        Adds the state of another monitor with the same configuration, e.g. from another worker process.
+
+        :param other: DriftMonitor object
+        :return: None
+        """
+        for name, sketch in self.sketches.items():
+            sketch.merge(other.sketches[name])
+        for name, counts in self.categories.items():
+            counts.merge(other.categories[name])
+        self.num_predicted += other.num_predicted
+        self.num_flagged += other.num_flagged
+
+    def report(self) -> pd.DataFrame:
+        """
+        Compares the current distributions with the reference ones.
+
+        :return: DataFrame with one row per monitored distribution: the number of values, the reference and current medians and 99th
+                 percentiles, the PSI, the KS statistic (numeric only) and whether the PSI is above psi_threshold
+        """
+        if self.reference is None:
+            raise ValueError("DriftMonitor needs a reference, see set_reference")
+
+        rows = []
+        for name, sketch in self.sketches.items():
+            reference = self.reference.sketches[name]
+            if sketch.count == 0 or reference.count == 0:
+                continue
+            # bins between the reference deciles
+            edges = np.unique(reference.quantile(np.linspace(0.1, 0.9, 9)))
+            reference_bins = np.diff(np.concatenate([[0], reference.cdf(edges), [1]]))
+            current_bins = np.diff(np.concatenate([[0], sketch.cdf(edges), [1]]))
+            points = np.union1d(reference.buckets()[0], sketch.buckets()[0])
+            ks = float(np.max(np.abs(reference.cdf(points) - sketch.cdf(points))))
+            reference_quantiles = reference.quantile([0.5, 0.99])
+            current_quantiles = sketch.quantile([0.5, 0.99])
+            rows.append({'distribution': name, 'count': sketch.count, 'reference_median': reference_quantiles[0], 'median': current_quantiles[0],
+                         'reference_p99': reference_quantiles[1], 'p99': current_quantiles[1],
+                         'psi': population_stability_index(reference_bins, current_bins), 'ks': ks})
+
+        for name, counts in self.categories.items():
+            reference = self.reference.categories[name]
+            if not counts.counts or not reference.counts:
+                continue
+            categories = sorted(set(counts.counts) | set(reference.counts))
+            rows.append({'distribution': name, 'count': sum(counts.counts.values()),
+                         'psi': population_stability_index(reference.proportions(categories), counts.proportions(categories))})
+
+        if self.num_predicted and self.reference.num_predicted:
+            rows.append({'distribution': 'flagged_rate', 'count': self.num_predicted,
+                         'reference_median': self.reference.num_flagged / self.reference.num_predicted, 'median': self.num_flagged / self.num_predicted})
+
+        report = pd.DataFrame(rows)
+        if 'psi' in report:
+            report['drifted'] = report['psi'] > self.psi_threshold
+
+        return report
+
+
+class MonitoredDetector:
+    """
+    MonitoredDetector object. Wraps a detector (see Ensemble.Detector), e.g. OneClassSVM.AnomalyDetection or a detector of Models.py, and
+    records every batch it scores or predicts in a DriftMonitor. Only score provides anomaly scores to the monitor, predict records the
+    features and the flagged rate. A batch both scored and predicted has its features recorded twice, which leaves their distributions,
+    and so the PSI and KS statistics, unchanged.
+    """
+
+    def __init__(self, detector: Detector, monitor: DriftMonitor):
+        self.detector = detector
+        self.monitor = monitor
+
+    def score(self, data) -> np.ndarray:
+        scores = np.asarray(self.detector.score(data))
+        self.monitor.observe(data, scores=scores)
+
+        return scores
+
+    def predict(self, data) -> np.ndarray:
+        predictions = np.asarray(self.detector.predict(data))
+        self.monitor.observe(data, predictions=predictions)
+
+        return predictions
@@ -0,0 +1,282 @@
+import pickle
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from Model.Preprocessing import DATETIME_FORMAT
+from Model.Velocity import EPOCH
+
+
+def hash_keys(*columns: pd.Series) -> np.ndarray:
+    """
+    Hashes the values of one or more columns, row by row, into 64-bit keys. Uses pandas' hashing, which is stable across processes and runs.
+
+    :param columns: Series representing the columns, of equal length
+    :return: Numpy array of uint64 keys
+    """
+    values = columns[0].fillna('').astype(str)
+    for column in columns[1:]:
+        values = values + '\x1f' + column.fillna('').astype(str).to_numpy()
+
+    # categorize only pays off with many repeated values
+    return pd.util.hash_array(values.to_numpy(dtype=object), categorize=False)
+
+
+class BloomFilter:
+    """
+    BloomFilter object. Compact set of 64-bit keys answering "possibly seen" or "definitely not seen", with false positives at error_rate
+    once capacity keys are added and no false negatives. The k bit positions of a key are derived from its two 32-bit halves
+    (double hashing), so batches of keys are added and tested with vectorised numpy operations.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        """
+        Initialises the BloomFilter object.
+
+        :param capacity: Integer representing the number of keys the filter is sized for.
+        :param error_rate: Float representing the false positive rate at capacity.
+        """
+        self.num_bits = int(np.ceil(-capacity * np.log(error_rate) / np.log(2) ** 2))
+        self.num_hashes = max(1, int(round(self.num_bits / capacity * np.log(2))))
+        self.bits = np.zeros((self.num_bits + 7) // 8, dtype=np.uint8)
+
+    def positions(self, keys: np.ndarray) -> np.ndarray:
+        """
+        Gets the bit positions of keys.
+
+        :param keys: Numpy array of uint64 keys
+        :return: Numpy array of shape (number of keys, num_hashes) of positions
+        """
+        keys = np.asarray(keys, dtype=np.uint64)
+        low = keys & np.uint64(0xFFFFFFFF)
+        # odd, so the positions of a key are all distinct when num_bits is a power of 2, and nonzero otherwise
+        high = (keys >> np.uint64(32)) | np.uint64(1)
+        steps = np.arange(self.num_hashes, dtype=np.uint64)
+
+        return (low[:, None] + steps[None, :] * high[:, None]) % np.uint64(self.num_bits)
+
+    def add(self, keys: np.ndarray) -> None:
+        """
+        Adds keys to the filter.
+
+        :param keys: Numpy array of uint64 keys
+        :return: None
+        """
+        positions = self.positions(keys).ravel()
+        np.bitwise_or.at(self.bits, positions >> np.uint64(3), (1 << (positions & np.uint64(7))).astype(np.uint8))
+
+    def contains(self, keys: np.ndarray) -> np.ndarray:
+        """
+        Tests whether keys were possibly added.
+
+        :param keys: Numpy array of uint64 keys
+        :return: Numpy array of booleans, False if a key was definitely never added
+        """
+        positions = self.positions(keys)
+        set_bits = (self.bits[positions >> np.uint64(3)] >> (positions & np.uint64(7)).astype(np.uint8)) & 1
+
+        return set_bits.all(axis=1)
+
+    def contains_key(self, key: int) -> bool:
+        """
+        Tests whether a single key was possibly added, in pure Python, which is much faster than contains for one key.
+
+        :param key: Integer representing a uint64 key
+        :return: Boolean, False if the key was definitely never added
+        """
+        low = key & 0xFFFFFFFF
+        high = (key >> 32) | 1
+        for step in range(self.num_hashes):
+            position = (low + step * high) % (1 << 64) % self.num_bits
+            if not (self.bits[position >> 3] >> (position & 7)) & 1:
+                return False
+
+        return True
+
+
+class NoveltyIndex:
+    """
+    NoveltyIndex object
+
+    Index over the history of transactions answering "has this client paid this beneficiary before" (new payees) and "when did this user
+    last log in" (behaviour 4 of Dataset/models.py), updated as transactions stream in and turned into novelty features by transform.
+
+    Client/beneficiary pairs are kept as 64-bit hashes in a hash map (dict) with their first payment time and payment count, fronted by an
+    optional Bloom filter that answers most lookups of new pairs without touching the map. With exact=False only the Bloom filter is kept,
+    a compact approximate index where a new pair is reported as seen with probability error_rate.
+    """
+
+    PAIR_COLUMNS = ('Client Entity Name', 'Beneficiary Account Number')
+
+    # user, last successful login and action time columns of each user role
+    LOGIN_COLUMNS = {
+        'maker': ('Connexis User ID (Maker)', 'Maker last successful login date/time', 'Payment Creation Date and Time'),
+        'authoriser': ('Connexis User ID (Authoriser)', 'Authoriser last successful login date/time', 'Payment Authorisation Date and Time'),
+    }
+
+    TIME_COLUMN = 'Payment Creation Date and Time'
+
+    def __init__(self, exact: bool = True, bloom_capacity: Optional[int] = None, error_rate: float = 0.001):
+        """
+        Initialises the NoveltyIndex object.
+
+        :param exact: Boolean representing whether the pairs are kept in a hash map, which is required for the payment count features.
+        :param bloom_capacity: Integer representing the number of pairs the Bloom filter is sized for, no Bloom filter if None.
+        :param error_rate: Float representing the false positive rate of the Bloom filter at capacity.
+        """
+        if not exact and bloom_capacity is None:
+            raise ValueError("NoveltyIndex needs a Bloom filter when exact is False")
+
+        self.exact = exact
+        self.bloom_capacity = bloom_capacity
+        self.error_rate = error_rate
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Forgets all the transactions seen so far.
+
+        :return: None
+        """
+        # first payment time and payment count of each client/beneficiary pair hash
+        self.pairs: Dict[int, List[float]] = {}
+        self.bloom = BloomFilter(self.bloom_capacity, self.error_rate) if self.bloom_capacity is not None else None
+        # latest successful login time of each user, in seconds since the epoch
+        self.last_login: Dict[str, float] = {}
+
+    @property
+    def feature_names(self) -> List[str]:
+        """
+        Gets the names of the columns returned by transform, in order.
+
+        :return: List of column names
+        """
+        names = ['new_beneficiary']
+        if self.exact:
+            names = names + ['beneficiary_payment_count', 'hours_since_first_beneficiary_payment']
+
+        return names + [f"{role}_hours_since_last_login" for role in self.LOGIN_COLUMNS]
+
+    def seen_pair(self, client: str, beneficiary: str) -> bool:
+        """
+        Looks up whether a client has paid a beneficiary before.
+
+        :param client: String representing the client entity name.
+        :param beneficiary: String representing the beneficiary account number.
+        :return: Boolean, possibly a false positive if exact is False
+        """
+        key = int(pd.util.hash_array(np.array([f"{client}\x1f{beneficiary}"], dtype=object), categorize=False)[0])
+        if self.bloom is not None and not self.bloom.contains_key(key):
+            return False
+
+        return key in self.pairs if self.exact else True
+
+    def seen_keys(self, keys: np.ndarray) -> np.ndarray:
+        """
+        Looks up pair hashes, with the Bloom filter first when there is one.
+
+        :param keys: Numpy array of uint64 pair hashes
+        :return: Numpy array of booleans
+        """
+        seen = self.bloom.contains(keys) if self.bloom is not None else np.ones(len(keys), dtype=bool)
+        if self.exact:
+            # only the keys the Bloom filter may have seen go to the hash map
+            candidates = np.flatnonzero(seen)
+            seen[candidates] = [int(key) in self.pairs for key in keys[candidates]]
+
+        return seen
+
+    def user_last_login(self, user: str) -> Optional[float]:
+        """
+        Looks up the latest successful login of a user.
+
+        :param user: String representing the Connexis user ID.
+        :return: Float representing the login time in seconds since the epoch, None if the user was never seen
+        """
+        return self.last_login.get(user)
+
+    @staticmethod
+    def seconds(data: pd.DataFrame, column: str) -> np.ndarray:
+        times = pd.to_datetime(data[column], format=DATETIME_FORMAT, errors='coerce')
+
+        return (times - EPOCH).dt.total_seconds().to_numpy(dtype=np.float64)
+
+    def transform(self, data: pd.DataFrame) -> pd.DataFrame:
+        """
+        Adds a chunk of transactions to the index, in time order, and gets their novelty features, which only depend on earlier transactions
+        and the transaction itself.
+
+        Chunks must be passed in time order, within a chunk the rows may be in any order. Login gaps are measured from the action of the
+        user (creation for the maker, authorisation for the authoriser) back to their latest login known at that time, including the login
+        recorded on the transaction itself, and are NaN when no login is known.
+
+        :param data: DataFrame representing a chunk of transactions in the simulated schema
+        :return: DataFrame of float32 features with the feature_names columns, in the row order of data
+        """
+        timestamps = self.seconds(data, self.TIME_COLUMN)
+        order = np.argsort(timestamps, kind='stable')
+        keys = hash_keys(*(data[column] for column in self.PAIR_COLUMNS))
+        features = pd.DataFrame(index=data.index, columns=self.feature_names, dtype=np.float32)
+
+        # new if not seen in earlier chunks nor earlier in this chunk
+        sorted_keys = pd.Series(keys[order])
+        new = np.empty(len(data), dtype=bool)
+        new[order] = ~self.seen_keys(keys[order]) & ~sorted_keys.duplicated().to_numpy()
+        features['new_beneficiary'] = new
+
+        if self.exact:
+            counts = np.empty(len(data))
+            first_seen = np.empty(len(data))
+            for i in order:
+                key = int(keys[i])
+                pair = self.pairs.get(key)
+                if pair is None:
+                    pair = [timestamps[i], 0]
+                    self.pairs[key] = pair
+                pair[1] += 1
+                counts[i] = pair[1]
+                first_seen[i] = pair[0]
+            features['beneficiary_payment_count'] = counts
+            features['hours_since_first_beneficiary_payment'] = (timestamps - first_seen) / 3600
+        if self.bloom is not None:
+            self.bloom.add(keys)
+
+        for role, (user_column, login_column, time_column) in self.LOGIN_COLUMNS.items():
+            users = data[user_column].fillna('').astype(str).to_numpy(dtype=object)
+            logins = self.seconds(data, login_column)
+            times = timestamps if time_column == self.TIME_COLUMN else self.seconds(data, time_column)
+            gaps = np.full(len(data), np.nan)
+            for i in order:
+                latest = self.last_login.get(users[i], np.nan)
+                # logins recorded after the transaction (on later transactions of the user) are not its last login
+                last_login = latest if latest <= times[i] else np.nan
+                if logins[i] <= times[i] and not logins[i] <= last_login:
+                    last_login = logins[i]
+                if not logins[i] <= latest:
+                    self.last_login[users[i]] = logins[i] if not np.isnan(logins[i]) else latest
+                gaps[i] = (times[i] - last_login) / 3600
+            features[f"{role}_hours_since_last_login"] = gaps
+
+        return features.astype(np.float32)
+
+    def save(self, path: str) -> None:
+        """
+        Persists the index.
+
+        :param path: String representing the file path
+        :return: None
+        """
+        with open(path, 'wb') as f:
+            pickle.dump(self, f)
+
+    @staticmethod
+    def load(path: str) -> 'NoveltyIndex':
+        """
+        Loads an index persisted with save.
+
+        :param path: String representing the file path
+        :return: NoveltyIndex object
+        """
+        with open(path, 'rb') as f:
+            return pickle.load(f)
@@ -1,10 +1,68 @@
 import time
-from typing import List, Optional, Tuple
+from typing import List, Optional, Tuple, Union
 
 import numpy as np
 import pandas as pd
-from sklearn.cluster import OPTICS
-from sklearn.svm import OneClassSVM
+
+
+class ReducedSetSVDD:
+    """
+    ReducedSetSVDD object. RBF decision function with fewer expansion vectors than the SVDD it approximates, a drop-in replacement for the
+    fitted OneClassSVM in AnomalyDetection (see AnomalyDetection.compress). Evaluated with numpy in chunks, as one matrix product per chunk.
+    """
+
+    def __init__(self, vectors: np.ndarray, coefficients: np.ndarray, intercept: float, gamma: float, chunk_size: int = 16384):
+        """
+        Initialises the ReducedSetSVDD object.
+
+        :param vectors: Numpy array representing the expansion vectors.
+        :param coefficients: Numpy array representing the weight of each vector.
+        :param intercept: Float added to the weighted sum of kernels.
+        :param gamma: Float representing the coefficient of the rbf kernel.
+        :param chunk_size: Integer representing the number of rows evaluated at once.
+        """
+        self.vectors = vectors
+        self.coefficients = coefficients
+        self.intercept = intercept
+        self.gamma = gamma
+        self.chunk_size = chunk_size
+        self.squared_norms = np.einsum('ij,ij->i', vectors, vectors)
+
+    @staticmethod
+    def rbf_kernel(data: np.ndarray, vectors: np.ndarray, squared_norms: np.ndarray, gamma: float) -> np.ndarray:
+        """
+        Computes the rbf kernel between rows and vectors, exp(-gamma * ||x - v||^2).
+
+        :return: Numpy array of shape (number of rows, number of vectors)
+        """
+        distances = np.einsum('ij,ij->i', data, data)[:, None] + squared_norms[None, :] - 2 * data @ vectors.T
+        np.maximum(distances, 0, out=distances)
+
+        return np.exp(-gamma * distances, out=distances)
+
+    def decision_function(self, data) -> np.ndarray:
+        """
+        Computes the decision function, positive inside the boundary as for OneClassSVM.
+
+        :param data: DataFrame or Numpy array representing the data
+        :return: Numpy array of decision values
+        """
+        data = np.asarray(data, dtype=np.float64)
+        decisions = np.empty(len(data))
+        for start in range(0, len(data), self.chunk_size):
+            kernel = self.rbf_kernel(data[start:start + self.chunk_size], self.vectors, self.squared_norms, self.gamma)
+            decisions[start:start + self.chunk_size] = kernel @ self.coefficients + self.intercept
+
+        return decisions
+
+    def predict(self, data) -> np.ndarray:
+        """
+        Predicts whether rows are inside the boundary, as OneClassSVM.predict.
+
+        :param data: DataFrame or Numpy array representing the data
+        :return: Numpy array of 1 for inliers and -1 for outliers
+        """
+        return np.where(self.decision_function(data) >= 0, 1, -1)
 
 
 class AnomalyDetection:
@@ -96,6 +154,8 @@ class AnomalyDetection:
         :param eps: Float representing the eps.
         :return: Numpy array representing the training data.
         """
+        from sklearn.cluster import OPTICS
+
         start = time.time()
         print("Starting DBSCAN...")
         clustering_optics = OPTICS(eps=eps, cluster_method='dbscan').fit(data)
@@ -151,11 +211,7 @@ class AnomalyDetection:
         print("=" * 50)
 
         # select data based on input parameters
-        if self.feature_columns:
-            start, end = self.feature_columns
-            data_selected = self.data.iloc[:, start:end].to_numpy()
-        else:
-            data_selected = self.data.to_numpy()
+        data_selected = np.asarray(self.select_features(self.data))
 
         # run DBSCAN
         df_dbscan_labels = self.DBSCAN(data_selected, 0.02)
@@ -164,14 +220,14 @@ class AnomalyDetection:
 
         return reduced_pts
 
-    def fit(self, data: pd.DataFrame, feature_columns: Optional[List[int]] = None) -> None:
+    def fit(self, data: Union[pd.DataFrame, np.ndarray], feature_columns: Optional[List[int]] = None) -> None:
         """
         Reduce, fit (with the reduced points) and train the data provided.
 
         Note that the reduction of data points is done already.
         No option to remove the reduction of data points step as it is too computationally expensive
 
-        :param data: Numpy array representing the data used for training
+        :param data: DataFrame or Numpy array representing the data used for training
         :param feature_columns: List representing the start and end index of columns to be used
         :return: None
         """
@@ -195,6 +251,8 @@ class AnomalyDetection:
         print("=" * 50)
         print("Starting SVDD training...")
 
+        from sklearn.svm import OneClassSVM
+
         svdd_start = time.time()
         training_pts_toList = reduced_pts.values.tolist()
         svm = OneClassSVM(kernel='rbf', gamma=self.gamma)
@@ -208,22 +266,152 @@ class AnomalyDetection:
         print("=" * 50)
         print(f"Total time taken: {end - start}\n")
 
-    def predict(self, data: pd.DataFrame, feature_columns: Optional[List[int]] = None) -> np.ndarray:
+    def select_features(self, data: Union[pd.DataFrame, np.ndarray], feature_columns: Optional[List[int]] = None) -> Union[pd.DataFrame, np.ndarray]:
         """
-        Predict incoming data based on trained SVDD model.
+        Selects the feature columns of the data, defaulting to the columns the model was trained on.
 
-        :param data: Numpy array representing the data used for prediction
+        :param data: DataFrame or Numpy array representing the data
         :param feature_columns: List representing the start and end index of columns to be used
+        :return: DataFrame or Numpy array representing the selected columns
+        """
+        feature_columns = feature_columns or self.feature_columns
+        if not feature_columns:
+            return data
+
+        start, end = feature_columns
+        if isinstance(data, pd.DataFrame):
+            return data.iloc[:, start:end]
+        return np.asarray(data)[:, start:end]
+
+    def score(self, data: Union[pd.DataFrame, np.ndarray], feature_columns: Optional[List[int]] = None) -> np.ndarray:
+        """
+        Computes the anomaly score of incoming data based on trained SVDD model, i.e. the negated SVDD decision function.
+
+        :param data: DataFrame or Numpy array representing the data used for prediction
+        :param feature_columns: List representing the start and end index of columns to be used, defaults to the trained ones
+        :return: Numpy array representing the anomaly scores, positive (outside the SVDD boundary) for fraud.
+        """
+        return -self.svm.decision_function(self.select_features(data, feature_columns))
+
+    def predict(self, data: Union[pd.DataFrame, np.ndarray], feature_columns: Optional[List[int]] = None) -> np.ndarray:
+        """
+        Predict incoming data based on trained SVDD model.
+
+        :param data: DataFrame or Numpy array representing the data used for prediction
+        :param feature_columns: List representing the start and end index of columns to be used, defaults to the trained ones
         :return: Numpy array representing the predicted class where 0 is non-fraud and 1 is fraud.
         """
-        if feature_columns:
-            start, end = feature_columns
-            pred = self.svm.predict(data.iloc[:, start:end])
-        else:
-            pred = self.svm.predict(data)
+        pred = self.svm.predict(self.select_features(data, feature_columns))
 
         # reformat y_pred (run in sequence)
         pred[pred == 1] = 0
         pred[pred == -1] = 1
 
         return pred
+
+    @property
+    def decision_threshold(self) -> float:
+        """
+        Gets the anomaly score above which predict flags a row as fraud, i.e. the SVDD boundary.
+
+        :return: Float representing the threshold, 0 as rows outside the boundary have positive scores
+        """
+        return 0.0
+
+    def save(self, path: str) -> None:
+        """
+        Persists the trained SVDD model and its parameters (the training data is not kept).
+
+        :param path: String representing the file path
+        :return: None
+        """
+        import joblib
+
+        joblib.dump({'eps': self.eps, 'percent': self.percent, 'gamma': self.gamma, 'drop_rate': self.drop_rate,
+                     'feature_columns': self.feature_columns, 'svm': self.svm}, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'AnomalyDetection':
+        """
+        Loads an AnomalyDetection object persisted with save, ready for prediction.
+
+        :param path: String representing the file path
+        :return: AnomalyDetection object
+        """
+        import joblib
+
+        state = joblib.load(path)
+        model = cls(eps=state['eps'], percent=state['percent'], gamma=state['gamma'], drop_rate=state['drop_rate'])
+        model.feature_columns = state['feature_columns']
+        model.svm = state['svm']
+
+        return model
+
+    def compress(self, data: Union[pd.DataFrame, np.ndarray], tolerance: float = 0.01, sizes: Optional[List[int]] = None,
+                 random_state: Optional[int] = None) -> pd.DataFrame:
+        """
+        Replaces the trained SVDD by a smaller ReducedSetSVDD whose predictions on data disagree with the original ones on at most a
+        tolerance proportion of the rows, if there is one.
+
+        For each candidate size, the support vectors are clustered with k-means weighted by their dual coefficients, and the weights of the
+        cluster centres (and an offset) are refit by least squares so that their kernel expansion matches the original one on the support
+        vectors and on data. The smallest candidate within tolerance is kept, the original SVDD is kept if none is.
+
+        :param data: DataFrame or Numpy array representing sample data, e.g. the training data or recent transactions
+        :param tolerance: Float representing the maximum proportion of rows of data whose prediction may change.
+        :param sizes: List representing the candidate numbers of vectors, 1/32, 1/16, 1/8, 1/4 and 1/2 of the support vectors if None.
+        :param random_state: Integer representing the seed of k-means.
+        :return: DataFrame with the number of vectors, the agreement with the original predictions, the maximum absolute error of the
+                 decision function relative to its standard deviation on data and the scoring speedup of each candidate
+        """
+        from sklearn.cluster import KMeans
+
+        svm = self.svm
+        if not hasattr(svm, 'support_vectors_'):
+            raise ValueError("compress needs the SVDD trained by fit, which is already compressed or not trained")
+        support_vectors = np.asarray(svm.support_vectors_, dtype=np.float64)
+        dual_coefficients = np.asarray(svm.dual_coef_, dtype=np.float64).ravel()
+        gamma = float(getattr(svm, '_gamma', svm.gamma))
+        num_support_vectors = len(support_vectors)
+        if sizes is None:
+            sizes = [num_support_vectors // divisor for divisor in (32, 16, 8, 4, 2)]
+        sizes = sorted({size for size in sizes if 0 < size < num_support_vectors})
+
+        data = np.asarray(self.select_features(data), dtype=np.float64)
+        start = time.time()
+        original = svm.decision_function(data)
+        original_time = time.time() - start
+        original_predictions = original >= 0
+        scale = original.std() if original.std() > 0 else 1.0
+
+        # the kernel expansion without the intercept is fit on the support vectors and the sample data
+        fit_points = np.vstack([support_vectors, data])
+        target = svm.decision_function(fit_points) - float(svm.intercept_[0])
+
+        report = []
+        best = None
+        for size in sizes:
+            centres = KMeans(n_clusters=size, n_init=1, random_state=random_state).fit(
+                support_vectors, sample_weight=dual_coefficients).cluster_centers_
+            kernel = ReducedSetSVDD.rbf_kernel(fit_points, centres, np.einsum('ij,ij->i', centres, centres), gamma)
+            design = np.hstack([kernel, np.ones((len(fit_points), 1))])
+            solution = np.linalg.lstsq(design, target, rcond=None)[0]
+            candidate = ReducedSetSVDD(centres, solution[:-1], solution[-1] + float(svm.intercept_[0]), gamma)
+
+            start = time.time()
+            approximation = candidate.decision_function(data)
+            candidate_time = time.time() - start
+            agreement = float(np.mean((approximation >= 0) == original_predictions))
+            report.append({'num_vectors': size, 'agreement': agreement, 'max_relative_error': float(np.max(np.abs(approximation - original))) / scale,
+                           'speedup': original_time / max(candidate_time, 1e-9)})
+            if best is None and agreement >= 1 - tolerance:
+                best = candidate
+
+        report.append({'num_vectors': num_support_vectors, 'agreement': 1.0, 'max_relative_error': 0.0, 'speedup': 1.0})
+        if best is not None:
+            print(f"SVDD compressed from {num_support_vectors} to {len(best.vectors)} vectors\n")
+            self.svm = best
+        else:
+            print(f"No compressed SVDD within tolerance {tolerance}, keeping {num_support_vectors} support vectors\n")
+
+        return pd.DataFrame(report)
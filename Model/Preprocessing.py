@@ -0,0 +1,267 @@
+import pickle
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+# formats written by Dataset/models.py Customer.simulate_transactions
+DATETIME_FORMAT = '%m/%d/%Y, %H:%M %p'
+DATE_FORMAT = '%Y-%m-%d'
+
+
+class TransactionPreprocessor:
+    """
+    TransactionPreprocessor object. Turns transactions in the simulated schema (see Dataset/models.py) into numeric features.
+
+    The preprocessor is fitted once, either in one go with fit or chunk by chunk with partial_fit, and then transforms any number of
+    chunks with the vocabularies, hash counts and scaling statistics it holds. A single fitted instance is meant to be shared by all models.
+    """
+
+    LABEL_COLUMN = 'Behaviour ID'
+
+    # low cardinality columns, one-hot encoded over the most frequent values seen during fitting
+    CATEGORICAL_COLUMNS = [
+        'Payment File Format/Channel',
+        'Instruction/Payment Type',
+        'Payment Currency',
+        'Beneficiary Country',
+        'Maker Country Geo-Location',
+    ]
+
+    # high cardinality columns, encoded as the frequency of their hash bucket during fitting
+    HASHED_COLUMNS = [
+        'Ordering Bank (Swift Code or Local Bank Code)',
+        'Client Entity Name',
+        'Beneficiary Account Number',
+        'Beneficiary Bank (Swift Code or Local Bank Code)',
+        'Connexis User ID (Maker)',
+    ]
+
+    # numeric features that are standardised, the remaining numeric features are 0/1 flags
+    CONTINUOUS_FEATURES = [
+        'login_to_creation_hours',
+        'creation_to_authorisation_hours',
+        'authoriser_login_to_authorisation_hours',
+        'authorisation_to_execution_hours',
+        'creation_hour',
+        'authorisation_hour',
+        'log_payment_amount',
+        'remittance_advice_length',
+    ]
+
+    FLAG_FEATURES = [
+        'creation_off_hours',
+        'authorisation_off_hours',
+        'creation_weekend',
+        'modified',
+        'has_intermediary_bank',
+        'cross_border',
+        'maker_is_authoriser',
+    ]
+
+    def __init__(self, num_hash_buckets: int = 2 ** 16, max_categories: int = 50, off_hours: Tuple[int, int] = (22, 7)):
+        """
+        Initialises the TransactionPreprocessor object.
+
+        :param num_hash_buckets: Integer representing the number of buckets values of the hashed columns are counted in.
+        :param max_categories: Integer representing the maximum number of one-hot columns per categorical column. Less frequent values are unknown.
+        :param off_hours: Tuple representing the first hour outside working hours and the first hour back within them (22, 7 for 10pm - 7am).
+        """
+        self.num_hash_buckets = num_hash_buckets
+        self.max_categories = max_categories
+        self.off_hours = off_hours
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Forgets everything learnt by previous calls to fit or partial_fit.
+
+        :return: None
+        """
+        self.num_rows = 0
+        self.category_counts: Dict[str, pd.Series] = {column: pd.Series(dtype=np.int64) for column in self.CATEGORICAL_COLUMNS}
+        self.vocabularies: Dict[str, List[str]] = {column: [] for column in self.CATEGORICAL_COLUMNS}
+        self.hash_counts: Dict[str, np.ndarray] = {column: np.zeros(self.num_hash_buckets, dtype=np.int64) for column in self.HASHED_COLUMNS}
+        # running count, mean and sum of squared deviations of the continuous features, ignoring missing values
+        self.feature_count = np.zeros(len(self.CONTINUOUS_FEATURES))
+        self.feature_mean = np.zeros(len(self.CONTINUOUS_FEATURES))
+        self.feature_m2 = np.zeros(len(self.CONTINUOUS_FEATURES))
+
+    @property
+    def fitted(self) -> bool:
+        return self.num_rows > 0
+
+    @property
+    def feature_names(self) -> List[str]:
+        """
+        Gets the names of the columns returned by transform, in order.
+
+        :return: List of column names
+        """
+        names = self.CONTINUOUS_FEATURES + self.FLAG_FEATURES
+        for column in self.CATEGORICAL_COLUMNS:
+            names = names + [f"{column}={value}" for value in self.vocabularies[column]] + [f"{column}=<unknown>"]
+        names = names + [f"{column} frequency" for column in self.HASHED_COLUMNS]
+
+        return names
+
+    def numeric_features(self, data: pd.DataFrame) -> pd.DataFrame:
+        """
+        Derives the raw (unscaled) continuous features and the flags from the timestamps, amounts and codes of the transactions.
+
+        :param data: DataFrame representing transactions in the simulated schema
+        :return: DataFrame with the CONTINUOUS_FEATURES and FLAG_FEATURES columns
+        """
+        creation = pd.to_datetime(data['Payment Creation Date and Time'], format=DATETIME_FORMAT, errors='coerce')
+        authorisation = pd.to_datetime(data['Payment Authorisation Date and Time'], format=DATETIME_FORMAT, errors='coerce')
+        modification = pd.to_datetime(data['Payment Modification Date and Time'], format=DATETIME_FORMAT, errors='coerce')
+        execution = pd.to_datetime(data['Payment Execution Date'], format=DATE_FORMAT, errors='coerce')
+        maker_login = pd.to_datetime(data['Maker last successful login date/time'], format=DATETIME_FORMAT, errors='coerce')
+        authoriser_login = pd.to_datetime(data['Authoriser last successful login date/time'], format=DATETIME_FORMAT, errors='coerce')
+
+        def hours_between(start: pd.Series, end: pd.Series) -> pd.Series:
+            return (end - start).dt.total_seconds() / 3600
+
+        def is_off_hours(hour: pd.Series) -> pd.Series:
+            start, end = self.off_hours
+            return (hour >= start) | (hour < end)
+
+        features = pd.DataFrame(index=data.index)
+        features['login_to_creation_hours'] = hours_between(maker_login, creation)
+        features['creation_to_authorisation_hours'] = hours_between(creation, authorisation)
+        features['authoriser_login_to_authorisation_hours'] = hours_between(authoriser_login, authorisation)
+        features['authorisation_to_execution_hours'] = hours_between(authorisation, execution)
+        features['creation_hour'] = creation.dt.hour
+        features['authorisation_hour'] = authorisation.dt.hour
+        features['log_payment_amount'] = np.log1p(pd.to_numeric(data['Payment Amount'], errors='coerce'))
+        features['remittance_advice_length'] = data['Remittance Advice'].fillna('').astype(str).str.len()
+
+        features['creation_off_hours'] = is_off_hours(creation.dt.hour)
+        features['authorisation_off_hours'] = is_off_hours(authorisation.dt.hour)
+        features['creation_weekend'] = creation.dt.dayofweek >= 5
+        features['modified'] = modification.notna()
+        features['has_intermediary_bank'] = data['Intermediary Bank Code'].fillna('').astype(str) != ''
+        features['cross_border'] = data['Beneficiary Country'] != data['Maker Country Geo-Location']
+        features['maker_is_authoriser'] = data['Connexis User ID (Maker)'] == data['Connexis User ID (Authoriser)']
+
+        return features.astype(np.float64)
+
+    def hash_buckets(self, values: pd.Series) -> np.ndarray:
+        """
+        Hashes values into buckets. Uses pandas' hashing, which, unlike hash(), is stable across processes and runs.
+
+        :param values: Series representing the values of a hashed column
+        :return: Numpy array representing the bucket of each value
+        """
+        hashes = pd.util.hash_array(values.fillna('').astype(str).to_numpy(dtype=object))
+
+        return (hashes % np.uint64(self.num_hash_buckets)).astype(np.int64)
+
+    def partial_fit(self, data: pd.DataFrame) -> None:
+        """
+        Updates the vocabularies, hash counts and scaling statistics with a chunk of transactions.
+
+        :param data: DataFrame representing a chunk of transactions in the simulated schema
+        :return: None
+        """
+        for column in self.CATEGORICAL_COLUMNS:
+            counts = data[column].fillna('').astype(str).value_counts()
+            self.category_counts[column] = self.category_counts[column].add(counts, fill_value=0).astype(np.int64)
+            vocabulary = self.category_counts[column].sort_values(ascending=False, kind='stable')
+            self.vocabularies[column] = list(vocabulary.index[:self.max_categories])
+
+        for column in self.HASHED_COLUMNS:
+            self.hash_counts[column] += np.bincount(self.hash_buckets(data[column]), minlength=self.num_hash_buckets)
+
+        # merge the chunk's moments into the running ones (Chan et al.)
+        continuous = self.numeric_features(data)[self.CONTINUOUS_FEATURES].to_numpy()
+        chunk_count = np.sum(~np.isnan(continuous), axis=0)
+        present = chunk_count > 0
+        chunk_mean = np.zeros(len(self.CONTINUOUS_FEATURES))
+        chunk_m2 = np.zeros(len(self.CONTINUOUS_FEATURES))
+        chunk_mean[present] = np.nanmean(continuous[:, present], axis=0)
+        chunk_m2[present] = np.nansum((continuous[:, present] - chunk_mean[present]) ** 2, axis=0)
+
+        total_count = self.feature_count + chunk_count
+        delta = chunk_mean - self.feature_mean
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.feature_mean = np.where(total_count > 0, self.feature_mean + delta * chunk_count / total_count, 0)
+            self.feature_m2 = np.where(total_count > 0, self.feature_m2 + chunk_m2 + delta ** 2 * self.feature_count * chunk_count / total_count, 0)
+        self.feature_count = total_count
+        self.num_rows += len(data)
+
+    def fit(self, data: pd.DataFrame) -> None:
+        """
+        Fits the preprocessor on transactions, forgetting any previous fit.
+
+        :param data: DataFrame representing transactions in the simulated schema
+        :return: None
+        """
+        self.reset()
+        self.partial_fit(data)
+
+    def transform(self, data: pd.DataFrame) -> pd.DataFrame:
+        """
+        Transforms a chunk of transactions into features, with the statistics learnt while fitting.
+
+        Continuous features are standardised and missing values are imputed with the training mean (0 once standardised).
+        Categorical columns are one-hot encoded, with an extra column for values outside the vocabulary.
+        Hashed columns are replaced by the training frequency of their bucket, so values never seen in training get a frequency of 0.
+
+        :param data: DataFrame representing a chunk of transactions in the simulated schema
+        :return: DataFrame of float32 features with the feature_names columns
+        """
+        if not self.fitted:
+            raise ValueError("TransactionPreprocessor must be fitted before transform")
+
+        numeric = self.numeric_features(data)
+        std = np.sqrt(self.feature_m2 / np.maximum(self.feature_count, 1))
+        std[std == 0] = 1
+        continuous = (numeric[self.CONTINUOUS_FEATURES].to_numpy() - self.feature_mean) / std
+        blocks = [np.nan_to_num(continuous, nan=0.0), numeric[self.FLAG_FEATURES].to_numpy()]
+
+        for column in self.CATEGORICAL_COLUMNS:
+            vocabulary = self.vocabularies[column]
+            codes = pd.Categorical(data[column].fillna('').astype(str), categories=vocabulary).codes.astype(np.int64)
+            # values outside the vocabulary have code -1, map them to the last column
+            codes[codes < 0] = len(vocabulary)
+            one_hot = np.zeros((len(data), len(vocabulary) + 1))
+            one_hot[np.arange(len(data)), codes] = 1
+            blocks.append(one_hot)
+
+        frequencies = [self.hash_counts[column][self.hash_buckets(data[column])] / self.num_rows for column in self.HASHED_COLUMNS]
+        blocks.append(np.stack(frequencies, axis=1))
+
+        return pd.DataFrame(np.concatenate(blocks, axis=1).astype(np.float32), index=data.index, columns=self.feature_names)
+
+    def fit_transform(self, data: pd.DataFrame) -> pd.DataFrame:
+        """
+        Fits the preprocessor on transactions and transforms them.
+
+        :param data: DataFrame representing transactions in the simulated schema
+        :return: DataFrame of float32 features with the feature_names columns
+        """
+        self.fit(data)
+
+        return self.transform(data)
+
+    def save(self, path: str) -> None:
+        """
+        Persists the fitted preprocessor.
+
+        :param path: String representing the file path
+        :return: None
+        """
+        with open(path, 'wb') as f:
+            pickle.dump(self, f)
+
+    @staticmethod
+    def load(path: str) -> 'TransactionPreprocessor':
+        """
+        Loads a preprocessor persisted with save.
+
+        :param path: String representing the file path
+        :return: TransactionPreprocessor object
+        """
+        with open(path, 'rb') as f:
+            return pickle.load(f)
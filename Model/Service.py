@@ -0,0 +1,354 @@
+"""
+Asyncio scoring service. Single transactions are queued and coalesced into micro-batches, which are scored with the vectorised score and
+predict of a detector (see Ensemble.Detector) in a worker thread, so the event loop keeps accepting requests while a batch is scored.
+
+The service is exposed over a minimal HTTP/1.1 server built on asyncio streams, with no dependency beyond the standard library, e.g.
+
+    python -m Model.Service isolation_forest model.joblib --preprocessor preprocessor.pkl --port 8080
+    python -m Model.Service isolation_forest model.joblib --preprocessor preprocessor.pkl --load-test df_simulated.csv
+
+POST /score takes one transaction as a JSON object and returns {"score": ..., "prediction": ...}, GET /stats returns the latency and
+throughput counters of ScoringStats.
+"""
+import argparse
+import asyncio
+import json
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from Model.Preprocessing import TransactionPreprocessor
+
+
+class ScoringStats:
+    """
+    ScoringStats object. Counts requests and batches and keeps the latencies of the most recent requests to report their percentiles.
+    """
+
+    def __init__(self, window: int = 100000):
+        """
+        Initialises the ScoringStats object.
+
+        :param window: Integer representing the number of most recent latencies kept.
+        """
+        self.latencies = deque(maxlen=window)
+        self.num_requests = 0
+        self.num_batches = 0
+        self.num_errors = 0
+        self.scoring_time = 0.0
+        self.start_time = time.perf_counter()
+
+    def record_batch(self, latencies: List[float], scoring_time: float) -> None:
+        """
+        Records a scored batch.
+
+        :param latencies: List representing the time from arrival to response of each request of the batch, in seconds.
+        :param scoring_time: Float representing the time spent scoring the batch, in seconds.
+        :return: None
+        """
+        self.latencies.extend(latencies)
+        self.num_requests += len(latencies)
+        self.num_batches += 1
+        self.scoring_time += scoring_time
+
+    def to_dict(self) -> dict:
+        """
+        Gets a snapshot of the counters.
+
+        :return: Dict with the request, batch and error counts, the mean batch size, the throughput since the start and the p50 and p99
+                 latencies in milliseconds
+        """
+        elapsed = time.perf_counter() - self.start_time
+        latencies = np.fromiter(self.latencies, dtype=np.float64) * 1000
+        p50, p99 = np.percentile(latencies, [50, 99]) if len(latencies) else (float('nan'), float('nan'))
+
+        return {'requests': self.num_requests, 'batches': self.num_batches, 'errors': self.num_errors,
+                'mean_batch_size': self.num_requests / max(self.num_batches, 1), 'throughput_per_second': self.num_requests / elapsed,
+                'scoring_seconds': self.scoring_time, 'p50_ms': float(p50), 'p99_ms': float(p99)}
+
+
+class ScoringService:
+    """
+    ScoringService object
+
+    Accepts single transactions, coalesces them into micro-batches of at most max_batch_size rows, waiting at most max_wait seconds after the
+    first request of a batch for others to arrive, and scores each batch with one call to the detector.
+    """
+
+    def __init__(self, detector, preprocessor: Optional[TransactionPreprocessor] = None, max_batch_size: int = 256, max_wait: float = 0.005):
+        """
+        Initialises the ScoringService object.
+
+        :param detector: Fitted detector with score and predict methods (see Ensemble.Detector).
+        :param preprocessor: Fitted TransactionPreprocessor turning transactions in the simulated schema into features, None if requests
+                             are feature rows already.
+        :param max_batch_size: Integer representing the maximum number of requests scored together.
+        :param max_wait: Float representing the maximum time in seconds the first request of a batch waits for others.
+        """
+        self.detector = detector
+        self.preprocessor = preprocessor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.stats = ScoringStats()
+        self.queue: Optional[asyncio.Queue] = None
+        self.batcher: Optional[asyncio.Task] = None
+        # requests taken off the queue and not yet resolved, being gathered or scored
+        self.current_batch: List[tuple] = []
+        # a single thread, batches are scored one after the other and the detectors parallelise within a batch
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    async def start(self) -> None:
+        """
+        Starts batching requests, on the running event loop.
+
+        :return: None
+        """
+        self.queue = asyncio.Queue()
+        self.batcher = asyncio.create_task(self.run_batches())
+
+    async def stop(self) -> None:
+        """
+        Stops batching requests. Requests still queued and those of the batch being gathered or scored are cancelled, so no caller is
+        left waiting; a batch already running in the worker thread finishes in the background and its results are dropped.
+
+        :return: None
+        """
+        self.batcher.cancel()
+        try:
+            await self.batcher
+        except asyncio.CancelledError:
+            pass
+        for _, future, _ in self.current_batch:
+            future.cancel()
+        self.current_batch = []
+        while not self.queue.empty():
+            self.queue.get_nowait()[1].cancel()
+        self.executor.shutdown(wait=False)
+
+    async def score(self, transaction: dict) -> Tuple[float, int]:
+        """
+        Scores one transaction, as part of the next micro-batch.
+
+        :param transaction: Dict representing a transaction in the simulated schema, or a feature row if there is no preprocessor
+        :return: Tuple of the anomaly score and the predicted class where 0 is non-fraud and 1 is fraud.
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((transaction, future, time.perf_counter()))
+
+        return await future
+
+    def score_batch(self, transactions: List[dict]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Scores a batch of transactions with the detector, in a worker thread. Detectors exposing the decision_threshold of their predict
+        (see e.g. Models.IsolationForest) run once, their predictions being read off the scores; others are also run through predict.
+
+        :param transactions: List of dicts representing the transactions
+        :return: Tuple of the anomaly scores and the predicted classes
+        """
+        data = pd.DataFrame.from_records(transactions)
+        if self.preprocessor is not None:
+            data = self.preprocessor.transform(data)
+
+        scores = np.asarray(self.detector.score(data))
+        threshold = getattr(self.detector, 'decision_threshold', None)
+        if threshold is None:
+            return scores, np.asarray(self.detector.predict(data))
+
+        return scores, (scores > threshold).astype(int)
+
+    async def run_batches(self) -> None:
+        """
+        Takes requests off the queue batch by batch and resolves their futures, until cancelled.
+
+        :return: None
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            self.current_batch = batch
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            start = time.perf_counter()
+            try:
+                scores, predictions = await loop.run_in_executor(self.executor, self.score_batch, [request[0] for request in batch])
+            except Exception as e:
+                self.stats.num_errors += len(batch)
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            end = time.perf_counter()
+            for (_, future, arrival), score, prediction in zip(batch, scores, predictions):
+                if not future.done():
+                    future.set_result((float(score), int(prediction)))
+            self.stats.record_batch([end - arrival for _, _, arrival in batch], end - start)
+
+
+async def read_request(reader: asyncio.StreamReader) -> Optional[Tuple[str, str, bytes]]:
+    """
+    Reads one HTTP/1.1 request.
+
+    :param reader: StreamReader of the connection
+    :return: Tuple of the method, the path and the body, None if the connection was closed
+    :raises ValueError: if the request line or the Content-Length header is malformed
+    """
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+
+    method, path, _ = request_line.decode('latin-1').split(' ', 2)
+    content_length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.strip().lower() == 'content-length':
+            content_length = int(value.strip())
+    body = await reader.readexactly(content_length) if content_length else b''
+
+    return method, path, body
+
+
+def write_response(writer: asyncio.StreamWriter, status: str, content: dict) -> None:
+    """
+    Writes a JSON HTTP/1.1 response, keeping the connection alive.
+
+    :param writer: StreamWriter of the connection
+    :param status: String representing the status, e.g. '200 OK'
+    :param content: Dict representing the JSON body
+    :return: None
+    """
+    body = json.dumps(content).encode()
+    writer.write(f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+
+
+async def serve(service: ScoringService, host: str = '127.0.0.1', port: int = 8080) -> asyncio.AbstractServer:
+    """
+    Starts the service and an HTTP server in front of it on the running event loop.
+
+    :param service: ScoringService object
+    :param host: String representing the interface to listen on.
+    :param port: Integer representing the port to listen on, 0 for any free port.
+    :return: asyncio Server object
+    """
+    await service.start()
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except ValueError as e:
+                    # malformed request line or Content-Length, the rest of the stream cannot be framed so the connection is closed
+                    write_response(writer, '400 Bad Request', {'error': f"Malformed request: {e}"})
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+                method, path, body = request
+                if method == 'POST' and path == '/score':
+                    try:
+                        score, prediction = await service.score(json.loads(body))
+                        write_response(writer, '200 OK', {'score': score, 'prediction': prediction})
+                    except Exception as e:
+                        write_response(writer, '400 Bad Request', {'error': str(e)})
+                elif method == 'GET' and path == '/stats':
+                    write_response(writer, '200 OK', service.stats.to_dict())
+                else:
+                    write_response(writer, '404 Not Found', {'error': f"No route for {method} {path}"})
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
+
+
+async def load_test(host: str, port: int, transactions: List[dict], concurrency: int = 64) -> dict:
+    """
+    Posts transactions to a running service over concurrency keep-alive connections, each sending its next request once the previous
+    one is answered, and measures the latencies seen by the clients.
+
+    :param host: String representing the host of the service.
+    :param port: Integer representing the port of the service.
+    :param transactions: List of dicts representing the transactions to post
+    :param concurrency: Integer representing the number of concurrent connections.
+    :return: Dict with the number of requests, the throughput and the p50 and p99 client latencies in milliseconds
+    """
+    latencies = []
+
+    async def client(requests: List[dict]) -> None:
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            for transaction in requests:
+                body = json.dumps(transaction).encode()
+                start = time.perf_counter()
+                writer.write(f"POST /score HTTP/1.1\r\nHost: {host}\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+                await writer.drain()
+                await read_request(reader)
+                latencies.append(time.perf_counter() - start)
+        finally:
+            writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(transactions[i::concurrency]) for i in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    p50, p99 = np.percentile(np.array(latencies) * 1000, [50, 99])
+
+    return {'requests': len(latencies), 'throughput_per_second': len(latencies) / elapsed, 'p50_ms': float(p50), 'p99_ms': float(p99)}
+
+
+async def main(args: argparse.Namespace) -> None:
+    from Model.score import load_detector
+
+    preprocessor = TransactionPreprocessor.load(args.preprocessor) if args.preprocessor is not None else None
+    service = ScoringService(load_detector(args.detector, args.model), preprocessor, args.max_batch_size, args.max_wait)
+    server = await serve(service, args.host, args.port)
+    port = server.sockets[0].getsockname()[1]
+
+    async with server:
+        if args.load_test is None:
+            print(f"Serving on {args.host}:{port}")
+            await server.serve_forever()
+        else:
+            transactions = pd.read_csv(args.load_test, nrows=args.requests)
+            if args.label_column is not None:
+                transactions = transactions.drop(args.label_column, axis=1, errors='ignore')
+            # JSON has no NaN, missing values are sent as null
+            transactions = transactions.astype(object).where(transactions.notna(), None).to_dict('records')
+            print(json.dumps(await load_test(args.host, port, transactions, args.concurrency), indent=2))
+            print(json.dumps(service.stats.to_dict(), indent=2))
+        await service.stop()
+
+
+if __name__ == '__main__':
+    from Model.score import DETECTORS
+
+    parser = argparse.ArgumentParser(description="Serves a persisted fraud detector over HTTP, scoring requests in micro-batches.")
+    parser.add_argument('detector', choices=sorted(DETECTORS), help="Type of the persisted detector.")
+    parser.add_argument('model', help="File the detector was saved to.")
+    parser.add_argument('--preprocessor', help="Persisted TransactionPreprocessor, for requests in the simulated transaction schema.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--max-batch-size', type=int, default=256)
+    parser.add_argument('--max-wait', type=float, default=0.005, help="Maximum time in seconds a request waits for a batch to fill.")
+    parser.add_argument('--load-test', help="CSV file of transactions to post to the service instead of serving forever.")
+    parser.add_argument('--label-column', default='Behaviour ID', help="Label column dropped from the load test transactions.")
+    parser.add_argument('--requests', type=int, default=10000, help="Number of load test requests.")
+    parser.add_argument('--concurrency', type=int, default=64, help="Number of concurrent load test connections.")
+    asyncio.run(main(parser.parse_args()))
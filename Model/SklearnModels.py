@@ -1,14 +1,13 @@
-import itertools
-
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 from sklearn.ensemble import IsolationForest
 from sklearn.metrics import classification_report
-from sklearn.metrics import confusion_matrix
-from sklearn.metrics import roc_auc_score
 from sklearn.model_selection import train_test_split
 
+from Model.Cache import ScoringCache
+from Model.Evaluation import confusion_matrices, detection_report, plot_confusion_matrix, summarize_models, threshold_curve
+
 # from sklearn.covariance import EllipticEnvelope
 # from sklearn.neighbors import LocalOutlierFactor
 # from sklearn.svm import OneClassSVM
@@ -105,7 +104,9 @@ model = IsolationForest(n_estimators=10, warm_start=True)
 y_train_pred = model.fit_predict(X_train)
 y_train_pred[y_train_pred == 1] = 0
 y_train_pred[y_train_pred == -1] = 1
-y_test_pred = model.fit_predict(X_test)
+# duplicate rows of the test set are only scored once
+scoring_cache = ScoringCache(model)
+y_test_pred = scoring_cache.predict(X_test)
 y_test_pred[y_test_pred == 1] = 0
 y_test_pred[y_test_pred == -1] = 1
 
@@ -113,48 +114,23 @@ classes = np.array(['0', '1'])
 
 
 # Evaluation
-def plot_confusion_matrix(cm, classes, title='Confusion matrix', cmap=plt.cm.Blues):
-    plt.imshow(cm, interpolation='nearest', cmap=cmap)
-    plt.title(title)
-    plt.colorbar()
-    tick_marks = np.arange(len(classes))
-    plt.xticks(tick_marks, classes, rotation=45)
-    plt.yticks(tick_marks, classes)
-
-    fmt = 'd'
-    thresh = cm.max() / 2.
-    for i, j in itertools.product(range(cm.shape[0]), range(cm.shape[1])):
-        plt.text(j, i, format(cm[i, j], fmt),
-                 horizontalalignment="center",
-                 color="white" if cm[i, j] > thresh else "black")
-
-    plt.tight_layout()
-    plt.ylabel('True label')
-    plt.xlabel('Predicted label')
-    plt.show()
-
-
-cm_train = confusion_matrix(y_train, y_train_pred)
+cm_train = confusion_matrices(y_train_pred, y_train, [0.5])[0]
 plot_confusion_matrix(cm_train, ["Normal", "Fraud"])
 
-cm_test = confusion_matrix(y_test, y_test_pred)
+cm_test = confusion_matrices(y_test_pred, y_test, [0.5])[0]
 plot_confusion_matrix(cm_test, ["Normal", "Fraud"])
 
 # Training
-print(f"Total fraud transactions detected in training: {cm_train[1][1]} / {cm_train[1][1] + cm_train[1][0]}")
-print(f"Total non-fraud transactions detected in training: {cm_train[0][0]} / {cm_train[0][1] + cm_train[0][0]}")
-print(f"Probability to detect a fraud transaction in training: {cm_train[1][1] / (cm_train[1][1] + cm_train[1][0])}")
-print(f"Probability to detect a non-fraud transaction in training: {cm_train[0][0] / (cm_train[0][1] + cm_train[0][0])}")
-print(f"Accuracy of model on the training: {100 * (cm_train[0][0] + cm_train[1][1]) / (sum(cm_train[0]) + sum(cm_train[1]))}")
+print(detection_report(cm_train, "training"))
 
 # Test
-print(f"Total fraud transactions detected in test: {cm_test[1][1]} / {cm_test[1][1] + cm_test[1][0]}")
-print(f"Total non-fraud transactions detected in test: {cm_test[0][0]} / {cm_test[0][1] + cm_test[0][0]}")
-print(f"Probability to detect a fraud transaction in test: {cm_test[1][1] / (cm_test[1][1] + cm_test[1][0])}")
-print(f"Probability to detect a non-fraud transaction in test: {cm_test[0][0] / (cm_test[0][1] + cm_test[0][0])}")
-print(f"Accuracy of model on the test: {100 * (cm_test[0][0] + cm_test[1][1]) / (sum(cm_test[0]) + sum(cm_test[1]))}")
+print(detection_report(cm_test, "test"))
 
 # Classification Report
 # print(classification_report(y_train, y_train_pred))
 print(classification_report(y_test, y_test_pred))
-print(f"AUROC score: {roc_auc_score(y_test, y_test_pred)}")
+print(f"AUROC score: {threshold_curve(y_test_pred, y_test)[1]}")
+
+# Ranking quality of the continuous scores
+print(summarize_models({'IsolationForest': -scoring_cache.call('score_samples', X_test)}, y_test))
+print(f"Scoring cache: {scoring_cache.stats()}")
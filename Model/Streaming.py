@@ -0,0 +1,168 @@
+from typing import Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+
+def read_csv_chunks(path: str, chunksize: int = 100000, usecols: Optional[List[str]] = None, float32: bool = True) -> Iterator[pd.DataFrame]:
+    """
+    Reads a CSV file chunk by chunk, so that only one chunk is held in memory at a time.
+
+    :param path: String representing the CSV file path.
+    :param chunksize: Integer representing the number of rows per chunk.
+    :param usecols: List representing the columns to read, all columns if None.
+    :param float32: Boolean representing whether float64 columns are downcast to float32.
+    :return: Iterator of DataFrames
+    """
+    for chunk in pd.read_csv(path, chunksize=chunksize, usecols=usecols):
+        if float32:
+            float_columns = chunk.select_dtypes(include='float64').columns
+            chunk[float_columns] = chunk[float_columns].astype(np.float32)
+        yield chunk
+
+
+def split_features(chunk: pd.DataFrame, label_column: str, normalize: bool = False) -> Tuple[pd.DataFrame, np.ndarray]:
+    """
+    Splits a chunk into its features and labels, optionally L2-normalising each row as test.py does with preprocessing.normalize.
+    Row normalisation only depends on the row itself, so normalising chunk by chunk gives the same result as normalising the whole file.
+
+    :param chunk: DataFrame representing a chunk of labelled rows.
+    :param label_column: String representing the label column.
+    :param normalize: Boolean representing whether rows are L2-normalised.
+    :return: Tuple of the features DataFrame and the labels
+    """
+    features = chunk.drop(label_column, axis=1)
+    if normalize:
+        features = normalize_rows(features)
+
+    return features, chunk[label_column].to_numpy()
+
+
+def normalize_rows(features: Union[pd.DataFrame, np.ndarray]) -> Union[pd.DataFrame, np.ndarray]:
+    """
+    L2-normalises each row of numeric features, as test.py does with preprocessing.normalize.
+
+    :param features: DataFrame or Numpy array representing numeric features
+    :return: DataFrame or Numpy array of float32 normalised features, of the same type as features
+    """
+    from sklearn import preprocessing
+
+    normalized = preprocessing.normalize(features).astype(np.float32)
+    if isinstance(features, pd.DataFrame):
+        return pd.DataFrame(normalized, index=features.index, columns=features.columns)
+
+    return normalized
+
+
+class ReservoirSampler:
+    """
+    ReservoirSampler object
+
+    Keeps a uniform random sample of fixed size of all the rows added to it (reservoir sampling, algorithm R), whatever their number,
+    with chunks of rows processed in vectorised form.
+    """
+
+    def __init__(self, size: int, random_state: Optional[int] = None):
+        """
+        Initialises the ReservoirSampler object.
+
+        :param size: Integer representing the number of rows kept.
+        :param random_state: Integer representing the seed of the sampling.
+        """
+        self.size = size
+        self.rng = np.random.default_rng(random_state)
+        self.reservoir = None
+        self.columns = None
+        self.num_seen = 0
+
+    def add(self, rows: pd.DataFrame) -> None:
+        """
+        Offers a chunk of rows to the reservoir.
+
+        :param rows: DataFrame representing the rows
+        :return: None
+        """
+        values = rows.to_numpy()
+        if self.reservoir is None:
+            self.reservoir = np.empty((self.size, values.shape[1]), dtype=values.dtype)
+            self.columns = rows.columns
+
+        # fill the reservoir first
+        num_filled = min(self.num_seen, self.size)
+        num_fill = min(self.size - num_filled, len(values))
+        self.reservoir[num_filled:num_filled + num_fill] = values[:num_fill]
+
+        # then the ith row seen replaces a random slot with probability size / i
+        remaining = values[num_fill:]
+        positions = self.num_seen + num_fill + np.arange(1, len(remaining) + 1)
+        slots = (self.rng.random(len(remaining)) * positions).astype(np.int64)
+        replaced = slots < self.size
+        # numpy assigns repeated slots in order, so later rows win as in the sequential algorithm
+        self.reservoir[slots[replaced]] = remaining[replaced]
+        self.num_seen += len(values)
+
+    @property
+    def sample(self) -> pd.DataFrame:
+        """
+        Gets the rows sampled so far.
+
+        :return: DataFrame of at most size rows
+        """
+        if self.reservoir is None:
+            return pd.DataFrame()
+
+        return pd.DataFrame(self.reservoir[:min(self.num_seen, self.size)], columns=self.columns)
+
+
+def sample_csv(path: str, label_column: str, size: int, label_value: Optional[int] = 0, normalize: bool = False, chunksize: int = 100000,
+               usecols: Optional[List[str]] = None, random_state: Optional[int] = None) -> pd.DataFrame:
+    """
+    Draws a uniform random sample of the feature rows of a CSV file in one streaming pass, e.g. non-fraud rows to train a detector on.
+
+    :param path: String representing the CSV file path.
+    :param label_column: String representing the label column.
+    :param size: Integer representing the number of rows to sample.
+    :param label_value: Label of the rows to sample from, all rows if None.
+    :param normalize: Boolean representing whether rows are L2-normalised (see split_features).
+    :param chunksize: Integer representing the number of rows read at once.
+    :param usecols: List representing the columns to read (the label column is added), all columns if None.
+    :param random_state: Integer representing the seed of the sampling.
+    :return: DataFrame representing the sampled feature rows
+    """
+    if usecols is not None and label_column not in usecols:
+        usecols = usecols + [label_column]
+
+    sampler = ReservoirSampler(size, random_state)
+    for chunk in read_csv_chunks(path, chunksize, usecols):
+        features, labels = split_features(chunk, label_column, normalize)
+        if label_value is not None:
+            features = features[labels == label_value]
+        sampler.add(features)
+
+    return sampler.sample
+
+
+def predict_csv(detector, path: str, label_column: str, normalize: bool = False, chunksize: int = 100000,
+                usecols: Optional[List[str]] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Predicts every row of a CSV file with a fitted detector, one chunk at a time, keeping only the labels and the predictions.
+
+    :param detector: Fitted detector with a predict method (see Ensemble.Detector).
+    :param path: String representing the CSV file path.
+    :param label_column: String representing the label column.
+    :param normalize: Boolean representing whether rows are L2-normalised (see split_features).
+    :param chunksize: Integer representing the number of rows read at once.
+    :param usecols: List representing the columns to read (the label column is added), all columns if None.
+    :return: Tuple of the true labels and the predicted classes
+    """
+    if usecols is not None and label_column not in usecols:
+        usecols = usecols + [label_column]
+
+    all_labels = []
+    all_predictions = []
+    for chunk in read_csv_chunks(path, chunksize, usecols):
+        features, labels = split_features(chunk, label_column, normalize)
+        all_labels.append(labels)
+        all_predictions.append(np.asarray(detector.predict(features)))
+
+    return np.concatenate(all_labels), np.concatenate(all_predictions)
@@ -0,0 +1,318 @@
+import math
+import pickle
+from collections import deque
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from Model.Preprocessing import DATETIME_FORMAT
+from Model.Streaming import read_csv_chunks
+
+EPOCH = pd.Timestamp('1970-01-01')
+EPOCH_DATETIME = EPOCH.to_pydatetime()
+
+
+class WindowState:
+    """
+    WindowState object. Payments of one entity within a sliding time window, kept in a ring buffer (deque) together with their running
+    count, sum and a histogram of their amounts, so adding a payment and evicting expired ones costs O(1) amortised.
+    """
+
+    __slots__ = ('length', 'events', 'total', 'histogram')
+
+    def __init__(self, length: float, num_bins: int):
+        """
+        Initialises the WindowState object.
+
+        :param length: Float representing the length of the window in seconds.
+        :param num_bins: Integer representing the number of amount histogram bins.
+        """
+        self.length = length
+        self.events = deque()
+        self.total = 0.0
+        self.histogram = [0] * num_bins
+
+    def add(self, timestamp: float, amount: float, amount_bin: int) -> None:
+        """
+        Adds a payment, then evicts the payments outside the window ending at its timestamp, i.e. at or before timestamp - length.
+
+        :param timestamp: Float representing the payment time in seconds since the epoch.
+        :param amount: Float representing the payment amount.
+        :param amount_bin: Integer representing the histogram bin of the amount.
+        :return: None
+        """
+        self.events.append((timestamp, amount, amount_bin))
+        self.total += amount
+        self.histogram[amount_bin] += 1
+        self.evict(timestamp)
+
+    def evict(self, now: float) -> None:
+        """
+        Evicts the payments at or before now - length.
+
+        :param now: Float representing the current time in seconds since the epoch.
+        :return: None
+        """
+        events = self.events
+        while events and events[0][0] <= now - self.length:
+            _, amount, amount_bin = events.popleft()
+            self.total -= amount
+            self.histogram[amount_bin] -= 1
+        if not events:
+            # reset the running sum, so floating point errors do not accumulate
+            self.total = 0.0
+
+    def bin_quantile(self, q: float) -> int:
+        """
+        Gets the histogram bin holding the q quantile of the amounts in the window.
+
+        :param q: Float representing the quantile, between 0 and 1.
+        :return: Integer representing the bin, -1 if the window is empty
+        """
+        rank = q * (len(self.events) - 1)
+        seen = 0
+        for amount_bin, count in enumerate(self.histogram):
+            seen += count
+            if seen > rank:
+                return amount_bin
+
+        return -1
+
+
+class VelocityFeatures:
+    """
+    VelocityFeatures object
+
+    Maintains, for every maker, client and beneficiary, the number, total and amount quantiles of their payments over sliding time windows
+    (e.g. behaviour 1 of Dataset/models.py, many small payments, only shows in such aggregates). The state is updated incrementally, one
+    transaction at a time with update or chunk by chunk with transform, so the same object serves batch scoring over a time-sorted file
+    and online scoring. The features of a transaction include the transaction itself.
+
+    Amount quantiles are read off a histogram of log amounts with bins_per_octave bins per doubling, i.e. within a factor of
+    2 ** (1 / bins_per_octave) of the exact quantile.
+    """
+
+    ENTITY_COLUMNS = {
+        'maker': 'Connexis User ID (Maker)',
+        'client': 'Client Entity Name',
+        'beneficiary': 'Beneficiary Account Number',
+    }
+
+    TIME_COLUMN = 'Payment Creation Date and Time'
+    AMOUNT_COLUMN = 'Payment Amount'
+
+    def __init__(self, windows: Optional[Dict[str, float]] = None, quantiles: Sequence[float] = (0.5,), bins_per_octave: int = 2,
+                 max_amount: float = 2.0 ** 32):
+        """
+        Initialises the VelocityFeatures object.
+
+        :param windows: Dict representing the length of each window in seconds by name, 1 day, 30 days and 365 days if None.
+        :param quantiles: List representing the amount quantiles computed for each window.
+        :param bins_per_octave: Integer representing the number of amount histogram bins per doubling of the amount.
+        :param max_amount: Float representing the amount above which amounts fall into the last bin.
+        """
+        self.windows = windows if windows is not None else {'1d': 86400.0, '30d': 30 * 86400.0, '365d': 365 * 86400.0}
+        self.quantiles = list(quantiles)
+        self.bins_per_octave = bins_per_octave
+        self.num_bins = int(np.ceil(np.log2(1 + max_amount) * bins_per_octave)) + 1
+        # edges of the bins of 1 + amount, bin b holds amounts a with b <= bins_per_octave * log2(1 + a) < b + 1
+        bin_edges = 2.0 ** (np.arange(self.num_bins + 1) / bins_per_octave)
+        # a quantile falling in a bin is reported as the geometric midpoint of the bin
+        self.bin_values = list(np.sqrt(bin_edges[:-1] * bin_edges[1:]) - 1)
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Forgets all the transactions seen so far.
+
+        :return: None
+        """
+        self.states: Dict[str, Dict[str, List[WindowState]]] = {entity: {} for entity in self.ENTITY_COLUMNS}
+
+    @property
+    def feature_names(self) -> List[str]:
+        """
+        Gets the names of the columns returned by transform, in order.
+
+        :return: List of column names
+        """
+        statistics = ['count', 'sum'] + [f"q{round(q * 100)}" for q in self.quantiles]
+
+        return [f"{entity}_{window}_{statistic}" for entity in self.ENTITY_COLUMNS for window in self.windows for statistic in statistics]
+
+    def amount_bins(self, amounts: np.ndarray) -> np.ndarray:
+        """
+        Gets the histogram bin of each amount.
+
+        :param amounts: Numpy array representing non-negative amounts
+        :return: Numpy array of bins
+        """
+        bins = np.floor(np.log2(1 + np.maximum(amounts, 0)) * self.bins_per_octave)
+
+        return np.clip(bins, 0, self.num_bins - 1).astype(np.int64)
+
+    def update_entities(self, keys: Sequence[str], timestamp: float, amount: float, amount_bin: int) -> List[float]:
+        """
+        Adds a payment to the windows of its entities and reads their features.
+
+        :param keys: List representing the maker, client and beneficiary of the payment, in ENTITY_COLUMNS order.
+        :param timestamp: Float representing the payment time in seconds since the epoch.
+        :param amount: Float representing the payment amount.
+        :param amount_bin: Integer representing the histogram bin of the amount.
+        :return: List of features in feature_names order
+        """
+        features = []
+        for entity, key in zip(self.ENTITY_COLUMNS, keys):
+            windows = self.states[entity].get(key)
+            if windows is None:
+                windows = [WindowState(length, self.num_bins) for length in self.windows.values()]
+                self.states[entity][key] = windows
+            for window in windows:
+                window.add(timestamp, amount, amount_bin)
+                features.append(len(window.events))
+                features.append(window.total)
+                for q in self.quantiles:
+                    quantile_bin = window.bin_quantile(q)
+                    features.append(self.bin_values[quantile_bin] if quantile_bin >= 0 else 0.0)
+
+        return features
+
+    def parse(self, data: pd.DataFrame):
+        """
+        Extracts the timestamps, amounts, amount bins and entity keys of transactions.
+
+        :param data: DataFrame representing transactions in the simulated schema
+        :return: Tuple of the timestamps in seconds since the epoch (NaN if missing), the amounts, their bins and the entity keys
+        """
+        times = pd.to_datetime(data[self.TIME_COLUMN], format=DATETIME_FORMAT, errors='coerce')
+        timestamps = ((times - EPOCH).dt.total_seconds()).to_numpy(dtype=np.float64)
+        amounts = pd.to_numeric(data[self.AMOUNT_COLUMN], errors='coerce').fillna(0).to_numpy(dtype=np.float64)
+        keys = [data[column].fillna('').astype(str).to_numpy(dtype=object) for column in self.ENTITY_COLUMNS.values()]
+
+        return timestamps, amounts, self.amount_bins(amounts), keys
+
+    def transform(self, data: pd.DataFrame) -> pd.DataFrame:
+        """
+        Adds a chunk of transactions to the state, in time order, and gets their features.
+
+        Chunks must be passed in time order (e.g. chunks of a file sorted by creation time), within a chunk the rows may be in any order.
+        Rows with a missing creation time are not added and get 0 features.
+
+        :param data: DataFrame representing a chunk of transactions in the simulated schema
+        :return: DataFrame of float32 features with the feature_names columns, in the row order of data
+        """
+        timestamps, amounts, amount_bins, keys = self.parse(data)
+        features = np.zeros((len(data), len(self.feature_names)), dtype=np.float32)
+
+        # NaN timestamps are sorted last
+        order = np.argsort(timestamps, kind='stable')
+        for i in order[:np.count_nonzero(~np.isnan(timestamps))]:
+            features[i] = self.update_entities([entity_keys[i] for entity_keys in keys], timestamps[i], amounts[i], amount_bins[i])
+
+        return pd.DataFrame(features, index=data.index, columns=self.feature_names)
+
+    def amount_bin(self, amount: float) -> int:
+        """
+        Gets the histogram bin of one amount, the scalar form of amount_bins.
+
+        :param amount: Float representing the amount
+        :return: Integer representing the bin
+        """
+        amount_bin = math.floor(math.log2(1 + max(amount, 0.0)) * self.bins_per_octave)
+
+        return min(max(amount_bin, 0), self.num_bins - 1)
+
+    def parse_one(self, transaction: dict):
+        """
+        Extracts the timestamp, amount, amount bin and entity keys of one transaction, as parse does for a DataFrame.
+
+        :param transaction: Dict representing a transaction in the simulated schema
+        :return: Tuple of the timestamp in seconds since the epoch (NaN if missing), the amount, its bin and the entity keys
+        """
+        time = transaction.get(self.TIME_COLUMN)
+        try:
+            if isinstance(time, str):
+                time = datetime.strptime(time, DATETIME_FORMAT)
+            timestamp = (time - EPOCH_DATETIME).total_seconds() if isinstance(time, datetime) else float('nan')
+        except ValueError:
+            timestamp = float('nan')
+
+        try:
+            amount = float(transaction.get(self.AMOUNT_COLUMN))
+        except (TypeError, ValueError):
+            amount = 0.0
+        if math.isnan(amount):
+            amount = 0.0
+
+        keys = []
+        for column in self.ENTITY_COLUMNS.values():
+            key = transaction.get(column)
+            keys.append('' if key is None or (isinstance(key, float) and math.isnan(key)) else str(key))
+
+        return timestamp, amount, self.amount_bin(amount), keys
+
+    def update(self, transaction: dict) -> Dict[str, float]:
+        """
+        Adds a single transaction to the state and gets its features, for online scoring, in O(1) amortised time: the transaction is
+        read from the dict directly, without building a DataFrame. A transaction with a missing creation time is not added and gets 0
+        features, as in transform.
+
+        :param transaction: Dict representing a transaction in the simulated schema
+        :return: Dict representing the features by name
+        """
+        timestamp, amount, amount_bin, keys = self.parse_one(transaction)
+        if math.isnan(timestamp):
+            return dict.fromkeys(self.feature_names, 0.0)
+
+        # rounded to float32, as the columns of transform
+        features = np.asarray(self.update_entities(keys, timestamp, amount, amount_bin), dtype=np.float32).tolist()
+
+        return dict(zip(self.feature_names, features))
+
+    def transform_csv(self, path: str, chunksize: int = 100000) -> Iterator[pd.DataFrame]:
+        """
+        Gets the features of every transaction of a CSV file sorted by creation time, chunk by chunk.
+
+        :param path: String representing the CSV file path.
+        :param chunksize: Integer representing the number of rows read at once.
+        :return: Iterator of feature DataFrames
+        """
+        for chunk in read_csv_chunks(path, chunksize, float32=False):
+            yield self.transform(chunk)
+
+    def prune(self, now: float) -> None:
+        """
+        Evicts the payments outside the windows ending at now and forgets the entities left without payments, bounding the state size.
+
+        :param now: Float representing the current time in seconds since the epoch.
+        :return: None
+        """
+        for entity, states in self.states.items():
+            for key in list(states):
+                for window in states[key]:
+                    window.evict(now)
+                if all(not window.events for window in states[key]):
+                    del states[key]
+
+    def save(self, path: str) -> None:
+        """
+        Persists the state.
+
+        :param path: String representing the file path
+        :return: None
+        """
+        with open(path, 'wb') as f:
+            pickle.dump(self, f)
+
+    @staticmethod
+    def load(path: str) -> 'VelocityFeatures':
+        """
+        Loads a state persisted with save.
+
+        :param path: String representing the file path
+        :return: VelocityFeatures object
+        """
+        with open(path, 'rb') as f:
+            return pickle.load(f)
@@ -0,0 +1,112 @@
+"""
+Scores a file of transactions with a persisted detector, e.g.
+
+    python -m Model.score isolation_forest model.joblib transactions.csv scores.csv --preprocessor preprocessor.pkl
+
+The entry point only imports the module of the chosen detector (sklearn, joblib or tensorflow are not imported unless that detector needs
+them) and reports its startup time, i.e. imports and model loading, separately from the scoring time.
+"""
+import argparse
+import importlib
+import sys
+import time
+
+# module and class of each persisted detector, loaded with its load classmethod
+DETECTORS = {
+    'autoencoder': ('Model.Models', 'AutoEncoder'),
+    'isolation_forest': ('Model.Models', 'IsolationForest'),
+    'lof': ('Model.Models', 'LocalOutlierFactor'),
+    'svdd': ('Model.OneClassSVM', 'AnomalyDetection'),
+}
+
+
+def load_detector(name: str, path: str):
+    """
+    Imports the module of a detector and loads it from its persisted file.
+
+    :param name: String representing the detector, a key of DETECTORS.
+    :param path: String representing the file the detector was saved to.
+    :return: Fitted detector with score and predict methods (see Ensemble.Detector)
+    """
+    module_name, class_name = DETECTORS[name]
+
+    return getattr(importlib.import_module(module_name), class_name).load(path)
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Scores transactions with a persisted fraud detector.")
+    parser.add_argument('detector', choices=sorted(DETECTORS), help="Type of the persisted detector.")
+    parser.add_argument('model', help="File the detector was saved to.")
+    parser.add_argument('input', help="CSV file of transactions or features, or .npy file of features.")
+    parser.add_argument('output', help="CSV file the scores and predictions are written to.")
+    parser.add_argument('--preprocessor', help="Persisted TransactionPreprocessor, for input in the simulated transaction schema.")
+    parser.add_argument('--label-column', help="Label column of the input, dropped before scoring and copied to the output.")
+    parser.add_argument('--normalize', action='store_true', help="L2-normalise feature rows, after the preprocessor if any, as test.py does.")
+    parser.add_argument('--chunksize', type=int, default=100000, help="Number of rows read and scored at once.")
+
+    args = parser.parse_args(argv)
+    if args.input.endswith('.npy') and args.preprocessor is not None:
+        parser.error("--preprocessor needs CSV input in the simulated transaction schema, a .npy file already holds features")
+    if args.input.endswith('.npy') and args.label_column is not None:
+        parser.error("--label-column needs CSV input, a .npy file has no column names")
+
+    return args
+
+
+def main(argv=None) -> None:
+    start = time.perf_counter()
+    args = parse_args(argv)
+
+    import numpy as np
+    import pandas as pd
+
+    from Model.Streaming import normalize_rows, read_csv_chunks
+
+    detector = load_detector(args.detector, args.model)
+    preprocessor = None
+    if args.preprocessor is not None:
+        from Model.Preprocessing import TransactionPreprocessor
+
+        preprocessor = TransactionPreprocessor.load(args.preprocessor)
+    startup_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    def raw_chunks():
+        if args.input.endswith('.npy'):
+            # memory-mapped, so only the pages being scored are read
+            features = np.load(args.input, mmap_mode='r')
+            for chunk_start in range(0, len(features), args.chunksize):
+                yield features[chunk_start:chunk_start + args.chunksize], None
+        else:
+            for chunk in read_csv_chunks(args.input, args.chunksize):
+                if args.label_column is not None:
+                    yield chunk.drop(args.label_column, axis=1), chunk[args.label_column].to_numpy()
+                else:
+                    yield chunk, None
+
+    # predictions are read off the scores when the detector exposes the threshold of its predict, as in Service.score_batch
+    threshold = getattr(detector, 'decision_threshold', None)
+    num_rows = 0
+    header = True
+    for features, labels in raw_chunks():
+        # the preprocessor reads the raw schema columns, so rows are normalised after it
+        if preprocessor is not None:
+            features = preprocessor.transform(features)
+        if args.normalize:
+            features = normalize_rows(features)
+        scores = np.asarray(detector.score(features))
+        predictions = (scores > threshold).astype(int) if threshold is not None else np.asarray(detector.predict(features))
+        output = pd.DataFrame({'score': scores, 'prediction': predictions})
+        if labels is not None:
+            output[args.label_column] = labels
+        output.to_csv(args.output, mode='w' if header else 'a', header=header, index=False)
+        header = False
+        num_rows += len(output)
+    scoring_time = time.perf_counter() - start
+
+    print(f"Startup (imports and model loading): {startup_time:.3f}s", file=sys.stderr)
+    print(f"Scored {num_rows} rows in {scoring_time:.3f}s", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,49 +1,52 @@
 import numpy as np
-import pandas as pd
-from sklearn import preprocessing
 from sklearn.metrics import classification_report
 
+from Model.Cache import ScoringCache
+from Model.Coreset import CoresetSampler
+from Model.FeatureStore import FeatureStore, csv_feature_chunks
 from Model.OneClassSVM import AnomalyDetection
 
-# Pre-processing data into fraud and non-fraud
-df = pd.read_csv('Model/creditcard.csv')
-df_features = df.iloc[:, :-1]
-df_normalized = pd.DataFrame(preprocessing.normalize(df_features))
-df_normalized['Class'] = df['Class']
-
-df_nonfraud = df_normalized.loc[df['Class'] == 0]
-df_fraud = df_normalized.loc[df['Class'] == 1]
-
-# setting train and test data
-df_features_nonfraud = df_nonfraud.iloc[:, :-1]
-df_features_fraud = df_fraud.iloc[:, :-1]
-df_features_all = df_normalized.iloc[:, : -1]
-
+# normalized features are built once and memory-mapped from the feature store on later runs
 # test set will contain all data
 # training set will only contain non-fraud data
 # no y_train as all training data assumed to be non-fraud
-X_test = df_features_all
-y_test = df['Class']
-
-X_train = df_features_nonfraud
-print(f"Original number of non-fraud: {df_nonfraud.shape[0]}")
-print(f"Original number of fraud: {df_fraud.shape[0]}")
-print(X_train.shape)
+data_path = 'Model/creditcard.csv'
+label_column = 'Class'
 
 # preparing train and test data
 no_of_samples = 5000
 # no_of_samples = len(df)
 feature_columns = [1, 3]
-# selected number of train data for training
-X_train_selected = X_train[:no_of_samples]
+# the data is time-ordered, the training rows are spread over this many periods of equal length
+no_of_periods = 10
+chunk_size = 100000
 
 if __name__ == "__main__":
+    feature_set = FeatureStore().load_or_build(data_path, csv_feature_chunks, label_column=label_column, normalize=True)
+    X_test = feature_set.features
+    y_test = feature_set.labels
+
+    nonfraud_indices = np.flatnonzero(y_test == 0)
+    print(f"Original number of non-fraud: {len(nonfraud_indices)}")
+    print(f"Original number of fraud: {len(y_test) - len(nonfraud_indices)}")
+
+    # selected number of train data for training, a sample of the non-fraud rows selected in one pass over the file and stratified over
+    # time. AnomalyDetection.fit takes no sample weights, so rows are sampled uniformly (see CoresetSampler)
+    sampler = CoresetSampler(no_of_samples, stratum_width=int(np.ceil(len(y_test) / no_of_periods)), weighting='uniform', random_state=0)
+    for start in range(0, len(nonfraud_indices), chunk_size):
+        indices = nonfraud_indices[start:start + chunk_size]
+        sampler.add(X_test[indices], times=indices)
+    X_train_selected = sampler.sample
+    print(X_train_selected.shape)
+
     # training and prediction
     AD = AnomalyDetection()
     AD.fit(X_train_selected, feature_columns)
 
-    # evaluation using test data
-    y_pred = AD.predict(X_test, feature_columns)
+    # evaluation using test data, rows with the same values in the columns the model reads are only predicted once
+    scoring_cache = ScoringCache(AD, columns=slice(*AD.get_trained_features()))
+    y_pred = scoring_cache.predict(X_test)
+    print(f"Scoring cache: {scoring_cache.stats()}\n")
 
     print(f"Number of non-fraud detected: {len(np.where(y_pred == 0)[0])}")
     print(f"Number of fraud detected: {len(np.where(y_pred == 1)[0])}\n")